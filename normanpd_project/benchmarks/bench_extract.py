@@ -0,0 +1,60 @@
+"""
+Report `extractincidents` throughput in pages/sec as the worker count increases.
+
+The shipped daily summary is repeated `--copies` times to build a long document.
+
+Usage (from the project root):
+    python -m benchmarks.bench_extract --copies 4 --workers 1 2 4 8
+"""
+import argparse
+import io
+import os
+import time
+
+from pypdf import PdfReader, PdfWriter
+
+from scripts.project0 import extractincidents
+
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'scripts', 'resources', 'DailyIncidentSummary.pdf')
+
+
+def build_pdf(copies):
+    """
+    Return the bytes of a PDF holding the sample summary's pages `copies` times.
+    """
+    reader = PdfReader(SAMPLE_PDF)
+    writer = PdfWriter()
+    for _ in range(copies):
+        for page in reader.pages:
+            writer.add_page(page)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def main(copies, worker_counts):
+    incident_data = build_pdf(copies)
+    page_count = len(PdfReader(io.BytesIO(incident_data)).pages)
+    print(f"{page_count} pages, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'seconds':>9} {'pages/sec':>10} {'rows':>7} {'matches serial':>15}")
+
+    serial = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        rows = extractincidents(incident_data, workers=workers)
+        elapsed = time.perf_counter() - start
+        if serial is None:
+            serial = extractincidents(incident_data) if workers > 1 else rows
+        print(f"{workers:>8} {elapsed:>9.3f} {page_count / elapsed:>10.1f} {len(rows):>7} {str(rows == serial):>15}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--copies", type=int, default=4, help="Times the sample summary is repeated.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Worker counts to benchmark.")
+
+    args = parser.parse_args()
+    main(args.copies, args.workers)
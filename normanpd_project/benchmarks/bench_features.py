@@ -0,0 +1,52 @@
+"""
+Compare peak memory and time of the dense and sparse `preprocess_features` paths.
+
+Usage (from the project root):
+    python -m benchmarks.bench_features --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import create_database
+from scripts.clustering import preprocess_features
+
+
+def measure(db_path, sparse):
+    """
+    Return (seconds, peak bytes, encoded width) for one preprocessing run.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    _, numeric, _ = preprocess_features(db_path, sparse=sparse)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, numeric.shape[1]
+
+
+def main(sizes, max_dense_rows):
+    print(f"{'rows':>8} {'mode':>6} {'width':>8} {'seconds':>9} {'peak MiB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            db_path = create_database(os.path.join(tmp, f"bench_{size}.db"), size)
+            for sparse in (False, True):
+                mode = 'sparse' if sparse else 'dense'
+                if not sparse and size > max_dense_rows:
+                    print(f"{size:>8} {mode:>6} {'-':>8} {'skipped (--max-dense-rows)':>20}")
+                    continue
+                elapsed, peak, width = measure(db_path, sparse)
+                print(f"{size:>8} {mode:>6} {width:>8} {elapsed:>9.3f} {peak / 2 ** 20:>10.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Incident counts to benchmark.")
+    parser.add_argument("--max-dense-rows", type=int, default=10000,
+                        help="Skip the dense path above this many rows; it needs rows x rows memory.")
+
+    args = parser.parse_args()
+    main(args.sizes, args.max_dense_rows)
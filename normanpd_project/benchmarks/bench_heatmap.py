@@ -0,0 +1,81 @@
+"""
+Time the hour x location heatmap against the number of distinct locations.
+
+  * all: every distinct location as a `sns.heatmap` column with cell borders, as the heatmap used to be drawn
+  * top-N: SQL aggregation, the `--top-n` busiest locations plus "Other", drawn with `imshow`
+  * street: the same after bucketing addresses by street
+
+Usage (from the project root):
+    python -m benchmarks.bench_heatmap --sizes 1000 10000 50000
+"""
+import argparse
+import io
+import os
+import sqlite3
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import pandas as pd
+import seaborn as sns
+import django
+from django.conf import settings
+
+from benchmarks.synthetic import create_database
+from scripts.clustering import generate_heatmap
+
+
+def draw_all(db_path):
+    """
+    The previous heatmap: pandas unstack of every location and a patch per cell.
+    """
+    with sqlite3.connect(db_path) as conn:
+        df = pd.read_sql_query("SELECT incident_hour AS hour, incident_location FROM incidents", conn)
+    heatmap_data = df.groupby(['hour', 'incident_location']).size().unstack(fill_value=0)
+    plt.figure(figsize=(12, 8))
+    sns.heatmap(heatmap_data, cmap='coolwarm', linewidths=0.5, cbar=True)
+    plt.tight_layout()
+    plt.savefig(io.BytesIO(), format='png')
+    plt.close()
+    return heatmap_data.shape[1]
+
+
+def timed(function, *args, **kwargs):
+    """
+    Return the seconds one call takes.
+    """
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main(sizes, top_n, max_all_rows):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "normanpd_project.settings")
+    django.setup()
+
+    print(f"{'rows':>7} {'locations':>10} {'all s':>8} {'top-N s':>8} {'street s':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.MEDIA_ROOT = os.path.join(tmp, 'media')
+        os.makedirs(settings.MEDIA_ROOT)
+        for size in sizes:
+            db_path = create_database(os.path.join(tmp, f"bench_{size}.db"), size)
+            with sqlite3.connect(db_path) as conn:
+                locations = conn.execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+            all_column = f"{timed(draw_all, db_path):>8.2f}" if size <= max_all_rows else f"{'-':>8}"
+            top = timed(generate_heatmap, db_path, top_n=top_n)
+            street = timed(generate_heatmap, db_path, top_n=top_n, bucket='street')
+            print(f"{size:>7} {locations:>10} {all_column} {top:>8.2f} {street:>9.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000],
+                        help="Incident counts to benchmark; nearly every incident has its own address.")
+    parser.add_argument("--top-n", type=int, default=30, help="Location columns kept by the new heatmap.")
+    parser.add_argument("--max-all-rows", type=int, default=5000,
+                        help="Skip the old every-location heatmap above this many rows.")
+
+    args = parser.parse_args()
+    main(args.sizes, args.top_n, args.max_all_rows)
@@ -0,0 +1,94 @@
+"""
+Compare ingest latency of the old subprocess call to `main.py` with the in-process ingest API.
+
+  * subprocess: a fresh interpreter per request, as `upload_files` used to do
+  * cold: the first in-process call in a fresh interpreter, including imports
+  * warm: later in-process calls in an interpreter that already imported everything
+
+Usage (from the project root):
+    python -m benchmarks.bench_ingest_latency --requests 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from scripts.ingest import ingest
+
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_PDF = os.path.join(PROJECT_ROOT, 'scripts', 'resources', 'DailyIncidentSummary.pdf')
+
+COLD_SNIPPET = """
+import time
+start = time.perf_counter()
+from scripts.ingest import ingest
+ingest({source!r}, db_path={db_path!r})
+print(time.perf_counter() - start)
+"""
+
+
+def subprocess_latency():
+    """
+    Time one `main.py --incidents` run in a new interpreter, in an empty working
+    directory so it neither touches the real database nor hits the parse cache.
+    """
+    with tempfile.TemporaryDirectory() as cwd:
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.join(PROJECT_ROOT, 'scripts', 'main.py'), '--incidents', SAMPLE_PDF],
+            cwd=cwd,
+            capture_output=True,
+            check=True,
+        )
+        return time.perf_counter() - start
+
+
+def cold_latency(db_path):
+    """
+    Time imports plus the first in-process ingest in a new interpreter.
+    """
+    output = subprocess.run(
+        [sys.executable, '-c', COLD_SNIPPET.format(source=SAMPLE_PDF, db_path=db_path)],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def warm_latency(db_path):
+    """
+    Time one in-process ingest in this (already warm) interpreter.
+    """
+    start = time.perf_counter()
+    ingest(SAMPLE_PDF, db_path=db_path)
+    return time.perf_counter() - start
+
+
+def main(requests):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'normanpd.db')
+        warm_latency(db_path)
+        results = {
+            'subprocess': [subprocess_latency() for _ in range(requests)],
+            'cold': [cold_latency(db_path) for _ in range(requests)],
+            'warm': [warm_latency(db_path) for _ in range(requests)],
+        }
+
+    print(f"{'path':>10} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+    for path, latencies in results.items():
+        print(f"{path:>10} {statistics.median(latencies) * 1000:>10.0f} "
+              f"{min(latencies) * 1000:>8.0f} {max(latencies) * 1000:>8.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5, help="Requests timed per path.")
+
+    args = parser.parse_args()
+    main(args.requests)
@@ -0,0 +1,87 @@
+"""
+Compare lines/sec of the column-position line parser with the INCIDENT_REGEX-only parser.
+
+The layout lines of the sample summary are parsed `--repeat` times. `--long-addresses`
+pads every address with single-spaced words, which makes the lazy regex groups
+backtrack over much longer lines.
+
+Usage (from the project root):
+    python -m benchmarks.bench_lineparser --repeat 200
+"""
+import argparse
+import time
+
+from pypdf import PdfReader
+
+from benchmarks.bench_extract import SAMPLE_PDF
+from scripts.project0 import INCIDENT_REGEX, extractpagelines, iterincidentrows
+
+
+def sample_pages(long_addresses=False):
+    """
+    Return the layout lines of every sample page, optionally with much longer addresses.
+    """
+    reader = PdfReader(SAMPLE_PDF)
+    pages = [extractpagelines(page, index, len(reader.pages)) for index, page in enumerate(reader.pages)]
+    if long_addresses:
+        padding = " ".join(["BLVD"] * 40)
+        widened = []
+        for lines in pages:
+            # Widen the location column by the padding so the nature and ORI columns stay aligned
+            match = INCIDENT_REGEX.match(lines[0])
+            location_start, nature_start = match.start(4), match.start(5)
+            width = nature_start - location_start + len(padding) + 1
+            widened.append([
+                line[:location_start] + (line[location_start:nature_start].rstrip() + " " + padding).ljust(width)
+                + line[nature_start:] if INCIDENT_REGEX.match(line) else line
+                for line in lines
+            ])
+        pages = widened
+    return pages
+
+
+def regex_rows(pages):
+    """
+    The previous parser: every line is matched against INCIDENT_REGEX.
+    """
+    rows = []
+    for row_contents in pages:
+        for line in row_contents:
+            row_check = INCIDENT_REGEX.match(line)
+            if row_check:
+                extracted_data = [i.strip() for i in row_check.groups()]
+                extracted_data[:2] = [' / '.join(extracted_data[:2])]
+                rows.append(extracted_data)
+            elif rows:
+                rows[-1][2] = rows[-1][2] + " " + line.lstrip()
+    return rows
+
+
+def lines_per_second(parse, pages, repeat):
+    """
+    Return (lines/sec, rows) for parsing the pages `repeat` times.
+    """
+    line_count = sum(len(lines) for lines in pages) * repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        rows = list(parse(pages))
+    return line_count / (time.perf_counter() - start), rows
+
+
+def main(repeat):
+    print(f"{'input':>15} {'regex lines/s':>14} {'columns lines/s':>16} {'speedup':>8} {'same rows':>10}")
+    for long_addresses in (False, True):
+        pages = sample_pages(long_addresses)
+        regex_rate, expected = lines_per_second(regex_rows, pages, repeat)
+        column_rate, rows = lines_per_second(iterincidentrows, pages, repeat)
+        label = 'long addresses' if long_addresses else 'sample'
+        print(f"{label:>15} {regex_rate:>14,.0f} {column_rate:>16,.0f} {column_rate / regex_rate:>7.1f}x "
+              f"{str(rows == expected):>10}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200, help="Times the sample lines are parsed.")
+
+    args = parser.parse_args()
+    main(args.repeat)
@@ -0,0 +1,52 @@
+"""
+Compare time, peak memory and explained variance of the exact and approximate PCA projections.
+
+Usage (from the project root):
+    python -m benchmarks.bench_pca --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import create_database
+from scripts.clustering import PROJECTIONS, preprocess_features, projection_model
+
+
+def measure(matrix, projection):
+    """
+    Return (seconds, peak bytes, explained variance ratio of both components) for one projection.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    model = projection_model(projection)
+    model.fit_transform(matrix)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, model.explained_variance_ratio_
+
+
+def main(sizes):
+    print(f"{'rows':>8} {'projection':>11} {'seconds':>9} {'peak MiB':>10} {'PC1':>8} {'PC2':>8} {'vs exact':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            db_path = create_database(os.path.join(tmp, f"bench_{size}.db"), size)
+            _, _, matrix = preprocess_features(db_path, sparse=True)
+            exact = None
+            for projection in PROJECTIONS:
+                elapsed, peak, ratio = measure(matrix, projection)
+                if exact is None:
+                    exact = ratio.sum()
+                print(f"{size:>8} {projection:>11} {elapsed:>9.3f} {peak / 2 ** 20:>10.1f} "
+                      f"{ratio[0]:>8.4f} {ratio[1]:>8.4f} {ratio.sum() / exact:>9.1%}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="Incident counts to benchmark.")
+
+    args = parser.parse_args()
+    main(args.sizes)
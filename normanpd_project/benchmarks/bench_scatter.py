@@ -0,0 +1,87 @@
+"""
+Time the PCA cluster plot render against the number of points.
+
+  * loop: one filtered copy and one `plt.scatter` per cluster, as the plot used to be drawn
+  * single: every point in one `scatter` call with a per-point color array
+  * scatter: points sorted by label once, one single-color marker slice per cluster
+  * hexbin: hexagons colored by their most common cluster
+
+Usage (from the project root):
+    python -m benchmarks.bench_scatter --sizes 1000 10000 100000 1000000 --clusters 8
+"""
+import argparse
+import io
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from scripts.clustering import CLUSTER_COLORS, cluster_colormap, draw_cluster_scatter
+
+
+def make_points(n_points, n_clusters, seed=42):
+    """
+    Return a DataFrame of 2D blobs around `n_clusters` centers with their labels.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=5, size=(n_clusters, 2))
+    labels = rng.integers(0, n_clusters, n_points)
+    points = centers[labels] + rng.normal(size=(n_points, 2))
+    return pd.DataFrame({'pca_x': points[:, 0], 'pca_y': points[:, 1], 'cluster': labels}), centers
+
+
+def draw_loop(ax, df, n_clusters, centroids):
+    """
+    The previous per-cluster drawing code.
+    """
+    for cluster in df['cluster'].unique():
+        cluster_data = df[df['cluster'] == cluster]
+        ax.scatter(cluster_data['pca_x'], cluster_data['pca_y'], label=f'Cluster {cluster}',
+                   color=CLUSTER_COLORS[cluster % len(CLUSTER_COLORS)])
+    ax.scatter(centroids[:, 0], centroids[:, 1], s=300, c='black', marker='X', label='Centroids')
+    ax.legend()
+
+
+def render(df, n_clusters, centroids, mode):
+    """
+    Return the seconds spent drawing and encoding one png.
+    """
+    start = time.perf_counter()
+    fig, ax = plt.subplots(figsize=(10, 6))
+    if mode == 'loop':
+        draw_loop(ax, df, n_clusters, centroids)
+    elif mode == 'single':
+        ax.scatter(df['pca_x'], df['pca_y'], c=df['cluster'], cmap=cluster_colormap(n_clusters), s=12, linewidths=0)
+    else:
+        draw_cluster_scatter(ax, df['pca_x'].to_numpy(), df['pca_y'].to_numpy(), df['cluster'].to_numpy(),
+                             n_clusters, centroids=centroids, mode=mode)
+    fig.savefig(io.BytesIO(), format='png')
+    plt.close(fig)
+    return time.perf_counter() - start
+
+
+def main(sizes, n_clusters, max_loop_points):
+    print(f"{'points':>9} {'loop s':>8} {'single s':>9} {'scatter s':>10} {'hexbin s':>9}")
+    for size in sizes:
+        df, centroids = make_points(size, n_clusters)
+        loop = render(df, n_clusters, centroids, 'loop') if size <= max_loop_points else None
+        single = render(df, n_clusters, centroids, 'single')
+        scatter = render(df, n_clusters, centroids, 'scatter')
+        hexbin = render(df, n_clusters, centroids, 'hexbin')
+        loop_column = f"{loop:>8.3f}" if loop is not None else f"{'-':>8}"
+        print(f"{size:>9} {loop_column} {single:>9.3f} {scatter:>10.3f} {hexbin:>9.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000],
+                        help="Point counts to render.")
+    parser.add_argument("--clusters", type=int, default=5, help="Number of clusters.")
+    parser.add_argument("--max-loop-points", type=int, default=100000,
+                        help="Skip the old per-cluster loop above this many points.")
+
+    args = parser.parse_args()
+    main(args.sizes, args.clusters, args.max_loop_points)
@@ -0,0 +1,82 @@
+"""
+Compare loading the clustering features from SQLite and from the columnar snapshot.
+
+Each load runs in a fresh process, and the growth of its peak resident set
+size is reported, so neither path sees the other's pages or allocations.
+
+Usage (from the project root):
+    python -m benchmarks.bench_snapshot --sizes 10000 100000 1000000
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.synthetic import create_database
+
+
+def load(db_path, source):
+    """
+    Load the features one way in this process and return (seconds, peak resident MiB added).
+    """
+    import pandas as pd
+    from scripts import snapshot
+    from scripts.clustering import CATEGORICAL_FEATURES, time_features
+
+    stored = ['incident_epoch'] + CATEGORICAL_FEATURES
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if source == 'sql':
+        with sqlite3.connect(db_path) as conn:
+            df = pd.read_sql_query(f"SELECT rowid AS incident_rowid, {', '.join(stored)} FROM incidents", conn,
+                                   index_col='incident_rowid')
+    else:
+        df = snapshot.load_incidents(db_path, stored)
+    # Derive the time features and touch every categorical column, as the pipeline does
+    time_features(df['incident_epoch'])
+    for column in CATEGORICAL_FEATURES:
+        pd.factorize(df[column])
+    seconds = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return seconds, (rss_after - rss_before) / 1024
+
+
+def measure(db_path, source):
+    """
+    Run `load` in a new interpreter.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(load, db_path, source).result()
+
+
+def main(sizes):
+    from scripts import snapshot
+
+    print(f"{'rows':>8} {'source':>9} {'seconds':>9} {'peak MiB':>9} {'write s':>8} {'on disk MiB':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            db_path = create_database(os.path.join(tmp, f"bench_{size}.db"), size)
+            start = time.perf_counter()
+            snapshot.update_snapshot(db_path)
+            write_seconds = time.perf_counter() - start
+            directory = snapshot.snapshot_dir(db_path)
+            disk = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+            seconds, rss = measure(db_path, 'sql')
+            print(f"{size:>8} {'sql':>9} {seconds:>9.3f} {rss:>9.1f} {'-':>8} {'-':>12}")
+            seconds, rss = measure(db_path, 'snapshot')
+            print(f"{size:>8} {'snapshot':>9} {seconds:>9.3f} {rss:>9.1f} {write_seconds:>8.3f} {disk / 2 ** 20:>12.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="Incident counts to benchmark.")
+
+    args = parser.parse_args()
+    main(args.sizes)
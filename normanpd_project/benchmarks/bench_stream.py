@@ -0,0 +1,58 @@
+"""
+Compare peak memory of loading a long summary through the row list and through the streaming iterator.
+
+  * list: `populatedb(db, extractincidents(pdf_bytes))`, every row in memory before the insert
+  * stream: `populatedb(db, iterincidents(pdf_path))`, one page and one insert chunk at a time
+
+Usage (from the project root):
+    python -m benchmarks.bench_stream --copies 2 8
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.bench_extract import build_pdf
+from scripts.project0 import createdb, extractincidents, iterincidents, populatedb
+
+
+def measure(db_path, load):
+    """
+    Return (seconds, peak bytes) for one load into a fresh database.
+    """
+    createdb(db_path)
+    tracemalloc.start()
+    start = time.perf_counter()
+    load()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(copies_list):
+    print(f"{'copies':>7} {'mode':>7} {'seconds':>9} {'peak MiB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'normanpd.db')
+        for copies in copies_list:
+            pdf_path = os.path.join(tmp, f"summary_{copies}.pdf")
+            with open(pdf_path, 'wb') as pdf_file:
+                pdf_file.write(build_pdf(copies))
+
+            def load_list():
+                with open(pdf_path, 'rb') as pdf_file:
+                    populatedb(db_path, extractincidents(pdf_file.read()))
+
+            for mode, load in (('list', load_list), ('stream', lambda: populatedb(db_path, iterincidents(pdf_path)))):
+                elapsed, peak = measure(db_path, load)
+                print(f"{copies:>7} {mode:>7} {elapsed:>9.2f} {peak / 2 ** 20:>10.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--copies", type=int, nargs="+", default=[2, 8],
+                        help="Times the sample summary is repeated.")
+
+    args = parser.parse_args()
+    main(args.copies)
@@ -0,0 +1,61 @@
+"""
+Time features and heatmap counts for rolling windows of days against the whole table.
+
+Each window ends one day before the previous one, so after the first window
+only one day's counts are not cached yet.
+
+Usage (from the project root):
+    python -m benchmarks.bench_window --sizes 100000 1000000 --days 7 --windows 5
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks.synthetic import create_database
+from scripts import metrics, snapshot
+from scripts.clustering import heatmap_counts, last_days, load_features
+
+
+def timed_call(function, *args, **kwargs):
+    """
+    Return the seconds one call takes.
+    """
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main(sizes, days, windows):
+    print(f"{'rows':>8} {'window':>23} {'rows in':>8} {'features s':>11} {'heatmap s':>10} {'days hit':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            db_path = create_database(os.path.join(tmp, f"bench_{size}.db"), size)
+            snapshot.update_snapshot(db_path)
+            features = timed_call(load_features, db_path)
+            heatmap = timed_call(heatmap_counts, db_path)
+            print(f"{size:>8} {'all':>23} {size:>8} {features:>11.3f} {heatmap:>10.3f} {'-':>9}")
+
+            start, end = (date.fromisoformat(day) for day in last_days(db_path, days))
+            for _ in range(windows):
+                window = start.isoformat(), end.isoformat()
+                metrics.reset()
+                rows = len(load_features(db_path, window=window))
+                features = timed_call(load_features, db_path, window=window)
+                heatmap = timed_call(heatmap_counts, db_path, window=window)
+                hits = metrics.snapshot()['counters'].get('snapshot.partition_hits', 0)
+                print(f"{size:>8} {' to '.join(window):>23} {rows:>8} {features:>11.3f} {heatmap:>10.3f} "
+                      f"{f'{hits}/{days}':>9}")
+                start, end = start - timedelta(days=1), end - timedelta(days=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000],
+                        help="Incident counts to benchmark.")
+    parser.add_argument("--days", type=int, default=7, help="Days in each window.")
+    parser.add_argument("--windows", type=int, default=5, help="Rolling windows to time per size.")
+
+    args = parser.parse_args()
+    main(args.sizes, args.days, args.windows)
@@ -0,0 +1,202 @@
+"""
+Benchmark suite for ingest, clustering and rendering, with a stored baseline.
+
+For every size a synthetic database (and, up to `--max-pdf-rows`, a synthetic
+summary pdf) is generated, and each stage below runs in a fresh process so its
+time and peak memory are measured without the other stages' state:
+
+  * extract: `extractincidents` on the summary pdf
+  * populate: `populatedb` of the rows into a new database and `update_snapshot`, as an ingest does
+  * preprocess: `preprocess_features(sparse=True)`, reading the columnar snapshot
+  * cluster: fitting the sparse pipeline and `add_clusters_to_database`
+  * pca_plot, comparison_plot, heatmap: each `generate_*` function with a fitted pipeline
+
+Peak memory is the growth of the process's maximum resident set size during the stage.
+Results are compared with `benchmarks/baseline.json`, and the run exits with
+status 1 when a stage is slower or larger than its baseline by more than the
+tolerance.
+
+Usage (from the project root):
+    python -m benchmarks.suite                              # compare with the baseline
+    python -m benchmarks.suite --sizes 1000 10000 100000 1000000 --max-pdf-rows 10000
+    python -m benchmarks.suite --update-baseline            # record a new baseline
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+STAGES = ['extract', 'populate', 'preprocess', 'cluster', 'pca_plot', 'comparison_plot', 'heatmap']
+N_CLUSTERS = 3
+
+
+def fitted_pipeline(db_path):
+    """
+    Fit the pipeline the clustering job uses.
+    """
+    from scripts.clustering import ClusteringPipeline
+    return ClusteringPipeline(db_path, n_clusters=N_CLUSTERS, sparse=True).run()
+
+
+def prepare_stage(stage, workdir, size):
+    """
+    Do the untimed setup of a stage and return the function to time.
+    """
+    from benchmarks.synthetic import generate_rows
+    from scripts import clustering, project0, snapshot
+
+    db_path = os.path.join(workdir, f"suite_{size}.db")
+    if stage == 'extract':
+        with open(os.path.join(workdir, f"suite_{size}.pdf"), 'rb') as pdf_file:
+            incident_data = pdf_file.read()
+        return lambda: project0.extractincidents(incident_data)
+    if stage == 'populate':
+        rows = generate_rows(size)
+        project0.createdb(db_path)
+        return lambda: (project0.populatedb(db_path, rows), snapshot.update_snapshot(db_path))
+    if stage == 'preprocess':
+        return lambda: clustering.preprocess_features(db_path, sparse=True)
+    if stage == 'cluster':
+        return lambda: clustering.add_clusters_to_database(db_path, N_CLUSTERS, pipeline=fitted_pipeline(db_path))
+
+    # The generate_* functions write into MEDIA_ROOT
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "normanpd_project.settings")
+    import django
+    from django.conf import settings
+    django.setup()
+    settings.MEDIA_ROOT = os.path.join(workdir, 'media')
+    os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+
+    pipeline = fitted_pipeline(db_path)
+    if stage == 'pca_plot':
+        return lambda: clustering.generate_cluster_plot_with_pca(db_path, N_CLUSTERS, pipeline=pipeline)
+    if stage == 'comparison_plot':
+        return lambda: clustering.generate_comparison_plot(db_path, pipeline=pipeline)
+    return lambda: clustering.generate_heatmap(db_path, pipeline=pipeline)
+
+
+def run_stage(stage, workdir, size):
+    """
+    Run one stage in this (fresh) process and return its seconds and peak memory growth in MiB.
+    """
+    import contextlib
+    import io
+    function = prepare_stage(stage, workdir, size)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    # The clustering functions print progress; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        function()
+    seconds = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'seconds': round(seconds, 4), 'peak_mib': round((rss_after - rss_before) / 1024, 1)}
+
+
+def measure(stage, workdir, size):
+    """
+    Run a stage in a new interpreter so imports, caches and peak memory do not leak between stages.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_stage, stage, workdir, size).result()
+
+
+def run_suite(sizes, max_pdf_rows):
+    """
+    Return {size: {stage: {'seconds', 'peak_mib'}}} for every size.
+    """
+    from benchmarks.synthetic import build_summary_pdf, generate_rows
+
+    results = {}
+    for size in sizes:
+        results[str(size)] = {}
+        with tempfile.TemporaryDirectory() as workdir:
+            for stage in STAGES:
+                if stage == 'extract':
+                    if size > max_pdf_rows:
+                        continue
+                    with open(os.path.join(workdir, f"suite_{size}.pdf"), 'wb') as pdf_file:
+                        pdf_file.write(build_summary_pdf(generate_rows(size)))
+                result = measure(stage, workdir, size)
+                results[str(size)][stage] = result
+                print(f"{size:>8} {stage:>16} {result['seconds']:>9.3f} s {result['peak_mib']:>9.1f} MiB", flush=True)
+    return results
+
+
+def machine():
+    """
+    Describe the machine, since timings only compare on the same hardware.
+    """
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()}
+
+
+def compare(results, baseline, tolerance, memory_tolerance, min_seconds, min_mib):
+    """
+    Return the stages that regressed as (size, stage, metric, baseline, current) tuples.
+
+    A stage regresses when it is more than `tolerance` slower (and at least
+    `min_seconds` slower), or its peak memory grew by more than
+    `memory_tolerance` (and at least `min_mib`).
+    """
+    regressions = []
+    for size, stages in results.items():
+        for stage, current in stages.items():
+            previous = baseline.get('results', {}).get(size, {}).get(stage)
+            if previous is None:
+                continue
+            if (current['seconds'] > previous['seconds'] * (1 + tolerance)
+                    and current['seconds'] - previous['seconds'] >= min_seconds):
+                regressions.append((size, stage, 'seconds', previous['seconds'], current['seconds']))
+            if (current['peak_mib'] > previous['peak_mib'] * (1 + memory_tolerance)
+                    and current['peak_mib'] - previous['peak_mib'] >= min_mib):
+                regressions.append((size, stage, 'peak_mib', previous['peak_mib'], current['peak_mib']))
+    return regressions
+
+
+def main(args):
+    print(f"{'rows':>8} {'stage':>16} {'time':>11} {'peak memory':>13}")
+    results = run_suite(args.sizes, args.max_pdf_rows)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'machine': machine(), 'results': results}, baseline_file, indent=1, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one.")
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get('machine') != machine():
+        print(f"Warning: baseline was recorded on {baseline.get('machine')}, this is {machine()}")
+
+    regressions = compare(results, baseline, args.tolerance, args.memory_tolerance, args.min_seconds, args.min_mib)
+    for size, stage, metric, previous, current in regressions:
+        print(f"REGRESSION {stage} at {size} rows: {metric} {previous} -> {current}")
+    if not regressions:
+        print("No regressions against the baseline.")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="Incident counts to benchmark.")
+    parser.add_argument("--max-pdf-rows", type=int, default=10000,
+                        help="Skip the pdf extraction stage above this many rows.")
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline JSON file.")
+    parser.add_argument("--update-baseline", action="store_true", help="Record this run as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown, as a fraction.")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25, help="Allowed memory growth, as a fraction.")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="Ignore slowdowns smaller than this.")
+    parser.add_argument("--min-mib", type=float, default=5, help="Ignore memory growth smaller than this.")
+
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,133 @@
+"""
+Synthetic incident generator shared by the benchmark scripts.
+
+Rows mimic the Norman PD daily summaries: one incident every few minutes,
+mostly unique street addresses, a few dozen natures and three ORIs.
+`build_summary_pdf` lays rows out like the published pdf, so they can also
+be fed through `extractincidents`.
+"""
+import io
+import random
+import zlib
+from datetime import datetime, timedelta
+
+from scripts.project0 import createdb, populatedb
+
+
+NATURES = [
+    'Traffic Stop', 'Transfer/Interfacility', 'Sick Person', 'Contact a Subject', 'Alarm',
+    'Disturbance/Domestic', 'Welfare Check', 'Breathing Problems', 'Harassment / Threats Report',
+    'Falls', 'Unconscious/Fainting', 'MVA Non Injury', 'Trespassing', 'Runaway or Lost Child',
+    'Parking Problem', 'MVA With Injuries', 'Chest Pain', 'Larceny', 'Convulsion/Seizure',
+    'Animal Livestock', 'Suspicious', 'Supplement Report', 'Follow Up', 'Overdose/Poisoning',
+    'Open Door/Premises Check', 'Medical Call Pd Requested', 'Fraud', 'Check Area', 'Burglary',
+    'Stolen Vehicle', 'Public Assist', 'Noise Complaint', 'Extra Patrol', 'Barking Dog', 'Assault',
+]
+
+STREETS = [
+    'ALAMEDA ST', 'RANCHO DR', 'ED NOBLE PKWY', 'W DAWS ST', 'W IMHOFF RD', 'COLLEGE AVE',
+    'E LINDSEY ST', 'HEALTHPLEX PKWY', '24TH AVE SW', 'MCNAMEE ST', 'CHALMETTE DR',
+    'ANN BRANDEN BLVD', 'LEXINGTON AVE', 'CLASSEN BLVD', 'BOULDER CT', 'HEATHER GLEN DR',
+    'E BOYD ST', '13TH PL', 'RAMBLING OAKS DR', 'N INTERSTATE DR', 'W TECUMSEH RD',
+    'N FLOOD AVE', 'W MAIN ST', 'E ROBINSON ST', '12TH AVE SE', 'CHAUTAUQUA AVE',
+]
+
+ORIS = ['OK0140200', '14005', 'EMSSTAT']
+
+
+def generate_rows(n_rows, seed=42, start=datetime(2024, 12, 1)):
+    """
+    Return `n_rows` incident records in the `[time, number, location, nature, ori]` layout.
+    """
+    rng = random.Random(seed)
+    rows = []
+    current = start
+    for index in range(n_rows):
+        current += timedelta(minutes=rng.randint(0, 7))
+        incident_time = f"{current.month}/{current.day}/{current.year} / {current.hour}:{current.minute:02d}"
+        location = f"{rng.randint(1, 9999)} {rng.choice(STREETS)}"
+        rows.append([
+            incident_time,
+            f"{current.year}-{index:08d}",
+            location,
+            rng.choice(NATURES),
+            rng.choice(ORIS),
+        ])
+    return rows
+
+
+def create_database(db_path, n_rows, seed=42):
+    """
+    Create an `incidents` database at `db_path` filled with `n_rows` synthetic records.
+    """
+    createdb(db_path)
+    populatedb(db_path, generate_rows(n_rows, seed))
+    return db_path
+
+
+# x positions of the date/time, number, location, nature and ORI columns on a landscape letter page
+PDF_COLUMNS = [52, 150, 235, 445, 650]
+PDF_HEADER = [
+    [(300, 'NORMAN POLICE DEPARTMENT')],
+    [(310, 'Daily Incident Summary (Public)')],
+    [(60, 'Date / Time'), (150, 'Incident Number'), (235, 'Location'), (445, 'Nature'), (650, 'Incident ORI')],
+]
+
+
+def pdf_text(text):
+    """
+    Escape text for a PDF string literal.
+    """
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def build_summary_pdf(rows, lines_per_page=30, wrap_every=25):
+    """
+    Return the bytes of a daily incident summary pdf holding `rows`.
+
+    Like the published summaries, the first page starts with three header
+    lines, the last page ends with a footer line, and the address of every
+    `wrap_every`-th row continues on a second line. The pdf is written
+    directly (Helvetica text in FlateDecode content streams), so a million
+    rows take seconds to produce. `extractincidents` returns `rows` unchanged.
+    """
+    lines = list(PDF_HEADER)
+    for index, (incident_time, number, location, nature, ori) in enumerate(rows):
+        continuation = None
+        if wrap_every and index % wrap_every == 0 and ' ' in location:
+            location, continuation = location.rsplit(' ', 1)
+        fields = [incident_time.replace(' / ', ' '), number, location, nature, ori]
+        lines.append(list(zip(PDF_COLUMNS, fields)))
+        if continuation:
+            lines.append([(PDF_COLUMNS[2], continuation)])
+    pages = [lines[start:start + lines_per_page] for start in range(0, len(lines), lines_per_page)]
+    pages[-1].append([(PDF_COLUMNS[0], rows[-1][0].split(' / ')[0] if rows else '')])
+
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>", None]
+    font_id, pages_id = 1, 2
+    kids = []
+    for page in pages:
+        operators = ["BT /F1 8 Tf"]
+        for line_index, line in enumerate(page):
+            y = 560 - 17 * line_index
+            operators.extend(f"1 0 0 1 {x} {y} Tm ({pdf_text(text)}) Tj" for x, text in line)
+        operators.append("ET")
+        stream = zlib.compress("\n".join(operators).encode('latin-1'))
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 792 612] "
+                       f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {len(objects)} 0 R >>".encode())
+        kids.append(len(objects))
+    objects[pages_id - 1] = f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>".encode()
+    objects.append(f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode())
+
+    pdf = io.BytesIO()
+    pdf.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(pdf.tell())
+        pdf.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = pdf.tell()
+    pdf.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    pdf.writelines(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, len(objects), xref))
+    return pdf.getvalue()
@@ -49,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'webapp.middleware.RequestMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'normanpd_project.urls'
@@ -126,3 +127,23 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Queue for the ingest and clustering jobs run by `python manage.py runjobs`
+JOBS_DB = os.path.join(BASE_DIR, 'scripts', 'resources', 'jobs.db')
+JOB_WORKERS = 2
+
+# Allow `?profile=cprofile|tracemalloc` on requests and the jobs they queue; reports go to resources/profiles
+PROFILE_REQUESTS = DEBUG
+
+# The PCA cluster plot switches from a scatter to hexagonal bins above this many incidents
+SCATTER_MAX_POINTS = 100000
+
+# Clusters used by /process/: a number, or 'auto' to pick the best k in CLUSTER_K_RANGE by silhouette
+N_CLUSTERS = 'auto'
+CLUSTER_K_RANGE = (2, 10)
+
+# How /process/ shows results: 'png' renders the plots with matplotlib, 'client' draws the /api/ payloads in the browser
+RENDER_MODE = 'png'
+
+# PCA solver of the cluster plot: 'exact', or 'randomized'/'sample' (scripts.clustering.ApproximatePCA) for large tables
+PCA_PROJECTION = 'exact'
@@ -1,34 +1,268 @@
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from matplotlib.colors import ListedColormap
+from matplotlib.lines import Line2D
+import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
+import scipy.sparse as sp
+from sklearn.cluster import KMeans, MiniBatchKMeans
 import sqlite3
 import os
+import pickle
+import itertools
+from datetime import date, datetime, timedelta, timezone
 from django.conf import settings
-import seaborn as sns
 from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from scripts import metrics, snapshot
+from scripts.project0 import countclusterrun, migratedb, parseincidenttime
+from scripts.rendercache import save_figure
 
 
 
-def preprocess_features(db_path):
+# One-hot encoded; each keeps the vocabulary of its values in order of first appearance in the table
+CATEGORICAL_FEATURES = ['incident_location', 'nature', 'incident_ori']
+
+# Time of day and day of week as points on a circle, so 23:59 sits next to 0:00 and Sunday next to Monday
+TIME_FEATURES = ['time_sin', 'time_cos', 'weekday_sin', 'weekday_cos']
+
+# Numeric columns first, in the order `pd.get_dummies` puts them
+SELECTED_FEATURES = TIME_FEATURES + CATEGORICAL_FEATURES
+
+
+def time_features(epoch):
     """
-    Load and preprocess features from the database for clustering.
+    Derive hour, weekday (Monday is 0), minute of the day and their cyclic encodings from UTC epoch seconds.
+
+    Incidents whose time could not be parsed (NULL or -1) get -1 for the
+    integer features and 0 for the cyclic ones.
+    """
+    epoch = pd.to_numeric(pd.Series(epoch), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    known = epoch >= 0
+    seconds = np.where(known, epoch, 0).astype(np.int64)
+    minute_of_day = (seconds % 86400) // 60
+    # 1 January 1970 was a Thursday
+    weekday = (seconds // 86400 + 3) % 7
+    time_angle = 2 * np.pi * minute_of_day / 1440
+    weekday_angle = 2 * np.pi * weekday / 7
+    return {
+        'hour': np.where(known, minute_of_day // 60, -1).astype(np.int8),
+        'weekday': np.where(known, weekday, -1).astype(np.int8),
+        'minute_of_day': np.where(known, minute_of_day, -1).astype(np.int16),
+        'time_sin': np.where(known, np.sin(time_angle), 0.0),
+        'time_cos': np.where(known, np.cos(time_angle), 0.0),
+        'weekday_sin': np.where(known, np.sin(weekday_angle), 0.0),
+        'weekday_cos': np.where(known, np.cos(weekday_angle), 0.0),
+    }
+
+
+def coded(values, names=None):
+    """
+    Return `values` as a Categorical with its categories in order of first appearance.
+
+    When `names` (a Series of lookup table names indexed by id) is given,
+    `values` are ids into it, so the text is never read row by row.
+    """
+    codes, uniques = pd.factorize(values)
+    categories = pd.Index(uniques if names is None else names.reindex(uniques).to_numpy(), dtype=object)
+    return pd.Categorical.from_codes(codes, categories=categories, validate=False)
+
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def window_days(window):
+    """
+    Return a `(start, end)` window of ISO dates (inclusive, None for an open end) as days since the epoch.
+
+    `window=None` is the whole table and returns None.
+    """
+    if window is None:
+        return None
+    return tuple(None if day is None else date.fromisoformat(day).toordinal() - EPOCH_ORDINAL for day in window)
+
+
+def epoch_filter(window):
+    """
+    Return an SQL condition on `incident_epoch` for the window, and its parameters.
+
+    The condition is a range on the indexed epoch, so SQLite only visits the
+    incidents of those days.
+    """
+    days = window_days(window)
+    if days is None:
+        return "1", []
+    conditions, params = ["incident_epoch IS NOT NULL"], []
+    if days[0] is not None:
+        conditions.append("incident_epoch >= ?")
+        params.append(days[0] * 86400)
+    if days[1] is not None:
+        conditions.append("incident_epoch < ?")
+        params.append((days[1] + 1) * 86400)
+    return " AND ".join(conditions), params
+
+
+def last_days(db_path, days):
+    """
+    Return the window of the `days` most recent incident dates, ending on the newest incident.
+
+    Returns None when the table has no dated incidents.
+    """
+    with sqlite3.connect(db_path) as conn:
+        newest = conn.execute("SELECT MAX(incident_epoch) FROM incidents").fetchone()[0]
+    if newest is None:
+        return None
+    end = date.fromordinal(EPOCH_ORDINAL + newest // 86400)
+    return (end - timedelta(days=days - 1)).isoformat(), end.isoformat()
+
+
+def read_features(db_path, after_rowid=0, window=None):
+    """
+    Read the incident epoch and categorical features from SQLite, indexed by `incident_rowid`.
+
+    On the typed schema locations and natures are read as their integer ids
+    and named from the `locations`/`natures` lookup tables, and a `window`
+    is a range on the epoch index. Older all-TEXT tables are read as text and
+    their times parsed with `parseincidenttime`.
     """
     with sqlite3.connect(db_path) as conn:
-        # Load data
-        df = pd.read_sql_query("SELECT * FROM incidents", conn)
+        if 'nature_id' in incident_columns(conn):
+            condition, params = epoch_filter(window)
+            df = pd.read_sql_query(
+                f"SELECT rowid AS incident_rowid, incident_epoch, location_id, nature_id, incident_ori \
+                  FROM incidents WHERE rowid > ? AND {condition} ORDER BY rowid",
+                conn, params=[after_rowid] + params, index_col='incident_rowid',
+            )
+            locations = pd.read_sql_query("SELECT id, name FROM locations", conn, index_col='id')['name']
+            natures = pd.read_sql_query("SELECT id, name FROM natures", conn, index_col='id')['name']
+            return pd.DataFrame({
+                'incident_epoch': df['incident_epoch'].to_numpy(),
+                'incident_location': coded(df['location_id'].to_numpy(), locations),
+                'nature': coded(df['nature_id'].to_numpy(), natures),
+                'incident_ori': coded(df['incident_ori'].to_numpy()),
+            }, index=df.index)
+
+        df = pd.read_sql_query(
+            "SELECT rowid AS incident_rowid, incident_time, incident_location, nature, incident_ori \
+             FROM incidents WHERE rowid > ? ORDER BY rowid",
+            conn, params=(after_rowid,), index_col='incident_rowid',
+        )
+    epoch = pd.Series([parseincidenttime(incident_time)[0] for incident_time in df['incident_time']],
+                      index=df.index, dtype='Int64')
+    days = window_days(window)
+    if days is not None:
+        day = epoch // 86400
+        keep = day.notna()
+        if days[0] is not None:
+            keep &= day >= days[0]
+        if days[1] is not None:
+            keep &= day <= days[1]
+        keep = keep.fillna(False).to_numpy(dtype=bool)
+        df, epoch = df[keep], epoch[keep]
+    return pd.DataFrame({
+        'incident_epoch': epoch.array,
+        **{column: coded(df[column].to_numpy()) for column in CATEGORICAL_FEATURES},
+    }, index=df.index)
+
+
+def load_features(db_path, after_rowid=0, window=None):
+    """
+    Return the clustering inputs of the incidents after `after_rowid`, indexed by `incident_rowid`.
+
+    The categorical features are `pd.Categorical` columns whose vocabulary is
+    the order of first appearance in the table, so a value keeps its code as
+    rows are appended. They come from the columnar snapshot when it is
+    current, and from `read_features` otherwise. The time features of
+    `time_features` replace the raw `incident_time` strings. With a `window`
+    of ISO dates only the incidents of those days are read: the snapshot's
+    day partitions, or an epoch range in SQLite.
+    """
+    df = snapshot.load_incidents(db_path, ['incident_epoch'] + CATEGORICAL_FEATURES, days=window_days(window))
+    if df is None:
+        df = read_features(db_path, after_rowid, window)
+    elif after_rowid:
+        df = df.iloc[df.index.searchsorted(after_rowid, side='right'):]
+    time = time_features(df['incident_epoch'].to_numpy())
+    return pd.DataFrame({**time, **{column: df[column] for column in CATEGORICAL_FEATURES}}, index=df.index)
+
+
+def sparse_one_hot(df, columns):
+    """
+    One-hot encode `columns` into a CSR matrix, matching `pd.get_dummies(drop_first=True)`.
+
+    Categorical columns keep their own categories; others are factorized in
+    sorted order. Returns the matrix and the list of feature names in column
+    order.
+    """
+    blocks = []
+    feature_names = []
+    for column in columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            codes, uniques = df[column].cat.codes.to_numpy(), df[column].cat.categories
+        else:
+            codes, uniques = pd.factorize(df[column], sort=True)
+
+        # Category 0 is dropped like drop_first; missing values (-1) get no column
+        mask = codes > 0
+        rows = np.flatnonzero(mask)
+        cols = codes[mask] - 1
+        data = np.ones(len(rows), dtype=np.float64)
+        blocks.append(sp.csr_matrix((data, (rows, cols)), shape=(len(df), max(len(uniques) - 1, 0))))
+        feature_names.extend(f"{column}_{value}" for value in uniques[1:])
+
+    return sp.hstack(blocks, format='csr'), feature_names
+
+
+def sparse_variance_mask(matrix, threshold=0.01):
+    """
+    Return a boolean mask of the 0/1 columns whose sample variance is above `threshold`.
+    """
+    n_rows = matrix.shape[0]
+    if n_rows < 2:
+        return np.zeros(matrix.shape[1], dtype=bool)
+
+    # Column sums of a 0/1 matrix give the sample variance without densifying it
+    counts = np.asarray(matrix.sum(axis=0)).ravel()
+    variance = (counts - counts ** 2 / n_rows) / (n_rows - 1)
+    return variance > threshold
+
+
+@metrics.timed('features')
+def preprocess_features(db_path, sparse=False, window=None):
+    """
+    Load and preprocess features from the database for clustering.
 
-    # Select meaningful features for clustering
-    selected_features = ['incident_time', 'incident_location', 'nature', 'incident_ori']
-    df = df[selected_features]
+    With `sparse=True` the one-hot matrix is built, filtered and scaled as CSR
+    without ever being densified, and the second and third return values are
+    sparse matrices instead of a DataFrame and a dense array. The encoded and
+    kept column counts are recorded as the `features.*` gauges. The inputs
+    come from `load_features`: the time features plus the one-hot encoded
+    categorical features of the incidents in `window` (all when None).
+    """
+    # Indexed by rowid so labels can be written back to the same rows
+    df = load_features(db_path, window=window)
+
+    if sparse:
+        times = df[TIME_FEATURES].to_numpy()
+        one_hot, _ = sparse_one_hot(df, CATEGORICAL_FEATURES)
+        matrix = sp.hstack([sp.csr_matrix(times), one_hot], format='csr')
+        metrics.gauge('features.encoded_columns', matrix.shape[1])
+        time_mask = times.var(axis=0, ddof=1) > 0.01 if len(times) > 1 else np.zeros(len(TIME_FEATURES), dtype=bool)
+        matrix = matrix[:, np.concatenate([time_mask, sparse_variance_mask(one_hot)])]
+        metrics.gauge('features.width', matrix.shape[1])
+
+        # Centering would densify the matrix; KMeans and PCA are translation invariant
+        scaler = StandardScaler(with_mean=False)
+        return df, matrix, scaler.fit_transform(matrix)
 
     # Convert categorical features to numeric using One-Hot Encoding
-    df_numeric = pd.get_dummies(df, drop_first=True)
+    df_numeric = pd.get_dummies(df[SELECTED_FEATURES], drop_first=True)
+    metrics.gauge('features.encoded_columns', df_numeric.shape[1])
 
     # Remove low-variance columns
     df_numeric = df_numeric.loc[:, df_numeric.var() > 0.01]
+    metrics.gauge('features.width', df_numeric.shape[1])
 
     # Standardize features
     scaler = StandardScaler()
@@ -36,106 +270,545 @@ def preprocess_features(db_path):
 
     return df, df_numeric, df_scaled
 
-def add_clusters_to_database(db_path, n_clusters):
+
+# 'exact' is sklearn's PCA; the others are approximations for large matrices, see ApproximatePCA
+PROJECTIONS = ('exact', 'randomized', 'sample')
+PCA_SAMPLE_SIZE = 20000
+PCA_CHUNK_SIZE = 100000
+
+
+def column_variance(matrix):
+    """
+    Return the sample variance of every column of a dense or sparse matrix without densifying it.
+    """
+    n_rows = matrix.shape[0]
+    if sp.issparse(matrix):
+        mean = np.asarray(matrix.mean(axis=0)).ravel()
+        squares = np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel()
+    else:
+        mean = matrix.mean(axis=0)
+        squares = (matrix ** 2).sum(axis=0)
+    return (squares - n_rows * mean ** 2) / max(n_rows - 1, 1)
+
+
+class ApproximatePCA:
+    """
+    Approximate 2D PCA projection with the `fit_transform`/`transform` interface of sklearn's PCA.
+
+    'randomized' runs a randomized SVD (Halko et al.) of the centered matrix
+    without ever forming it: the mean is subtracted inside each block product,
+    so a sparse matrix stays sparse. 'sample' fits an exact PCA on
+    `sample_size` uniformly sampled rows and transforms every row in chunks of
+    `chunk_size`. `explained_variance_ratio_` is measured on all rows, so it
+    can be compared directly with the exact PCA's.
+    """
+
+    def __init__(self, n_components=2, method='randomized', sample_size=PCA_SAMPLE_SIZE, chunk_size=PCA_CHUNK_SIZE,
+                 n_oversamples=10, n_iter=4, random_state=42):
+        self.n_components = n_components
+        self.method = method
+        self.sample_size = sample_size
+        self.chunk_size = chunk_size
+        self.n_oversamples = n_oversamples
+        self.n_iter = n_iter
+        self.random_state = random_state
+        self.mean_ = None
+        self.components_ = None
+        self.explained_variance_ratio_ = None
+
+    def fit_transform(self, matrix):
+        """
+        Fit the projection on `matrix` and return its rows projected to `n_components` dimensions.
+        """
+        if self.method == 'randomized':
+            self.fit_randomized(matrix)
+        elif self.method == 'sample':
+            self.fit_sample(matrix)
+        else:
+            raise ValueError(f"Unknown approximate PCA method {self.method!r}")
+        reduced = self.transform(matrix)
+        self.explained_variance_ratio_ = reduced.var(axis=0, ddof=1) / column_variance(matrix).sum()
+        return reduced
+
+    def fit_randomized(self, matrix):
+        """
+        Find the top components from a few block products with the implicitly centered matrix.
+        """
+        rng = np.random.default_rng(self.random_state)
+        self.mean_ = np.asarray(matrix.mean(axis=0)).ravel()
+        block = self.n_components + self.n_oversamples
+
+        def product(right):
+            # (matrix - mean) @ right
+            return np.asarray(matrix @ right) - self.mean_ @ right
+
+        def transposed_product(left):
+            # (matrix - mean).T @ left
+            return np.asarray(matrix.T @ left) - np.outer(self.mean_, left.sum(axis=0))
+
+        basis = product(rng.standard_normal((matrix.shape[1], block)))
+        for _ in range(self.n_iter):
+            basis = self.orthonormalize(basis)
+            basis, _ = np.linalg.qr(transposed_product(basis))
+            basis = product(basis)
+        basis = self.orthonormalize(basis)
+        _, _, vt = np.linalg.svd(transposed_product(basis).T, full_matrices=False)
+        self.components_ = self.flip_signs(vt[:self.n_components])
+
+    @staticmethod
+    def orthonormalize(basis):
+        """
+        Orthonormalize the columns of a tall basis with a Cholesky QR, which only factors the small Gram matrix.
+
+        Falls back to Householder QR when the basis is too ill-conditioned for Cholesky.
+        """
+        try:
+            upper = np.linalg.cholesky(basis.T @ basis).T
+        except np.linalg.LinAlgError:
+            return np.linalg.qr(basis)[0]
+        return basis @ np.linalg.inv(upper)
+
+    def fit_sample(self, matrix):
+        """
+        Fit an exact PCA on a uniform sample of the rows.
+        """
+        rows = matrix.shape[0]
+        if rows > self.sample_size:
+            sample = np.sort(np.random.default_rng(self.random_state).choice(rows, self.sample_size, replace=False))
+            matrix = matrix[sample]
+        pca = PCA(n_components=self.n_components, random_state=self.random_state).fit(matrix)
+        self.mean_ = pca.mean_
+        self.components_ = self.flip_signs(pca.components_)
+
+    @staticmethod
+    def flip_signs(components):
+        """
+        Make the largest loading of every component positive, so the orientation does not depend on the solver.
+        """
+        signs = np.sign(components[np.arange(len(components)), np.abs(components).argmax(axis=1)])
+        return components * signs[:, np.newaxis]
+
+    def transform(self, matrix):
+        """
+        Project rows onto the fitted components, `chunk_size` rows at a time; no rows give a (0, n_components) array.
+        """
+        offset = self.mean_ @ self.components_.T
+        projected = np.empty((matrix.shape[0], self.components_.shape[0]))
+        for start in range(0, matrix.shape[0], self.chunk_size):
+            projected[start:start + self.chunk_size] = np.asarray(matrix[start:start + self.chunk_size]
+                                                                  @ self.components_.T) - offset
+        return projected
+
+
+def projection_model(projection):
+    """
+    Return an unfitted 2D projection: sklearn's PCA for 'exact', otherwise an ApproximatePCA.
+    """
+    if projection not in PROJECTIONS:
+        raise ValueError(f"Unknown projection {projection!r}, expected one of {PROJECTIONS}")
+    if projection == 'exact':
+        return PCA(n_components=2, random_state=42)
+    return ApproximatePCA(n_components=2, method=projection)
+
+
+class ClusteringPipeline:
+    """
+    Load, encode, scale, cluster and project the incidents table in a single pass.
+
+    The fitted pipeline is shared by `add_clusters_to_database` and the
+    `generate_*` functions so a request only pays for preprocessing, KMeans
+    and PCA once. `projection` picks the PCA solver (see `PROJECTIONS`), and
+    `window` limits it to the incidents of a `(start, end)` range of ISO dates.
+    """
+
+    def __init__(self, db_path, n_clusters, sparse=False, projection='exact', window=None):
+        self.db_path = db_path
+        self.n_clusters = n_clusters
+        self.sparse = sparse
+        self.projection = projection
+        self.window = window
+        self.df = None
+        self.df_numeric = None
+        self.df_scaled = None
+        self.kmeans = None
+        self.pca = None
+        self.reduced_data = None
+
+    def preprocess(self):
+        """
+        Load, encode and scale the features unless that was already done, so `choose_k` can score the same matrix.
+        """
+        if self.df_scaled is None:
+            self.df, self.df_numeric, self.df_scaled = preprocess_features(self.db_path, sparse=self.sparse,
+                                                                           window=self.window)
+        return self
+
+    def run(self):
+        """
+        Preprocess the features, fit KMeans and project the scaled matrix to 2D with the chosen PCA solver.
+        """
+        self.preprocess()
+
+        with metrics.timed('cluster.fit'):
+            self.kmeans = KMeans(n_clusters=self.n_clusters, random_state=42)
+            self.df['cluster'] = self.kmeans.fit_predict(self.df_scaled)
+        metrics.gauge('cluster.k', self.n_clusters)
+        metrics.gauge('cluster.fit_iterations', int(self.kmeans.n_iter_))
+
+        with metrics.timed('cluster.pca'):
+            self.pca = projection_model(self.projection)
+            self.reduced_data = self.pca.fit_transform(self.df_scaled)
+        metrics.count(f'cluster.pca.{self.projection}')
+        metrics.gauge('cluster.pca_explained_variance', float(self.pca.explained_variance_ratio_.sum()))
+        self.df['pca_x'] = self.reduced_data[:, 0]
+        self.df['pca_y'] = self.reduced_data[:, 1]
+        return self
+
+    def cluster_sizes(self):
+        """
+        Return the number of records per cluster as a DataFrame with `cluster` and `count` columns.
+        """
+        sizes = self.df['cluster'].value_counts().sort_index()
+        return sizes.rename_axis('cluster').reset_index(name='count')
+
+
+def run_pipeline(db_path, n_clusters, pipeline=None, window=None):
+    """
+    Return a fitted ClusteringPipeline, reusing `pipeline` when one is passed in.
+    """
+    if pipeline is None:
+        pipeline = ClusteringPipeline(db_path, n_clusters, window=window).run()
+    return pipeline
+
+
+def incident_columns(conn):
+    """
+    Return the column names of the incidents table.
+    """
+    return [row[1] for row in conn.execute("PRAGMA table_info(incidents)")]
+
+
+def latest_cluster_run(conn):
+    """
+    Return the id of the newest committed clustering run, or None if there is none.
+    """
+    return conn.execute("SELECT MAX(run_id) FROM cluster_runs").fetchone()[0]
+
+
+def window_cluster_run(conn, window=None):
+    """
+    Return the id of the newest run that clustered exactly `window` (None for the whole table), or None.
+    """
+    start, end = window if window is not None else (None, None)
+    return conn.execute("SELECT MAX(run_id) FROM cluster_runs WHERE window_start IS ? AND window_end IS ?",
+                        (start, end)).fetchone()[0]
+
+
+def save_cluster_labels(db_path, rowids, labels, n_clusters, mode='full', run_id=None, keep_runs=3, coordinates=None,
+                        window=None):
+    """
+    Write cluster labels to `incident_clusters` in a single WAL transaction and return the run id.
+
+    A new run is created unless `run_id` is given, in which case the labels
+    are added to that run, and the run's `cluster_counts` are recounted.
+    `coordinates` optionally holds each row's (pca_x, pca_y), stored so the
+    data API can serve the projection without refitting. `window` records the
+    `(start, end)` ISO dates a new run clustered. Readers keep serving the
+    previous run until this commits; only the newest `keep_runs` runs are kept.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        if run_id is None:
+            start, end = window if window is not None else (None, None)
+            run_id = conn.execute(
+                "INSERT INTO cluster_runs (n_clusters, mode, created_at, window_start, window_end) VALUES (?, ?, ?, ?, ?)",
+                (n_clusters, mode, datetime.now(timezone.utc).isoformat(), start, end),
+            ).lastrowid
+        if coordinates is None:
+            coordinates = itertools.repeat((None, None))
+        conn.executemany(
+            "INSERT OR REPLACE INTO incident_clusters (run_id, incident_number, cluster, pca_x, pca_y) \
+             SELECT ?, incident_number, ?, ?, ? FROM incidents WHERE rowid = ?",
+            ((run_id, int(label), x, y, int(rowid))
+             for rowid, label, (x, y) in zip(rowids, labels, coordinates)),
+        )
+        countclusterrun(conn, run_id)
+
+        # Drop runs that no reader will ask for again
+        stale = "SELECT run_id FROM cluster_runs ORDER BY run_id DESC LIMIT -1 OFFSET ?"
+        conn.execute(f"DELETE FROM incident_clusters WHERE run_id IN ({stale})", (keep_runs,))
+        conn.execute(f"DELETE FROM cluster_runs WHERE run_id IN ({stale})", (keep_runs,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return run_id
+
+
+def add_clusters_to_database(db_path, n_clusters, pipeline=None, window=None):
     """
     Perform clustering on the data and add cluster labels to the SQLite database.
+
+    With a `window` only the incidents of those days are clustered and labelled.
     """
     try:
-        # Preprocess features
-        df, _, df_scaled = preprocess_features(db_path)
+        # Upgrade older tables so every row has an incident_number to key its label on
+        migratedb(db_path)
 
-        # Perform clustering
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        df['cluster'] = kmeans.fit_predict(df_scaled)
+        # Preprocess features and perform clustering
+        pipeline = run_pipeline(db_path, n_clusters, pipeline, window)
+        df = pipeline.df.drop(columns=['pca_x', 'pca_y'])
 
         # Debugging: Check cluster distribution
         print("Cluster distribution:")
         print(df['cluster'].value_counts())
 
-        # Save updated DataFrame back to the database
-        with sqlite3.connect(db_path) as conn:
-            df.to_sql('incidents', conn, if_exists='replace', index=False)
-        print("Clusters added to the database.")
+        # Save the labels as a new run; the incidents table itself is never rewritten
+        coordinates = zip(pipeline.df['pca_x'].tolist(), pipeline.df['pca_y'].tolist())
+        with metrics.timed('cluster.save'):
+            run_id = save_cluster_labels(db_path, df.index, df['cluster'], n_clusters, coordinates=coordinates,
+                                         window=pipeline.window)
+        metrics.count('cluster.labels', len(df))
+        print(f"Clusters added to the database (run {run_id}).")
+        return run_id
     except Exception as e:
         print(f"Error adding clusters to database: {e}")
         raise
 
 
 
-def generate_cluster_plot_with_pca(db_path, n_clusters):
+class IncrementalClusterModel:
+    """
+    MiniBatchKMeans model that is updated with only the incidents inserted since the last run.
+
+    The encoder vocabulary of the categorical features is fixed by the first
+    batch (unseen values encode to all zeros), the scaler statistics and centroids are updated with
+    `partial_fit`, and `last_rowid`/`seen_rows` record how far into the
+    `incidents` table the model has read. Labels are appended to the
+    cluster run recorded in `run_id`.
+    """
+
+    def __init__(self, n_clusters):
+        self.n_clusters = n_clusters
+        self.encoder = OneHotEncoder(handle_unknown='ignore')
+        self.scaler = StandardScaler(with_mean=False)
+        self.kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3)
+        self.features = SELECTED_FEATURES
+        self.fitted = False
+        self.last_rowid = 0
+        self.seen_rows = 0
+        self.run_id = None
+
+    def partial_fit_predict(self, df):
+        """
+        Update the scaler and centroids with a batch of incidents and return its cluster labels.
+        """
+        if not self.fitted:
+            if len(df) < self.n_clusters:
+                raise ValueError(f"Need at least {self.n_clusters} incidents to start the incremental model, got {len(df)}")
+            self.encoder.fit(df[CATEGORICAL_FEATURES])
+
+        matrix = sp.hstack([sp.csr_matrix(df[TIME_FEATURES].to_numpy()), self.encoder.transform(df[CATEGORICAL_FEATURES])],
+                           format='csr')
+        self.scaler.partial_fit(matrix)
+        scaled = self.scaler.transform(matrix)
+        self.kmeans.partial_fit(scaled)
+        self.fitted = True
+        return self.kmeans.predict(scaled)
+
+    def save(self, model_path):
+        """
+        Persist the model next to the database.
+        """
+        with open(model_path, 'wb') as model_file:
+            pickle.dump(self, model_file)
+
+    @staticmethod
+    def load(model_path, n_clusters):
+        """
+        Load a persisted model, or start a new one when none exists or `n_clusters` or the features changed.
+        """
+        if os.path.exists(model_path):
+            with open(model_path, 'rb') as model_file:
+                model = pickle.load(model_file)
+            if model.n_clusters == n_clusters and getattr(model, 'features', None) == SELECTED_FEATURES:
+                return model
+        return IncrementalClusterModel(n_clusters)
+
+
+def add_clusters_incrementally(db_path, n_clusters, model_path=None):
+    """
+    Assign clusters to the incidents inserted since the previous run and update the persisted model.
+
+    Earlier labels are left untouched, so the cost depends on the number of new
+    incidents rather than the size of the table. If the rows the model has
+    already seen were rewritten (for example by `createdb`), or a newer full
+    clustering run replaced its run, the model is rebuilt from the whole
+    table. Returns the number of newly labelled rows.
+    """
+    if model_path is None:
+        model_path = os.path.join(os.path.dirname(os.path.abspath(db_path)), 'cluster_model.pkl')
+
+    try:
+        migratedb(db_path)
+        model = IncrementalClusterModel.load(model_path, n_clusters)
+        with sqlite3.connect(db_path) as conn:
+            # Start over if the history the model was trained on, or its run, is gone
+            seen = conn.execute("SELECT COUNT(*) FROM incidents WHERE rowid <= ?", (model.last_rowid,)).fetchone()[0]
+            if seen != model.seen_rows or getattr(model, 'run_id', None) != latest_cluster_run(conn):
+                model = IncrementalClusterModel(n_clusters)
+
+        df = load_features(db_path, after_rowid=model.last_rowid)
+        if df.empty:
+            return 0
+
+        labels = model.partial_fit_predict(df)
+        model.run_id = save_cluster_labels(db_path, df.index, labels, n_clusters,
+                                           mode='incremental', run_id=model.run_id)
+
+        model.last_rowid = int(df.index.max())
+        model.seen_rows += len(df)
+        model.save(model_path)
+        print(f"Incremental clustering labelled {len(df)} new incidents.")
+        return len(df)
+    except Exception as e:
+        print(f"Error adding clusters incrementally: {e}")
+        raise
+
+
+CLUSTER_COLORS = ['red', 'blue', 'green', 'purple', 'orange']
+
+# Above this many points the PCA plot switches from a scatter to hexagonal bins
+SCATTER_MAX_POINTS = 100000
+
+
+def cluster_colormap(n_clusters):
+    """
+    Return a colormap with one color per cluster label, for any number of clusters.
+    """
+    if n_clusters <= len(CLUSTER_COLORS):
+        return ListedColormap(CLUSTER_COLORS[:max(n_clusters, 1)])
+    return plt.get_cmap('turbo', n_clusters)
+
+
+def majority_label(labels):
+    """
+    Return the most common cluster label of the points in one hexagon.
+    """
+    return np.bincount(np.asarray(labels, dtype=np.int64)).argmax()
+
+
+def draw_cluster_scatter(ax, x, y, labels, n_clusters, centroids=None, max_points=SCATTER_MAX_POINTS, mode='auto'):
+    """
+    Draw the clustered points on `ax` and return the mode used ('scatter' or 'hexbin').
+
+    'scatter' sorts the points by label once and draws each cluster's slice as
+    single-color markers, which Agg stamps far faster than a per-point color
+    array. 'hexbin' colors each hexagon by its most common cluster, so the cost
+    depends on the grid size instead of the number of points. 'auto' picks
+    'hexbin' once there are more than `max_points` points.
+    """
+    x, y, labels = np.asarray(x), np.asarray(y), np.asarray(labels)
+    cmap = cluster_colormap(n_clusters)
+    colors = [cmap((cluster + 0.5) / n_clusters) for cluster in range(n_clusters)]
+    if mode == 'auto':
+        mode = 'hexbin' if len(labels) > max_points else 'scatter'
+
+    if mode == 'hexbin':
+        ax.hexbin(x, y, C=labels, reduce_C_function=majority_label, gridsize=80,
+                  cmap=cmap, vmin=-0.5, vmax=n_clusters - 0.5, mincnt=1)
+        handles = [Line2D([], [], marker='o', linestyle='', color=color, label=f'Cluster {cluster}')
+                   for cluster, color in enumerate(colors)]
+    else:
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(n_clusters + 1))
+        x, y = x[order], y[order]
+        markersize = 3.5 if len(labels) > 1000 else 6
+        handles = []
+        for cluster, color in enumerate(colors):
+            points = slice(bounds[cluster], bounds[cluster + 1])
+            handles += ax.plot(x[points], y[points], marker='o', linestyle='', markersize=markersize,
+                               markeredgewidth=0, color=color, label=f'Cluster {cluster}')
+
+    if centroids is not None:
+        handles.append(ax.scatter(centroids[:, 0], centroids[:, 1], s=300, c='black', marker='X', label='Centroids'))
+    ax.legend(handles=handles)
+    return mode
+
+
+@metrics.timed('render.pca_plot')
+def generate_cluster_plot_with_pca(db_path, n_clusters, pipeline=None, max_points=SCATTER_MAX_POINTS, mode='auto',
+                                   window=None):
     """
     Generate a scatter plot for clustering results using PCA for dimensionality reduction.
+
+    Large results are drawn as hexagonal bins; see `draw_cluster_scatter`.
+    `window` limits the clustering to a range of days when no pipeline is passed.
     """
     try:
         # Ensure media directory exists
         os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
 
-        # Preprocess features
-        df, df_numeric, df_scaled = preprocess_features(db_path)
-
-        # Perform clustering
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        df['cluster'] = kmeans.fit_predict(df_scaled)
-
-        # Reduce dimensions to 2D using PCA
-        pca = PCA(n_components=2, random_state=42)
-        reduced_data = pca.fit_transform(df_scaled)
-        df['pca_x'] = reduced_data[:, 0]
-        df['pca_y'] = reduced_data[:, 1]
+        # Preprocess, cluster and reduce dimensions to 2D using PCA
+        pipeline = run_pipeline(db_path, n_clusters, pipeline, window)
+        df = pipeline.df
+        kmeans = pipeline.kmeans
+        pca = pipeline.pca
 
         # Debugging: Validate PCA variance explained
         explained_variance = pca.explained_variance_ratio_
         print(f"PCA Explained Variance: {explained_variance}")
 
-        # Create scatter plot
-        plt.figure(figsize=(10, 6))
-        colors = ['red', 'blue', 'green', 'purple', 'orange']
-        for cluster in df['cluster'].unique():
-            cluster_data = df[df['cluster'] == cluster]
-            plt.scatter(
-                cluster_data['pca_x'],
-                cluster_data['pca_y'],
-                label=f'Cluster {cluster}',
-                color=colors[cluster % len(colors)]
-            )
-
-        # Add cluster centroids in PCA space
+        # Draw all points, plus the cluster centroids in PCA space
+        fig, ax = plt.subplots(figsize=(10, 6))
         centroids_reduced = pca.transform(kmeans.cluster_centers_)
-        plt.scatter(
-            centroids_reduced[:, 0],
-            centroids_reduced[:, 1],
-            s=300,
-            c='black',
-            marker='X',
-            label='Centroids'
-        )
+        drawn = draw_cluster_scatter(ax, df['pca_x'].to_numpy(), df['pca_y'].to_numpy(), df['cluster'].to_numpy(),
+                                     n_clusters, centroids=centroids_reduced, max_points=max_points, mode=mode)
+        metrics.count(f'render.pca_plot.{drawn}')
 
         # Add labels and title
-        plt.title('PCA-Reduced Scatter Plot with Clusters')
-        plt.xlabel('PCA Component 1')
-        plt.ylabel('PCA Component 2')
-        plt.legend()
-        plt.grid(True)
-        plt.tight_layout()
-
-        # Save the plot
-        plot_path = os.path.join(settings.MEDIA_ROOT, 'pca_cluster_plot.png')
-        plt.savefig(plot_path)
-        plt.close()
-        return os.path.join(settings.MEDIA_URL, 'pca_cluster_plot.png')
+        ax.set_title('PCA-Reduced Scatter Plot with Clusters')
+        ax.set_xlabel('PCA Component 1')
+        ax.set_ylabel('PCA Component 2')
+        ax.grid(True)
+        fig.tight_layout()
+
+        # Save the plot under a content-hashed name
+        plot_url = save_figure(fig, 'pca_cluster_plot', settings.MEDIA_ROOT, settings.MEDIA_URL)
+        plt.close(fig)
+        return plot_url
     except Exception as e:
         print(f"Error generating PCA-based scatter plot: {e}")
         raise
 
 
-def generate_comparison_plot(db_path):
+@metrics.timed('render.comparison_plot')
+def generate_comparison_plot(db_path, pipeline=None, window=None):
     """
     Generate a bar chart comparing cluster sizes using data from SQLite database.
+
+    Without a pipeline the sizes come from the newest run; with a `window`,
+    from the newest run that clustered that window, and a ValueError is raised
+    when there is none, rather than counting another window's labels.
     """
     try:
-        # Load data from the database
-        with sqlite3.connect(db_path) as conn:
-            df = pd.read_sql_query("SELECT cluster, COUNT(*) as count FROM incidents GROUP BY cluster", conn)
+        # Load data from the fitted pipeline or the database
+        if pipeline is not None:
+            df = pipeline.cluster_sizes()
+        else:
+            with sqlite3.connect(db_path) as conn:
+                run_id = latest_cluster_run(conn) if window is None else window_cluster_run(conn, tuple(window))
+                if run_id is None and window is not None:
+                    raise ValueError(f"No clustering run of the window {window[0]} to {window[1]}")
+                df = pd.read_sql_query(
+                    "SELECT cluster, total AS count FROM cluster_counts WHERE run_id = ? AND total > 0 ORDER BY cluster",
+                    conn,
+                    params=(run_id,),
+                )
 
         # Create the bar chart
         plt.figure(figsize=(8, 6))
@@ -144,45 +817,146 @@ def generate_comparison_plot(db_path):
         plt.xlabel('Cluster')
         plt.ylabel('Number of Records')
 
-        # Save the plot
-        plot_path = os.path.join(settings.MEDIA_ROOT, 'comparison_plot.png')
-        plt.savefig(plot_path)
+        # Save the plot under a content-hashed name
+        plot_url = save_figure(plt.gcf(), 'comparison_plot', settings.MEDIA_ROOT, settings.MEDIA_URL)
         plt.close()
-        return os.path.join(settings.MEDIA_URL, 'comparison_plot.png')
+        return plot_url
     except Exception as e:
         print(f"Error generating comparison plot: {e}")
         raise
 
-def generate_heatmap(db_path):
+# Locations shown as their own heatmap column; the rest are summed into "Other"
+HEATMAP_TOP_N = 30
+OTHER_LOCATION = 'Other'
+
+
+def location_buckets(locations, bucket=None):
     """
-    Generate a heatmap showing the frequency of incidents by time and location.
+    Map location strings to heatmap buckets.
+
+    With `bucket='street'` the house number is dropped ("1000 ALAMEDA ST" ->
+    "ALAMEDA ST"), with `bucket='block'` it is rounded down to its hundred block
+    ("1310 ALAMEDA ST" -> "1300 BLOCK ALAMEDA ST"). Intersections and
+    coordinates are kept as they are.
     """
-    try:
-        # Load data from the database
-        with sqlite3.connect(db_path) as conn:
+    locations = pd.Series(locations, dtype=object).fillna('')
+    if bucket == 'street':
+        return locations.str.replace(r'^\d+\s+', '', regex=True)
+    if bucket == 'block':
+        return locations.str.replace(r'^(\d+)(?=\s)', lambda match: f"{int(match.group(1)) // 100 * 100} BLOCK",
+                                     regex=True)
+    return locations
+
+
+def table_counts(db_path, pipeline=None):
+    """
+    Return incident counts by hour and location over the whole table, as `hour`, `incident_location` and `total` columns.
+
+    On the typed schema the counts are read from the precomputed
+    `hour_location_counts` table, so only one row per hour and distinct
+    location is read.
+    """
+    with sqlite3.connect(db_path) as conn:
+        typed = 'incident_hour' in incident_columns(conn)
+        if typed:
+            # Incident counts by hour and location, maintained as rows are inserted
+            counts = pd.read_sql_query(
+                "SELECT c.incident_hour AS hour, l.name AS incident_location, c.total \
+                 FROM hour_location_counts c JOIN locations l ON l.id = c.location_id WHERE c.total > 0",
+                conn,
+            )
+        elif pipeline is None:
             df = pd.read_sql_query("SELECT incident_time, incident_location FROM incidents", conn)
 
-        # Preprocess data for heatmap
-        # Convert `incident_time` to hour of the day
-        df['hour'] = pd.to_datetime(df['incident_time'], errors='coerce').dt.hour
+    if not typed:
+        # Older databases without the parsed hour column
+        if pipeline is not None:
+            df = pd.DataFrame({'hour': pipeline.df['hour'].where(pipeline.df['hour'] >= 0),
+                               'incident_location': pipeline.df['incident_location'].astype(object)})
+        else:
+            # Convert `incident_time` to hour of the day
+            df['hour'] = pd.to_datetime(df['incident_time'], errors='coerce').dt.hour
+        counts = df.dropna(subset=['hour']).groupby(['hour', 'incident_location']).size().reset_index(name='total')
+    return counts
+
+
+def window_counts(db_path, window):
+    """
+    Return incident counts by hour and location over a `(start, end)` window of ISO dates.
+
+    The counts are summed from the snapshot's cached per-day counts (see
+    `snapshot.partition_counts`), so overlapping windows share their days.
+    Without a current snapshot the window's incidents are counted directly.
+    """
+    counts = snapshot.partition_counts(db_path, *window_days(window))
+    if counts is None:
+        df = load_features(db_path, window=window)
+        df = pd.DataFrame({'hour': df['hour'], 'incident_location': df['incident_location'].astype(object)})
+        counts = df[df['hour'] >= 0].groupby(['hour', 'incident_location']).size().reset_index(name='total')
+    return counts
 
-        # Count incidents by hour and location
-        heatmap_data = df.groupby(['hour', 'incident_location']).size().unstack(fill_value=0)
+
+def heatmap_counts(db_path, top_n=HEATMAP_TOP_N, bucket=None, pipeline=None, window=None):
+    """
+    Return incident counts as an hour x location DataFrame with at most `top_n` location columns plus "Other".
+
+    The counts cover the whole table (`table_counts`) or a `(start, end)`
+    window of ISO dates (`window_counts`). Locations are then grouped into
+    buckets (see `location_buckets`), the `top_n` busiest buckets are kept and
+    the rest are summed into "Other". `top_n=None` keeps every bucket.
+    """
+    if window is not None:
+        counts = window_counts(db_path, window)
+    else:
+        counts = table_counts(db_path, pipeline)
+
+    counts['incident_location'] = location_buckets(counts['incident_location'], bucket).to_numpy()
+    if top_n is not None:
+        totals = counts.groupby('incident_location')['total'].sum()
+        top = totals.sort_values(ascending=False, kind='stable').index[:top_n]
+        counts.loc[~counts['incident_location'].isin(top), 'incident_location'] = OTHER_LOCATION
+
+    heatmap_data = counts.pivot_table(index='hour', columns='incident_location', values='total',
+                                      aggfunc='sum', fill_value=0)
+    heatmap_data.index = heatmap_data.index.astype(int)
+
+    # Busiest locations first, with "Other" last
+    order = heatmap_data.sum().sort_values(ascending=False, kind='stable').index.tolist()
+    if OTHER_LOCATION in order:
+        order.remove(OTHER_LOCATION)
+        order.append(OTHER_LOCATION)
+    return heatmap_data[order]
+
+
+@metrics.timed('render.heatmap')
+def generate_heatmap(db_path, pipeline=None, top_n=HEATMAP_TOP_N, bucket=None, window=None):
+    """
+    Generate a heatmap showing the frequency of incidents by time and location.
+
+    The matrix is drawn as a single image, and `top_n` bounds its width however many
+    distinct locations exist; see `heatmap_counts` for the bucketing and `window` options.
+    """
+    try:
+        heatmap_data = heatmap_counts(db_path, top_n=top_n, bucket=bucket, pipeline=pipeline, window=window)
+        metrics.gauge('render.heatmap_columns', heatmap_data.shape[1])
 
         # Create the heatmap
-        plt.figure(figsize=(12, 8))
-        sns.heatmap(heatmap_data, cmap='coolwarm', linewidths=0.5, cbar=True)
-        plt.title('Incident Frequency by Hour and Location')
-        plt.xlabel('Location')
-        plt.ylabel('Hour of Day')
-        plt.tight_layout()
-
-        # Save the heatmap
-        plot_path = os.path.join(settings.MEDIA_ROOT, 'heatmap.png')
-        plt.savefig(plot_path)
-        plt.close()
-        return os.path.join(settings.MEDIA_URL, 'heatmap.png')
+        fig, ax = plt.subplots(figsize=(12, 8))
+        image = ax.imshow(heatmap_data.to_numpy(), cmap='coolwarm', aspect='auto', interpolation='nearest')
+        fig.colorbar(image, ax=ax)
+        ax.set_xticks(range(heatmap_data.shape[1]))
+        ax.set_xticklabels(heatmap_data.columns, rotation=90, fontsize=8 if heatmap_data.shape[1] > 20 else 10)
+        ax.set_yticks(range(heatmap_data.shape[0]))
+        ax.set_yticklabels(heatmap_data.index)
+        ax.set_title('Incident Frequency by Hour and Location')
+        ax.set_xlabel('Location')
+        ax.set_ylabel('Hour of Day')
+        fig.tight_layout()
+
+        # Save the heatmap under a content-hashed name
+        plot_url = save_figure(fig, 'heatmap', settings.MEDIA_ROOT, settings.MEDIA_URL)
+        plt.close(fig)
+        return plot_url
     except Exception as e:
         print(f"Error generating heatmap: {e}")
         raise
-
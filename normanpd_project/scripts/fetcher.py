@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import http.client
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux i686) AppleWebKit/537.17 (KHTML, like Gecko) Chrome/24.0.1312.27 Safari/537.17"
+INDEX_FILE = '.fetch_index.json'
+CHUNK_SIZE = 64 * 1024
+MAX_REDIRECTS = 5
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections, reused per (scheme, host, port).
+    """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, scheme, netloc):
+        """
+        Return an idle connection for the host, or open a new one.
+        """
+        with self.lock:
+            connections = self.idle.get((scheme, netloc))
+            if connections:
+                return connections.pop(), True
+        return self.connect(scheme, netloc), False
+
+    def connect(self, scheme, netloc):
+        """
+        Open a new connection to the host.
+        """
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def release(self, scheme, netloc, connection):
+        """
+        Put a connection back so the next request to the host can reuse it.
+        """
+        with self.lock:
+            self.idle.setdefault((scheme, netloc), []).append(connection)
+
+    def close(self):
+        """
+        Close every idle connection.
+        """
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
+
+
+def load_index(dest_dir):
+    """
+    Load the ETag/Last-Modified validators recorded for previously downloaded URLs.
+    """
+    index_path = os.path.join(dest_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as index_file:
+        return json.load(index_file)
+
+
+def save_index(dest_dir, index):
+    """
+    Atomically write the validators index.
+    """
+    index_path = os.path.join(dest_dir, INDEX_FILE)
+    with open(index_path + '.part', 'w') as index_file:
+        json.dump(index, index_file, indent=1, sort_keys=True)
+    os.replace(index_path + '.part', index_path)
+
+
+def url_filename(url):
+    """
+    Return a per-URL file name: a short hash of the URL followed by its last path segment.
+    """
+    basename = os.path.basename(urlsplit(url).path) or 'index'
+    return f"{hashlib.sha256(url.encode()).hexdigest()[:10]}_{basename}"
+
+
+def send_request(pool, url, headers):
+    """
+    Send a GET over a pooled connection, following redirects. Returns (response, connection, scheme, netloc).
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        connection, reused = pool.acquire(parts.scheme, parts.netloc)
+        try:
+            connection.request('GET', target, headers=headers)
+            response = connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            connection.close()
+            if not reused:
+                raise
+            # The server closed an idle keep-alive connection; retry on a fresh one
+            connection = pool.connect(parts.scheme, parts.netloc)
+            connection.request('GET', target, headers=headers)
+            response = connection.getresponse()
+
+        if response.status in (301, 302, 303, 307, 308):
+            location = response.getheader('Location')
+            response.read()
+            finish(pool, parts.scheme, parts.netloc, connection, response)
+            url = urljoin(url, location)
+            continue
+        return response, connection, parts.scheme, parts.netloc
+    raise http.client.HTTPException(f"Too many redirects for {url}")
+
+
+def finish(pool, scheme, netloc, connection, response):
+    """
+    Return the connection to the pool unless the server asked to close it.
+    """
+    if response.will_close:
+        connection.close()
+    else:
+        pool.release(scheme, netloc, connection)
+
+
+def download(pool, url, path, validators):
+    """
+    Stream one URL to `path`, sending the stored validators as a conditional request.
+
+    The validators are only sent while the file they describe still exists,
+    since a 304 answer would leave nothing to read.
+    """
+    headers = {'User-Agent': USER_AGENT, 'Connection': 'keep-alive'}
+    if os.path.exists(path):
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    response, connection, scheme, netloc = send_request(pool, url, headers)
+    try:
+        if response.status == 304 and os.path.exists(path):
+            response.read()
+            return {'url': url, 'path': path, 'status': 'not_modified', 'bytes': 0,
+                    'etag': validators.get('etag'), 'last_modified': validators.get('last_modified')}
+        if response.status != 200:
+            response.read()
+            raise http.client.HTTPException(f"GET {url} returned {response.status} {response.reason}")
+
+        # Stream the body to a temporary file so readers never see a partial pdf
+        size = 0
+        with open(path + '.part', 'wb') as pdf_file:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                pdf_file.write(chunk)
+                size += len(chunk)
+        os.replace(path + '.part', path)
+        return {'url': url, 'path': path, 'status': 'downloaded', 'bytes': size,
+                'etag': response.getheader('ETag'), 'last_modified': response.getheader('Last-Modified')}
+    finally:
+        finish(pool, scheme, netloc, connection, response)
+
+
+async def fetch_many(urls, dest_dir, concurrency=8, timeout=30):
+    """
+    Download many incident summary URLs concurrently into per-URL files in `dest_dir`.
+
+    Connections are kept alive and reused per host, and URLs whose ETag or
+    Last-Modified still match are answered with 304 and not downloaded again.
+    Returns one result dict per URL, in input order, with `status` set to
+    `downloaded` or `not_modified`.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    index = load_index(dest_dir)
+    pool = ConnectionPool(timeout=timeout)
+    loop = asyncio.get_running_loop()
+
+    # http.client is blocking, so each transfer runs on a thread owned by this fetch
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        async def fetch_one(url):
+            path = os.path.join(dest_dir, url_filename(url))
+            result = await loop.run_in_executor(executor, download, pool, url, path, index.get(url, {}))
+            index[url] = {'path': path, 'etag': result['etag'], 'last_modified': result['last_modified']}
+            return result
+
+        try:
+            results = await asyncio.gather(*(fetch_one(url) for url in urls))
+        finally:
+            pool.close()
+            save_index(dest_dir, index)
+    return results
+
+
+def fetch_all(urls, dest_dir, concurrency=8, timeout=30):
+    """
+    Synchronous wrapper around `fetch_many` for scripts and views.
+    """
+    return asyncio.run(fetch_many(urls, dest_dir, concurrency=concurrency, timeout=timeout))
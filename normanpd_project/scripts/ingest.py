@@ -0,0 +1,62 @@
+import sqlite3
+import time
+
+try:
+    from scripts import metrics, project0, snapshot
+except ImportError:  # imported from inside scripts/, as main.py does
+    import metrics
+    import project0
+    import snapshot
+
+
+def ingest(source, db_path='resources/normanpd.db', reset=True, workers=None, cache=None):
+    """
+    Download (or read) one incident summary, extract it and load it into the database in-process.
+
+    Args:
+        source: incident summary URL or local pdf path
+        db_path: path of the incidents database
+        reset: start from an empty database, as `main.py --incidents` does; False appends
+        workers: number of processes used for PDF page extraction
+        cache: optional ParseCache so known pdfs skip pypdf
+    Returns:
+        A dict with the row counts, per-nature counts and per-stage timings in milliseconds.
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    incident_data = project0.readincidentsource(source)
+    timings['fetch_ms'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    incidents = project0.extractincidentscached(incident_data, cache, workers=workers)
+    timings['extract_ms'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    project0.createdb(db_path, reset=reset)
+    with sqlite3.connect(db_path) as con:
+        inserted = project0.insertincidents(con.cursor(), incidents)
+        con.commit()
+    timings['load_ms'] = (time.perf_counter() - start) * 1000
+    metrics.record('load', timings['load_ms'])
+
+    # Clustering reads its features from the columnar snapshot instead of SQLite
+    start = time.perf_counter()
+    snapshot.update_snapshot(db_path)
+    timings['snapshot_ms'] = (time.perf_counter() - start) * 1000
+    metrics.record('snapshot', timings['snapshot_ms'])
+
+    start = time.perf_counter()
+    natures = project0.naturecounts(db_path)
+    timings['status_ms'] = (time.perf_counter() - start) * 1000
+    metrics.record('status', timings['status_ms'])
+
+    return {
+        'source': source,
+        'bytes': len(incident_data),
+        'rows': len(incidents),
+        'inserted': inserted,
+        'total_rows': sum(count for _, count in natures),
+        'natures': dict(natures),
+        'timings_ms': timings,
+    }
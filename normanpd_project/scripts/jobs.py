@@ -0,0 +1,376 @@
+import contextlib
+import importlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from scripts import metrics
+
+
+# A running job whose heartbeat is older than this is taken to have lost its worker and is queued again
+LEASE_S = 300
+
+# Seconds between heartbeats of a running job
+HEARTBEAT_S = 30
+
+# Claims after which a job whose worker keeps dying is failed instead of queued again
+MAX_ATTEMPTS = 3
+
+
+def connect(jobs_db):
+    """
+    Open the job queue database, creating the jobs table (or adding its newer columns) if needed.
+    """
+    conn = sqlite3.connect(jobs_db, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS jobs ( \
+                    id INTEGER PRIMARY KEY, \
+                    task TEXT NOT NULL, \
+                    payload TEXT, \
+                    status TEXT NOT NULL DEFAULT 'queued', \
+                    result TEXT, \
+                    error TEXT, \
+                    created_at REAL, \
+                    started_at REAL, \
+                    finished_at REAL, \
+                    metrics TEXT, \
+                    heartbeat_at REAL, \
+                    attempts INTEGER NOT NULL DEFAULT 0 \
+                );")
+    columns = [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]
+    for column, definition in (('metrics', 'TEXT'), ('heartbeat_at', 'REAL'), ('attempts', 'INTEGER NOT NULL DEFAULT 0')):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+    return conn
+
+
+def enqueue(jobs_db, task, payload):
+    """
+    Add a job and return its id right away.
+
+    `task` is the dotted path of a function taking the payload dict and
+    returning a JSON-serializable result, e.g. "webapp.tasks.cluster_job".
+    """
+    conn = connect(jobs_db)
+    try:
+        return conn.execute(
+            "INSERT INTO jobs (task, payload, created_at) VALUES (?, ?, ?)",
+            (task, json.dumps(payload), time.time()),
+        ).lastrowid
+    finally:
+        conn.close()
+
+
+def get_job(jobs_db, job_id):
+    """
+    Return a job as a dict with its payload, result and metrics decoded, or None if it does not exist.
+    """
+    conn = connect(jobs_db)
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job['payload'] = json.loads(job['payload']) if job['payload'] else None
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['metrics'] = json.loads(job['metrics']) if job['metrics'] else None
+    return job
+
+
+def release(conn, condition, params, reason):
+    """
+    Queue the running jobs matching `condition` again, failing those already claimed `MAX_ATTEMPTS` times.
+
+    Returns (requeued, failed) counts. `reason` starts the error of a failed
+    job, followed by its number of attempts.
+    """
+    running = f"status = 'running' AND {condition}"
+    failed = conn.execute(f"UPDATE jobs SET status = 'failed', finished_at = ?, \
+                            error = ? || ' ' || attempts || ' times' \
+                            WHERE {running} AND attempts >= ?",
+                          (time.time(), reason, *params, MAX_ATTEMPTS)).rowcount
+    requeued = conn.execute(f"UPDATE jobs SET status = 'queued', started_at = NULL, heartbeat_at = NULL \
+                              WHERE {running}", params).rowcount
+    if requeued:
+        metrics.count('jobs.requeued', requeued)
+    return requeued, failed
+
+
+def requeue_stale(conn, lease=LEASE_S):
+    """
+    Queue running jobs whose heartbeat is older than `lease` seconds again, and return how many were requeued.
+
+    Their worker process died without recording a result. A job that was
+    already claimed `MAX_ATTEMPTS` times is failed instead, so a job that kills
+    its worker cannot take the queue down with it.
+    """
+    cutoff = time.time() - lease
+    return release(conn, "COALESCE(heartbeat_at, started_at, 0) < ?", (cutoff,), 'Worker stopped responding')[0]
+
+
+def release_lost(jobs_db, job_ids, charge=True):
+    """
+    Queue jobs whose worker process pool broke again, and return how many were failed after `MAX_ATTEMPTS` claims.
+
+    Jobs that recorded a result before the pool broke are left alone. With
+    `charge=False` the claim that was lost does not count as an attempt, for
+    jobs that may only have shared the pool with the one that killed it.
+    """
+    if not job_ids:
+        return 0
+    ids = f"id IN ({', '.join('?' * len(job_ids))})"
+    conn = connect(jobs_db)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if not charge:
+            conn.execute(f"UPDATE jobs SET attempts = attempts - 1 WHERE status = 'running' AND {ids}", tuple(job_ids))
+        _, failed = release(conn, ids, tuple(job_ids), 'Worker process died')
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    metrics.count('jobs.lost', len(job_ids))
+    return failed
+
+
+def claim_job(jobs_db, lease=LEASE_S):
+    """
+    Atomically mark the oldest queued job as running and return its id, or None if the queue is empty.
+
+    Jobs whose worker died (see `requeue_stale`) are queued again first.
+    """
+    conn = connect(jobs_db)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        requeue_stale(conn, lease)
+        row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        now = time.time()
+        conn.execute("UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ?, attempts = attempts + 1 \
+                       WHERE id = ?", (now, now, row['id']))
+        conn.execute("COMMIT")
+        return row['id']
+    finally:
+        conn.close()
+
+
+@contextlib.contextmanager
+def heartbeat(jobs_db, job_id, interval=HEARTBEAT_S):
+    """
+    Refresh the job's `heartbeat_at` every `interval` seconds from a background thread while the block runs.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                conn = connect(jobs_db)
+                try:
+                    conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                                 (time.time(), job_id))
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                pass  # A busy queue database; the next beat tries again
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def profile_dir(jobs_db):
+    """
+    Directory the cProfile/tracemalloc reports of profiled jobs are written to.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(jobs_db)), 'profiles')
+
+
+def execute_job(jobs_db, job_id):
+    """
+    Run a claimed job and record its result or error. Runs inside the worker processes.
+
+    The stage timings and counters the job recorded (see `scripts.metrics`)
+    are stored with it. A payload with `"profile": "cprofile"` or
+    `"tracemalloc"` also writes a profile report, whose path is added to the
+    job's metrics.
+    """
+    job = get_job(jobs_db, job_id)
+    payload = job['payload'] or {}
+    report = None
+    metrics.reset()
+    try:
+        module_name, function_name = job['task'].rsplit('.', 1)
+        function = getattr(importlib.import_module(module_name), function_name)
+        if payload.get('profile'):
+            capture = metrics.profiled(payload['profile'], profile_dir(jobs_db), f"job-{job_id}")
+        else:
+            capture = contextlib.nullcontext()
+        with heartbeat(jobs_db, job_id), capture as report:
+            with metrics.timed('job'):
+                result = function(payload)
+        status, result, error = 'done', json.dumps(result), None
+    except Exception as e:
+        status, result, error = 'failed', None, f"{e}\n{traceback.format_exc()}"
+
+    job_metrics = metrics.snapshot()
+    if report is not None:
+        job_metrics['profile'] = report
+    conn = connect(jobs_db)
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, metrics = ? WHERE id = ?",
+            (status, result, error, time.time(), json.dumps(job_metrics), job_id),
+        )
+    finally:
+        conn.close()
+    return status
+
+
+def run_pending(jobs_db, limit=None):
+    """
+    Run queued jobs in this process until the queue is empty (or `limit` jobs ran). Returns the job ids.
+    """
+    job_ids = []
+    while limit is None or len(job_ids) < limit:
+        job_id = claim_job(jobs_db)
+        if job_id is None:
+            break
+        execute_job(jobs_db, job_id)
+        job_ids.append(job_id)
+    return job_ids
+
+
+def run_worker(jobs_db, processes=2, poll_interval=0.5, initializer=None, max_jobs=None):
+    """
+    Claim queued jobs and run them on a pool of `processes` worker processes until interrupted.
+
+    `initializer` runs once in every worker process (for example `django.setup`).
+    With `max_jobs` the worker stops after that many jobs have finished.
+    When a worker process dies the pool is broken: it is replaced, and the
+    jobs it was running are queued again right away (see `release_lost`).
+    Which of them killed it is unknown, so none is charged an attempt and jobs
+    run one at a time until each of them finished or broke the pool alone.
+    """
+    finished = 0
+    executor = ProcessPoolExecutor(max_workers=processes, initializer=initializer)
+    running = {}
+    suspects = set()
+    try:
+        while max_jobs is None or finished + len(running) < max_jobs or running:
+            # Keep every worker busy while there is work queued
+            lost = []
+            while len(running) < (1 if suspects else processes) and \
+                    (max_jobs is None or finished + len(running) < max_jobs):
+                job_id = claim_job(jobs_db)
+                if job_id is None:
+                    break
+                try:
+                    running[executor.submit(execute_job, jobs_db, job_id)] = job_id
+                except BrokenProcessPool:
+                    lost.append(job_id)
+                    break
+
+            if not running and not lost:
+                time.sleep(poll_interval)
+                continue
+            done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            broken = lost or any(isinstance(future.exception(), BrokenProcessPool) for future in done)
+            if not broken:
+                finished += len(done)
+                for future in done:
+                    suspects.discard(running.pop(future))
+                continue
+
+            # Every job the broken pool still held is lost, including the one that killed it
+            for future, job_id in running.items():
+                if future.done() and future.exception() is None:
+                    finished += 1
+                    suspects.discard(job_id)
+                else:
+                    lost.append(job_id)
+            if len(lost) == 1:
+                suspects.discard(lost[0])
+                finished += release_lost(jobs_db, lost)
+            else:
+                suspects.update(lost)
+                finished += release_lost(jobs_db, lost, charge=False)
+            executor.shutdown(wait=True)
+            executor = ProcessPoolExecutor(max_workers=processes, initializer=initializer)
+            running = {}
+    finally:
+        executor.shutdown(wait=True)
+    return finished
+
+
+def percentile(values, fraction):
+    """
+    Return the value at `fraction` of the sorted values, or None for an empty list.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def queue_metrics(jobs_db, window=100):
+    """
+    Return queue depth, job counts by status and wait/run latency over the last `window` finished jobs.
+    """
+    conn = connect(jobs_db)
+    try:
+        counts = {row['status']: row['total'] for row in
+                  conn.execute("SELECT status, COUNT(*) AS total FROM jobs GROUP BY status")}
+        oldest = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        recent = conn.execute(
+            "SELECT started_at - created_at AS waited, finished_at - started_at AS ran FROM jobs \
+             WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?",
+            (window,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    waits = [row['waited'] for row in recent]
+    runs = [row['ran'] for row in recent]
+    return {
+        'queue_depth': counts.get('queued', 0),
+        'running': counts.get('running', 0),
+        'done': counts.get('done', 0),
+        'failed': counts.get('failed', 0),
+        'oldest_queued_age_s': time.time() - oldest if oldest else None,
+        'wait_s': {'mean': sum(waits) / len(waits) if waits else None, 'p95': percentile(waits, 0.95)},
+        'run_s': {'mean': sum(runs) / len(runs) if runs else None, 'p95': percentile(runs, 0.95)},
+    }
+
+
+def stage_metrics(jobs_db, window=100):
+    """
+    Return the stage timings, counters and gauges of the last `window` finished jobs, summarized per task.
+    """
+    conn = connect(jobs_db)
+    try:
+        rows = conn.execute(
+            "SELECT task, metrics FROM jobs WHERE metrics IS NOT NULL ORDER BY finished_at DESC LIMIT ?",
+            (window,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    snapshots = {}
+    for row in reversed(rows):
+        snapshots.setdefault(row['task'], []).append(json.loads(row['metrics']))
+    return {task: dict(metrics.summarize(task_snapshots), jobs=len(task_snapshots))
+            for task, task_snapshots in snapshots.items()}
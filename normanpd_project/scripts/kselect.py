@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+
+from scripts import metrics
+from scripts.clustering import preprocess_features
+
+
+# Bump when the scoring changes, so cached selections are recomputed
+KSELECT_VERSION = 2
+
+# Silhouette is quadratic in the number of points, so it is scored on a sample
+SILHOUETTE_SAMPLE = 2000
+
+# Matrices already mapped in this worker process, keyed by their directory
+_shared_matrices = {}
+
+
+def share_matrix(matrix, directory):
+    """
+    Write a CSR or dense matrix as .npy files that worker processes memory-map instead of receiving a pickled copy.
+
+    Returns the small descriptor that is sent to the workers.
+    """
+    if sp.issparse(matrix):
+        matrix = sp.csr_matrix(matrix)
+        for name in ('data', 'indices', 'indptr'):
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(matrix, name))
+        return {'directory': directory, 'shape': matrix.shape, 'sparse': True}
+    np.save(os.path.join(directory, 'dense.npy'), np.ascontiguousarray(matrix))
+    return {'directory': directory, 'shape': matrix.shape, 'sparse': False}
+
+
+def load_shared_matrix(shared):
+    """
+    Map a matrix written by `share_matrix`; the pages are shared with every other process mapping it.
+    """
+    matrix = _shared_matrices.get(shared['directory'])
+    if matrix is None:
+        if shared['sparse']:
+            arrays = tuple(np.load(os.path.join(shared['directory'], f"{name}.npy"), mmap_mode='r')
+                           for name in ('data', 'indices', 'indptr'))
+            matrix = sp.csr_matrix(arrays, shape=tuple(shared['shape']), copy=False)
+        else:
+            matrix = np.load(os.path.join(shared['directory'], 'dense.npy'), mmap_mode='r')
+        _shared_matrices.clear()
+        _shared_matrices[shared['directory']] = matrix
+    return matrix
+
+
+def score_k(shared, k, sample_size=SILHOUETTE_SAMPLE):
+    """
+    Fit KMeans with `k` clusters on the shared matrix and return its inertia and sampled silhouette.
+    """
+    matrix = load_shared_matrix(shared)
+    kmeans = KMeans(n_clusters=k, random_state=42)
+    labels = kmeans.fit_predict(matrix)
+
+    silhouette = None
+    if 1 < len(np.unique(labels)) < matrix.shape[0]:
+        silhouette = float(silhouette_score(matrix, labels, sample_size=min(sample_size, matrix.shape[0]),
+                                            random_state=42))
+    return {'k': k, 'inertia': float(kmeans.inertia_), 'silhouette': silhouette}
+
+
+def elbow_k(scores):
+    """
+    Return the k whose inertia lies farthest below the line joining the first and last point of the curve.
+    """
+    if len(scores) < 3:
+        return scores[0]['k'] if scores else None
+    ks = np.array([score['k'] for score in scores], dtype=float)
+    inertia = np.array([score['inertia'] for score in scores], dtype=float)
+
+    # Normalize both axes so the distance does not depend on their units
+    ks = (ks - ks[0]) / (ks[-1] - ks[0])
+    span = inertia[0] - inertia[-1]
+    if span <= 0:
+        return scores[0]['k']
+    inertia = (inertia[0] - inertia) / span
+    return scores[int(np.argmax(inertia - ks))]['k']
+
+
+def plateaued(scores, patience, tolerance):
+    """
+    Return True once the best silhouette has not improved by more than `tolerance` for `patience` consecutive k.
+    """
+    best = None
+    since_best = 0
+    for score in scores:
+        silhouette = score['silhouette']
+        if silhouette is not None and (best is None or silhouette > best + tolerance):
+            best, since_best = silhouette, 0
+        else:
+            since_best += 1
+    return best is not None and since_best >= patience
+
+
+def select_k(matrix, k_min=2, k_max=10, processes=2, patience=2, tolerance=0.01):
+    """
+    Score every k in [k_min, k_max] and return the k with the best sampled silhouette.
+
+    The matrix is memory-mapped by `processes` worker processes rather than
+    copied to each, k values are submitted in increasing order and the search
+    stops once the silhouette has plateaued (see `plateaued`). Returns a dict
+    with the chosen `k`, the `elbow_k` of the inertia curve, the per-k
+    `scores` and whether the search `stopped_early`.
+    """
+    k_max = min(k_max, matrix.shape[0] - 1)
+    if k_max < k_min:
+        raise ValueError(f"Need more than {k_min} incidents to choose the number of clusters, got {matrix.shape[0]}")
+    k_values = list(range(k_min, k_max + 1))
+    results = {}
+
+    def prefix():
+        # Scores of the contiguous run of k values that have finished so far
+        scores = []
+        for k in k_values:
+            if k not in results:
+                break
+            scores.append(results[k])
+        return scores
+
+    with tempfile.TemporaryDirectory() as directory:
+        shared = share_matrix(matrix, directory)
+        if processes <= 1:
+            for k in k_values:
+                results[k] = score_k(shared, k)
+                if plateaued(prefix(), patience, tolerance):
+                    break
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                pending = iter(k_values)
+                running = set()
+                stopped = False
+                while True:
+                    # Keep every worker busy until the curve has plateaued
+                    while not stopped and len(running) < processes:
+                        k = next(pending, None)
+                        if k is None:
+                            break
+                        running.add(executor.submit(score_k, shared, k))
+                    if not running:
+                        break
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        score = future.result()
+                        results[score['k']] = score
+                    stopped = stopped or plateaued(prefix(), patience, tolerance)
+        _shared_matrices.pop(directory, None)
+
+    scores = prefix()
+    scored = [score for score in scores if score['silhouette'] is not None]
+    best = max(scored, key=lambda score: score['silhouette']) if scored else scores[0]
+    return {
+        'k': best['k'],
+        'elbow_k': elbow_k(scores),
+        'scores': scores,
+        'stopped_early': len(scores) < len(k_values),
+    }
+
+
+@metrics.timed('kselect')
+def choose_k(db_path, fingerprint, cache_dir=None, k_min=2, k_max=10, processes=2, patience=2, tolerance=0.01,
+             window=None, pipeline=None):
+    """
+    Return `select_k` for the incidents in `db_path`, cached on disk per database fingerprint and search options.
+
+    `window` limits the search to the incidents of a `(start, end)` range of ISO dates.
+    On a cache miss with an unfitted `ClusteringPipeline` passed in, its
+    preprocessed matrix is scored, so the final fit reuses the same matrix.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), 'kselect_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+
+    options = {'k_min': k_min, 'k_max': k_max, 'patience': patience, 'tolerance': tolerance}
+    payload = json.dumps({'db': fingerprint, 'version': KSELECT_VERSION, 'options': options,
+                          'window': list(window) if window else None}, sort_keys=True)
+    path = os.path.join(cache_dir, f"{hashlib.sha256(payload.encode()).hexdigest()}.json")
+    try:
+        with open(path) as cache_file:
+            return dict(json.load(cache_file), cached=True)
+    except (FileNotFoundError, ValueError):
+        pass
+
+    if pipeline is not None:
+        matrix = pipeline.preprocess().df_scaled
+    else:
+        _, _, matrix = preprocess_features(db_path, sparse=True, window=window)
+    selection = select_k(matrix, processes=processes, **options)
+    metrics.gauge('kselect.k', selection['k'])
+    metrics.gauge('kselect.scored_k', len(selection['scores']))
+    with open(path + '.part', 'w') as cache_file:
+        json.dump(selection, cache_file)
+    os.replace(path + '.part', path)
+    return dict(selection, cached=False)
@@ -1,31 +1,61 @@
 import argparse
 
+import fetcher
 import project0 
+from ingest import ingest
+from parsecache import ParseCache
+import snapshot
 
-def main(url):
-    # Download data
+def main(url, workers=None):
+    # Download, extract and load the data into a new database
     print(url)
-    incidents = None
-    incident_data = project0.fetchincidents(url)
-
-    # Extract data
-    incidents = project0.extractincidents(incident_data)
-	
-    # Create new database
-    db = project0.createdb()
-	
-    # Insert data
-    project0.populatedb(db, incidents)
-	
+    result = ingest(url, workers=workers, cache=ParseCache())
+
+    # Print incident counts
+    for nature, count in result['natures'].items():
+        print(f"{nature}|{count}")
+
+
+def batch(sources, workers=4):
+    # Download URLs concurrently; unchanged reports are answered with 304 and read from disk
+    urls = [source for source in sources if source.startswith(('http://', 'https://'))]
+    downloaded = {}
+    if urls:
+        for result in fetcher.fetch_all(urls, 'resources/downloads', concurrency=workers):
+            print(f"{result['url']}|{result['status']}")
+            downloaded[result['url']] = result['path']
+    sources = [downloaded.get(source, source) for source in sources]
+
+    # Append every new pdf to the existing database
+    db = project0.createdb(reset=False)
+    cache = ParseCache()
+    for source, digest, row_count in project0.ingestbatch(db, sources, workers=workers, cache=cache):
+        if row_count is None:
+            print(f"{source}|skipped (already ingested {digest[:12]})")
+        else:
+            print(f"{source}|{row_count} incidents")
+
+    snapshot.update_snapshot(db)
+
+    stats = cache.stats()
+    print(f"Parse cache|{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions")
+
     # Print incident counts
     project0.status(db)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("--incidents", type=str, required=True, 
+    sources = parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument("--incidents", type=str,
                          help="Incident summary url.")
+    sources.add_argument("--batch", type=str, nargs="+",
+                         help="Incident summary urls, pdf files or directories to append to the database.")
+    parser.add_argument("--workers", type=int, default=None,
+                         help="Processes used for PDF page extraction.")
      
     args = parser.parse_args()
     if args.incidents:
-        main(args.incidents)
\ No newline at end of file
+        main(args.incidents, args.workers)
+    elif args.batch:
+        batch(args.batch, args.workers or 4)
\ No newline at end of file
@@ -0,0 +1,164 @@
+import contextlib
+import cProfile
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+# Counters, gauges and stage timings of this process. Each job starts from an empty registry (see jobs.execute_job)
+# and stores its snapshot with the job, so the web process can aggregate stages it never ran itself.
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+PROFILE_TOP = 40
+
+
+def count(name, value=1):
+    """
+    Add `value` to the counter `name`.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def gauge(name, value):
+    """
+    Set the gauge `name` to its latest `value`, such as a matrix width.
+    """
+    with _lock:
+        _gauges[name] = value
+
+
+def record(name, ms):
+    """
+    Add one observation of `ms` milliseconds to the stage `name`.
+    """
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            _timings[name] = {'count': 1, 'total_ms': ms, 'max_ms': ms}
+        else:
+            timing['count'] += 1
+            timing['total_ms'] += ms
+            timing['max_ms'] = max(timing['max_ms'], ms)
+
+
+@contextlib.contextmanager
+def timed(name):
+    """
+    Record the wall time of the `with` block as the stage `name`, also when it raises.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000)
+
+
+def snapshot():
+    """
+    Return a JSON-serializable copy of the counters, gauges and stage timings.
+    """
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timings': {name: dict(timing) for name, timing in _timings.items()},
+        }
+
+
+def reset():
+    """
+    Clear every counter, gauge and timing.
+    """
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
+
+
+def summarize(snapshots):
+    """
+    Combine snapshots (one per job, oldest first) into summed counters, gauges and per-stage timing statistics.
+
+    Gauges report their latest and largest value. Each stage reports how many
+    snapshots ran it, its total calls and the mean, p95 and max of its
+    per-snapshot milliseconds.
+    """
+    counters = {}
+    gauges = {}
+    stage_ms = {}
+    calls = {}
+    for snap in snapshots:
+        for name, value in snap.get('counters', {}).items():
+            counters[name] = counters.get(name, 0) + value
+        for name, value in snap.get('gauges', {}).items():
+            largest = gauges.get(name, {}).get('max', value)
+            gauges[name] = {'last': value, 'max': max(largest, value)}
+        for name, timing in snap.get('timings', {}).items():
+            stage_ms.setdefault(name, []).append(timing['total_ms'])
+            calls[name] = calls.get(name, 0) + timing['count']
+
+    timings = {}
+    for name, values in sorted(stage_ms.items()):
+        values.sort()
+        timings[name] = {
+            'runs': len(values),
+            'calls': calls[name],
+            'mean_ms': round(sum(values) / len(values), 3),
+            'p95_ms': round(values[min(len(values) - 1, int(0.95 * len(values)))], 3),
+            'max_ms': round(values[-1], 3),
+        }
+    return {'counters': dict(sorted(counters.items())), 'gauges': dict(sorted(gauges.items())), 'timings': timings}
+
+
+@contextlib.contextmanager
+def profiled(mode, directory, name):
+    """
+    Capture a cProfile or tracemalloc report of the `with` block into `directory`.
+
+    cProfile writes `<name>.prof` (open it with `python -m pstats` or
+    snakeviz) and a `<name>.txt` of the top functions by cumulative time;
+    tracemalloc writes `<name>.txt` with the peak and the top allocation
+    sites. The yielded dict gets the report `path` when the block exits.
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode {mode!r}, expected one of {PROFILE_MODES}")
+    os.makedirs(directory, exist_ok=True)
+    report = {'mode': mode, 'path': None}
+    text_path = os.path.join(directory, f"{name}.txt")
+
+    if mode == 'cprofile':
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield report
+        finally:
+            profile.disable()
+            profile.dump_stats(os.path.join(directory, f"{name}.prof"))
+            with open(text_path, 'w') as text_file:
+                pstats.Stats(profile, stream=text_file).sort_stats('cumulative').print_stats(PROFILE_TOP)
+            report['path'] = text_path
+        return
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        yield report
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        statistics = tracemalloc.take_snapshot().statistics('lineno')
+        if started:
+            tracemalloc.stop()
+        with open(text_path, 'w') as text_file:
+            text_file.write(f"current {current / 2**20:.1f} MiB, peak {peak / 2**20:.1f} MiB\n")
+            for statistic in statistics[:PROFILE_TOP]:
+                text_file.write(f"{statistic}\n")
+        report['path'] = text_path
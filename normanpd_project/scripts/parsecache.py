@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+
+# Bump when the rows project0 extracts from a pdf change, so entries from the old parser are not served
+PARSE_VERSION = 2
+
+
+class ParseCache:
+    """
+    On-disk cache of extracted incident rows, keyed by the SHA-256 of the pdf bytes and `PARSE_VERSION`.
+
+    Entries are gzip-compressed JSON row lists. A hit refreshes the entry's
+    modification time, and when the cache grows past `max_bytes` the least
+    recently used entries are evicted first.
+    """
+
+    def __init__(self, cache_dir='resources/parse_cache', max_bytes=64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def digest(incident_data):
+        """
+        Return the cache key for the pdf contents.
+        """
+        return hashlib.sha256(incident_data).hexdigest()
+
+    def path(self, digest):
+        """
+        Return the file holding the entry for `digest` as parsed by the current `PARSE_VERSION`.
+        """
+        return os.path.join(self.cache_dir, f"{digest}.v{PARSE_VERSION}.json.gz")
+
+    def get(self, digest):
+        """
+        Return the cached rows for `digest`, or None on a miss.
+        """
+        path = self.path(digest)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as cache_file:
+                rows = json.load(cache_file)
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return rows
+
+    def put(self, digest, rows):
+        """
+        Store the rows for `digest` and evict old entries if the cache is over its size limit.
+
+        Every writer uses its own temporary file, so workers storing the same
+        pdf at once each publish a complete entry.
+        """
+        path = self.path(digest)
+        part = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with gzip.open(part, 'wt', encoding='utf-8') as cache_file:
+            json.dump(rows, cache_file, separators=(',', ':'))
+        os.replace(part, path)
+        self.evict()
+
+    def entries(self):
+        """
+        Return (mtime, size, path) for every entry, least recently used first.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json.gz'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Evicted by another worker
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in `max_bytes`.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue  # Another worker evicted it first
+            with self.lock:
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Return the hit/miss/eviction counters and the current cache size.
+        """
+        entries = self.entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+        }
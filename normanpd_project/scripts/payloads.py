@@ -0,0 +1,138 @@
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from scripts.clustering import HEATMAP_TOP_N, heatmap_counts, latest_cluster_run
+from scripts.project0 import databaseid
+
+
+# Points returned by `cluster_points` unless the caller asks for another sample size
+API_MAX_POINTS = 20000
+
+# PCA coordinates are rounded to this many decimals, far below a pixel on any chart
+COORDINATE_DECIMALS = 4
+
+
+def resolve_run(conn, run_id=None):
+    """
+    Return (run_id, n_clusters) of `run_id`, or of the newest run when it is None; None if there is no such run.
+    """
+    if run_id is None:
+        run_id = latest_cluster_run(conn)
+    row = conn.execute("SELECT run_id, n_clusters FROM cluster_runs WHERE run_id = ?", (run_id,)).fetchone()
+    return tuple(row) if row else None
+
+
+def etag(*parts):
+    """
+    Return a short ETag value over the parts that determine a payload.
+    """
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def cluster_version(db_path, run_id=None):
+    """
+    Return an ETag for the labels of a run, or None when there is no run.
+
+    Labels are only ever added to a run, so its id and label count identify
+    its contents; both are read from `cluster_counts`. Run ids start over in a
+    re-created database, so its id (`project0.databaseid`) is included too.
+    """
+    with sqlite3.connect(db_path) as conn:
+        run = resolve_run(conn, run_id)
+        if run is None:
+            return None
+        labelled = conn.execute("SELECT COALESCE(SUM(total), 0) FROM cluster_counts WHERE run_id = ?",
+                                (run[0],)).fetchone()[0]
+        database_id = databaseid(conn.cursor())
+    return etag(database_id, run[0], labelled)
+
+
+def cluster_points(db_path, run_id=None, max_points=API_MAX_POINTS, seed=0):
+    """
+    Return the PCA coordinates and labels of a run as columns, or None when there is no run.
+
+    At most `max_points` points are returned, sampled uniformly without
+    replacement (the same sample for the same run). Centroids are the mean
+    PCA position of every point in each cluster, computed before sampling.
+    """
+    with sqlite3.connect(db_path) as conn:
+        run = resolve_run(conn, run_id)
+        if run is None:
+            return None
+        rows = conn.execute("SELECT pca_x, pca_y, cluster FROM incident_clusters \
+                             WHERE run_id = ? AND pca_x IS NOT NULL", (run[0],)).fetchall()
+
+    points = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    labels = points[:, 2].astype(np.int64)
+    clusters = np.unique(labels)
+    centroids = np.array([points[labels == cluster, :2].mean(axis=0) for cluster in clusters]).reshape(-1, 2)
+
+    total = len(points)
+    if max_points is not None and total > max_points:
+        keep = np.sort(np.random.default_rng(seed + run[0]).choice(total, max_points, replace=False))
+        points, labels = points[keep], labels[keep]
+
+    coordinates = np.round(points[:, :2], COORDINATE_DECIMALS)
+    return {
+        'run_id': run[0],
+        'n_clusters': run[1],
+        'total': total,
+        'x': coordinates[:, 0].tolist(),
+        'y': coordinates[:, 1].tolist(),
+        'cluster': labels.tolist(),
+        'centroids': {
+            'cluster': clusters.tolist(),
+            'x': np.round(centroids[:, 0], COORDINATE_DECIMALS).tolist(),
+            'y': np.round(centroids[:, 1], COORDINATE_DECIMALS).tolist(),
+        },
+    }
+
+
+def cluster_sizes(db_path, run_id=None):
+    """
+    Return the number of incidents per cluster of a run as columns, or None when there is no run.
+    """
+    with sqlite3.connect(db_path) as conn:
+        run = resolve_run(conn, run_id)
+        if run is None:
+            return None
+        rows = conn.execute("SELECT cluster, total FROM cluster_counts WHERE run_id = ? AND total > 0 ORDER BY cluster",
+                            (run[0],)).fetchall()
+    return {
+        'run_id': run[0],
+        'n_clusters': run[1],
+        'cluster': [cluster for cluster, _ in rows],
+        'count': [total for _, total in rows],
+    }
+
+
+def heatmap_version(db_path, top_n=HEATMAP_TOP_N, bucket=None, window=None):
+    """
+    Return an ETag for the hour x location counts.
+
+    It is a checksum over the `hour_location_counts` rows, which is one small
+    row per hour and location instead of a scan of the incidents. It covers
+    every day, so it also changes whenever a window's counts do. The database
+    id tells a re-created database with the same counts apart.
+    """
+    with sqlite3.connect(db_path) as conn:
+        checksum = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(total), 0), COALESCE(SUM(total * (incident_hour + 1) * location_id), 0) \
+             FROM hour_location_counts"
+        ).fetchone()
+        database_id = databaseid(conn.cursor())
+    return etag(database_id, tuple(checksum), top_n, bucket, window)
+
+
+def heatmap_payload(db_path, top_n=HEATMAP_TOP_N, bucket=None, window=None):
+    """
+    Return the hour x location counts of `heatmap_counts` as a row-major flat list with its hours and locations.
+    """
+    heatmap_data = heatmap_counts(db_path, top_n=top_n, bucket=bucket, window=window)
+    return {
+        'hours': heatmap_data.index.tolist(),
+        'locations': heatmap_data.columns.tolist(),
+        'counts': heatmap_data.to_numpy().astype(int).ravel().tolist(),
+    }
@@ -5,6 +5,33 @@ import pypdf
 from pypdf import PdfReader
 import sqlite3
 import io
+import functools
+import hashlib
+import itertools
+import calendar
+import shutil
+import uuid
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from scripts import metrics
+except ImportError:  # imported from inside scripts/, as main.py does
+    import metrics
+
+
+def downloadincidents(url):
+    """
+        Download the incident pdf from a URL without writing it to disk.
+        Args:
+            url: url of the incident pdf
+        Return:
+            data: pdf file contents
+    """
+    headers = {}
+    headers['User-Agent'] = "Mozilla/5.0 (X11; Linux i686) AppleWebKit/537.17 (KHTML, like Gecko) Chrome/24.0.1312.27 Safari/537.17"
+
+    return urllib.request.urlopen(urllib.request.Request(url, headers=headers)).read()
 
 
 def fetchincidents(url):
@@ -16,10 +43,7 @@ def fetchincidents(url):
             file_path: path of the downloaded pdf file
     '''
 
-    headers = {}
-    headers['User-Agent'] = "Mozilla/5.0 (X11; Linux i686) AppleWebKit/537.17 (KHTML, like Gecko) Chrome/24.0.1312.27 Safari/537.17"                          
-
-    data = urllib.request.urlopen(urllib.request.Request(url, headers=headers)).read()
+    data = downloadincidents(url)
     # temp = os.path.join(os.getcwd(), 'resources/')
     # file_path = os.path.join(temp, "Daily_Incident_Summary.pdf")
     # folder = 'resorces/'
@@ -32,140 +56,771 @@ def fetchincidents(url):
     return data
 
 
-def extractincidents(incident_data):
+# Pattern for matching records
+INCIDENT_PATTERN = r"""(\d{1,2}/\d{1,2}/\d{4})       # Date (e.g., 8/1/2024)
+                \s+
+                (\d{1,2}:\d{2})             # Time (e.g., 1:19)
+                \s{2,}
+                (\d{4}-\d+)                 # Incident Number (e.g., 2024-00055436)
+                \s{2,}
+                (.+?)\s{2,}                 # Address
+                (.+?)\s{2,}                 # Incident Type (e.g., Traffic Stop)
+                ([A-Z0-9]+)$"""             # Final Code (e.g., OK0140200)
+
+# Compile the regex pattern with verbose flag for readability
+INCIDENT_REGEX = re.compile(INCIDENT_PATTERN, re.VERBOSE)
+
+
+def extractpagelines(page, index, page_count):
+    """
+        Extracts the text lines of a single page in layout mode, without the header and footer lines.
+        Args:
+            page: pypdf page object
+            index: position of the page in the document
+            page_count: number of pages in the document
+        Return:
+            row_contents: list of text lines on the page
+    """
+    with metrics.timed('extract.layout'):
+        text = page.extract_text(extraction_mode="layout", layout_mode_space_vertically=False).splitlines()
+    # To eleminate the header row and extra text
+    if index == 0:
+        return text[3:]
+    elif index == page_count - 1:
+        return text[:-1]
+    return text
+
+
+def extractpagerange(incident_data, start, stop):
+    """
+        Extracts the text lines of pages [start, stop). Runs inside the extraction worker processes.
+        Args:
+            incident_data: pdf file contents
+            start: index of the first page
+            stop: index after the last page
+        Return:
+            A list with the text lines of every page in the range
+    """
+    reader = PdfReader(io.BytesIO(incident_data))
+    page_count = len(reader.pages)
+    return [extractpagelines(reader.pages[index], index, page_count) for index in range(start, stop)]
+
+
+def matchincidentline(line):
+    """
+        Parses a record line with INCIDENT_REGEX.
+        Args:
+            line: text line of a page
+        Return:
+            (record, column starts) or (None, None) when the line is not a record
+    """
+    row_check = INCIDENT_REGEX.match(line)
+    if not row_check:
+        return None, None
+    extracted_data = [i.strip() for i in row_check.groups()]
+    extracted_data[:2] = [' / '.join(extracted_data[:2])] # Merging the "date / time" values
+    return extracted_data, tuple(row_check.start(group) for group in range(3, 7))
+
+
+@functools.lru_cache(maxsize=64)
+def columnregex(starts):
+    """
+        Compiles a record pattern pinned to the column positions of one page.
+        Each field is anchored to its column with a fixed-width lookbehind and holds no run of two spaces, so
+        nothing is scanned lazily or backtracked across columns and the groups come out already stripped. A
+        line it matches gives exactly the fields INCIDENT_REGEX would.
+        Args:
+            starts: start offsets of the incident number, location, nature and ORI columns
+        Return:
+            compiled pattern for `fullmatch`
+    """
+    number_start, location_start, nature_start, ori_start = starts
+    return re.compile(rf"""(\d{{1,2}}/\d{{1,2}}/\d{{4}})\s+(\d{{1,2}}:\d{{2}})
+                          \ \ +(?<=^.{{{number_start}}})(\d{{4}}-\d+)
+                          \ \ +(?<=^.{{{location_start}}})(\S+(?:\ \S+)*)
+                          \ \ +(?<=^.{{{nature_start}}})(\S+(?:\ \S+)*)
+                          \ \ +(?<=^.{{{ori_start}}})([A-Z0-9]+)""", re.VERBOSE)
+
+
+def iterincidentrows(pages):
+    """
+        Parses the text lines into records and yields each record once its address is complete.
+        The column positions are taken from the first line on each page that matches INCIDENT_REGEX; later
+        lines are matched against `columnregex` for those positions, with INCIDENT_REGEX as the fallback for
+        lines that do not fit the columns. A record is held back until the next record (or the end of the
+        input) starts, since the following lines, even at the top of the next page, may continue its address.
+        Pages, rows, fallback matches and merged continuation lines are added to the `parse.*` counters once per page.
+        Args:
+            pages: iterable of per-page text line lists, in document order
+        Yields:
+            One incident record list at a time
+    """
+    pending = None
+    for row_contents in pages:
+        columns = None
+        rows = fallbacks = merged = 0
+        for line in row_contents:
+            # Records start with the date in the first column; anything indented continues an address
+            record = None
+            if line[:1].isdigit():
+                row_check = columns.fullmatch(line) if columns is not None else None
+                if row_check:
+                    date, time, *fields = row_check.groups()
+                    record = [f"{date} / {time}", *fields]
+                else:
+                    fallbacks += 1
+                    record, starts = matchincidentline(line)
+                    if columns is None and starts is not None:
+                        columns = columnregex(starts)
+            if record is not None:
+                rows += 1
+                if pending is not None:
+                    yield pending
+                pending = record
+            elif pending is not None:
+                # Multi row record adding the address
+                merged += 1
+                pending[2] = pending[2] + " " + line.lstrip()
+        metrics.count('parse.pages')
+        metrics.count('parse.rows', rows)
+        metrics.count('parse.regex_fallbacks', fallbacks)
+        metrics.count('parse.merged_lines', merged)
+    if pending is not None:
+        yield pending
+
+
+def parseincidentlines(pages):
+    """
+        Matches the text lines against the record pattern, merging multi-line addresses into the previous record.
+        Args:
+            pages: iterable of per-page text line lists, in document order
+        Return:
+            all_rows: A list containing all the individual incident records
+    """
+    return list(iterincidentrows(pages))
+
+
+def iterincidents(source):
+    """
+        Extracts the incident records one page at a time without loading every row first.
+        Args:
+            source: pdf file contents, a pdf file path or a binary file object; a path is read lazily from disk
+        Yields:
+            One incident record list at a time, in document order
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    reader = PdfReader(source)
+    page_count = len(reader.pages)
+    pages = (extractpagelines(reader.pages[index], index, page_count) for index in range(page_count))
+    yield from iterincidentrows(pages)
+
+
+@metrics.timed('extract')
+def extractincidents(incident_data, workers=None):
     """
         Extracts the data from pdf file using PdfReader. Extracts the data using regular expression match and stores in a list.
         Args:
-            incident_data: Path of the pdf file
+            incident_data: pdf file contents
+            workers: number of processes used for layout extraction; None or 1 extracts serially
         Return:
             all_rows: A list containing all the individual incident records
     """
-    pdf_data = io.BytesIO(incident_data)
-    pdf_data.seek(0)
-    reader = PdfReader(pdf_data)
-    
-    all_rows = []
-    page = reader.pages[0]
-    first_page = True
-    last_page = len(reader.pages)
-
-
-    # Pattern for matching records
-    pattern = r"""(\d{1,2}/\d{1,2}/\d{4})       # Date (e.g., 8/1/2024)
-                    \s+
-                    (\d{1,2}:\d{2})             # Time (e.g., 1:19)
-                    \s{2,}
-                    (\d{4}-\d+)                 # Incident Number (e.g., 2024-00055436)
-                    \s{2,}
-                    (.+?)\s{2,}                 # Address
-                    (.+?)\s{2,}                 # Incident Type (e.g., Traffic Stop)
-                    ([A-Z0-9]+)$"""             # Final Code (e.g., OK0140200)
-
-    # Compile the regex pattern with verbose flag for readability
-    regex = re.compile(pattern, re.VERBOSE)
-
-    # Shows the extracted text
-    for page in reader.pages:
-        # To eleminate the header row and extra text 
-        if first_page:
-            row_contents = page.extract_text(extraction_mode="layout", layout_mode_space_vertically=False).splitlines()[3:]
-            first_page = False
-        elif last_page == 1:
-            row_contents = page.extract_text(extraction_mode="layout", layout_mode_space_vertically=False).splitlines()[:-1]
-        else:
-            row_contents = page.extract_text(extraction_mode="layout", layout_mode_space_vertically=False).splitlines()
-        for index in range(len(row_contents)):
-            row_check = regex.match(row_contents[index])
-            if row_check:
-                extracted_data = [i.strip() for i  in row_check.groups()]
-                extracted_data[:2] = [' / '.join(extracted_data[:2])] # Merging the "date / time" values
-                all_rows.append(extracted_data)
-            else:
-                # Multi row record adding the address
-                all_rows[-1][2] = all_rows[-1][2] + " " + row_contents[index].lstrip()
-        last_page -= 1
+    page_count = len(PdfReader(io.BytesIO(incident_data)).pages)
+
+    if not workers or workers < 2 or page_count < 2:
+        return list(iterincidents(incident_data))
+
+    # Split the pages into contiguous ranges, one per worker, and keep them in document order
+    workers = min(workers, page_count)
+    bounds = [page_count * i // workers for i in range(workers + 1)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = executor.map(extractpagerange, [incident_data] * workers, bounds[:-1], bounds[1:])
+        pages = [lines for chunk in chunks for lines in chunk]
+
+    # Address continuations can cross page and worker boundaries, so rows are stitched serially
+    return parseincidentlines(pages)
+
+
+def extractincidentscached(incident_data, cache, workers=None):
+    """
+        Extracts the incident records, reusing the rows cached for identical pdf bytes so pypdf is skipped entirely.
+        Args:
+            incident_data: pdf file contents
+            cache: ParseCache instance, or None to always extract
+            workers: number of processes used for layout extraction
+        Return:
+            all_rows: A list containing all the individual incident records
+    """
+    if cache is None:
+        return extractincidents(incident_data, workers=workers)
+
+    digest = cache.digest(incident_data)
+    all_rows = cache.get(digest)
+    metrics.count('parse_cache.hits' if all_rows is not None else 'parse_cache.misses')
+    if all_rows is None:
+        all_rows = extractincidents(incident_data, workers=workers)
+        cache.put(digest, all_rows)
     return all_rows
 
 
-def createdb():
+INCIDENT_COLUMNS = ['incident_time', 'incident_number', 'incident_location', 'nature', 'incident_ori']
+
+
+def createschema(cur):
+    """
+        Creates the typed incidents table, its lookup tables and indexes if they are missing.
+        The text columns are kept next to the parsed and integer-coded ones so existing readers keep working.
+        Args:
+            cur : database cursor
+    """
+    cur.execute("CREATE TABLE IF NOT EXISTS natures ( \
+                    id INTEGER PRIMARY KEY, \
+                    name TEXT NOT NULL UNIQUE \
+                );")
+    cur.execute("CREATE TABLE IF NOT EXISTS locations ( \
+                    id INTEGER PRIMARY KEY, \
+                    name TEXT NOT NULL UNIQUE \
+                );")
+    cur.execute("CREATE TABLE IF NOT EXISTS incidents ( \
+                    id INTEGER PRIMARY KEY, \
+                    incident_time TEXT, \
+                    incident_number TEXT, \
+                    incident_location TEXT, \
+                    nature TEXT, \
+                    incident_ori TEXT, \
+                    incident_epoch INTEGER, \
+                    incident_hour INTEGER, \
+                    nature_id INTEGER REFERENCES natures(id), \
+                    location_id INTEGER REFERENCES locations(id) \
+                );")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_incidents_number ON incidents(incident_number)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_incidents_nature ON incidents(nature_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_incidents_hour_location ON incidents(incident_hour, location_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_incidents_epoch ON incidents(incident_epoch)")
+    # Clustering results; readers use the newest committed run. window_start/window_end are the ISO dates
+    # a windowed run clustered (NULL for an open end or the whole table)
+    cur.execute("CREATE TABLE IF NOT EXISTS cluster_runs ( \
+                    run_id INTEGER PRIMARY KEY, \
+                    n_clusters INTEGER, \
+                    mode TEXT, \
+                    created_at TEXT, \
+                    window_start TEXT, \
+                    window_end TEXT \
+                );")
+    # pca_x/pca_y are the incident's coordinates in the run's 2D PCA projection, NULL when not computed
+    cur.execute("CREATE TABLE IF NOT EXISTS incident_clusters ( \
+                    run_id INTEGER NOT NULL REFERENCES cluster_runs(run_id), \
+                    incident_number TEXT NOT NULL, \
+                    cluster INTEGER NOT NULL, \
+                    pca_x REAL, \
+                    pca_y REAL, \
+                    PRIMARY KEY (run_id, incident_number) \
+                ) WITHOUT ROWID;")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_incident_clusters_run_cluster ON incident_clusters(run_id, cluster)")
+    # Content hashes of the pdf files that have been ingested
+    cur.execute("CREATE TABLE IF NOT EXISTS ingested_files ( \
+                    sha256 TEXT PRIMARY KEY, \
+                    source TEXT, \
+                    row_count INTEGER, \
+                    ingested_at TEXT \
+                );")
+    # A random id given to the database when it is created, so caches can tell a recreated database apart
+    cur.execute("CREATE TABLE IF NOT EXISTS database_meta ( \
+                    key TEXT PRIMARY KEY, \
+                    value TEXT \
+                );")
+    cur.execute("INSERT OR IGNORE INTO database_meta VALUES ('database_id', ?)", (uuid.uuid4().hex,))
+    createaggregates(cur)
+
+
+def databaseid(cur):
+    """
+        Returns the id createschema gave the database.
+        Args:
+            cur : database cursor
+        Returns:
+            The id, or None for a database that was never migrated to the typed schema
+    """
+    try:
+        row = cur.execute("SELECT value FROM database_meta WHERE key = 'database_id'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+# Precomputed counts: the GROUP BY each one materializes and its key columns; see createaggregates
+AGGREGATE_QUERIES = {
+    'nature_counts': ("SELECT nature_id, COUNT(*) FROM incidents WHERE {rows} AND nature_id IS NOT NULL \
+                       GROUP BY nature_id", "nature_id"),
+    'hour_location_counts': ("SELECT incident_hour, location_id, COUNT(*) FROM incidents \
+                              WHERE {rows} AND incident_hour IS NOT NULL AND location_id IS NOT NULL \
+                              GROUP BY incident_hour, location_id", "incident_hour, location_id"),
+    'day_counts': ("SELECT date(incident_epoch, 'unixepoch'), COUNT(*) FROM incidents \
+                    WHERE {rows} AND incident_epoch IS NOT NULL GROUP BY 1", "day"),
+}
+CLUSTER_COUNTS_QUERY = "SELECT run_id, cluster, COUNT(*) FROM incident_clusters WHERE {rows} GROUP BY run_id, cluster"
+
+
+def aggregatechanges(row, sign):
+    """
+        Returns the trigger statements that add `sign` (+1 or -1) for one incidents row to every incidents aggregate.
+        Args:
+            row : "NEW" or "OLD"
+            sign : 1 or -1
+    """
+    return f"""
+        INSERT INTO nature_counts SELECT {row}.nature_id, {sign} WHERE {row}.nature_id IS NOT NULL
+            ON CONFLICT (nature_id) DO UPDATE SET total = total + {sign};
+        INSERT INTO hour_location_counts SELECT {row}.incident_hour, {row}.location_id, {sign}
+            WHERE {row}.incident_hour IS NOT NULL AND {row}.location_id IS NOT NULL
+            ON CONFLICT (incident_hour, location_id) DO UPDATE SET total = total + {sign};
+        INSERT INTO day_counts SELECT date({row}.incident_epoch, 'unixepoch'), {sign}
+            WHERE {row}.incident_epoch IS NOT NULL
+            ON CONFLICT (day) DO UPDATE SET total = total + {sign};"""
+
+
+def createaggregates(cur):
+    """
+        Creates the aggregate tables (incident counts by nature, by hour and location, by day, and label counts
+        by cluster run) so status, the comparison plot and the heatmap read one small row per group instead of
+        scanning `incidents`.
+        Inserts are counted in bulk by `addincidentcounts` and `countclusterrun`, since a trigger per inserted
+        row makes loading much slower; deleting or updating incidents, and deleting cluster runs, adjusts the
+        counts through triggers. Counts can drop to 0 but rows are kept. `checkaggregates` finds and repairs
+        any drift.
+        Args:
+            cur : database cursor
+    """
+    cur.execute("CREATE TABLE IF NOT EXISTS nature_counts ( \
+                    nature_id INTEGER PRIMARY KEY, \
+                    total INTEGER NOT NULL \
+                );")
+    cur.execute("CREATE TABLE IF NOT EXISTS hour_location_counts ( \
+                    incident_hour INTEGER NOT NULL, \
+                    location_id INTEGER NOT NULL, \
+                    total INTEGER NOT NULL, \
+                    PRIMARY KEY (incident_hour, location_id) \
+                ) WITHOUT ROWID;")
+    cur.execute("CREATE TABLE IF NOT EXISTS day_counts ( \
+                    day TEXT PRIMARY KEY, \
+                    total INTEGER NOT NULL \
+                ) WITHOUT ROWID;")
+    cur.execute("CREATE TABLE IF NOT EXISTS cluster_counts ( \
+                    run_id INTEGER NOT NULL, \
+                    cluster INTEGER NOT NULL, \
+                    total INTEGER NOT NULL, \
+                    PRIMARY KEY (run_id, cluster) \
+                ) WITHOUT ROWID;")
+
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS incidents_aggregate_delete AFTER DELETE ON incidents BEGIN \
+                    {aggregatechanges('OLD', -1)} \
+                END;")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS incidents_aggregate_update \
+                AFTER UPDATE OF nature_id, incident_hour, location_id, incident_epoch ON incidents BEGIN \
+                    {aggregatechanges('OLD', -1)} \
+                    {aggregatechanges('NEW', 1)} \
+                END;")
+    cur.execute("CREATE TRIGGER IF NOT EXISTS cluster_runs_aggregate_delete AFTER DELETE ON cluster_runs BEGIN \
+                    DELETE FROM cluster_counts WHERE run_id = OLD.run_id; \
+                END;")
+
+
+def addincidentcounts(cur, after_id):
+    """
+        Adds the incidents inserted after `after_id` to the aggregate tables with one GROUP BY per table.
+        New rows always get larger ids than existing ones, so the range holds exactly the rows just inserted.
+        Args:
+            cur : database cursor
+            after_id : largest incidents.id before the insert, 0 for an empty table
+    """
+    for table, (query, key) in AGGREGATE_QUERIES.items():
+        cur.execute(f"INSERT INTO {table} {query.format(rows='id > ?')} \
+                      ON CONFLICT ({key}) DO UPDATE SET total = total + excluded.total", (after_id,))
+
+
+def countclusterrun(cur, run_id):
+    """
+        Recounts the labels of one cluster run into `cluster_counts`; an index-only count on (run_id, cluster).
+        Args:
+            cur : database cursor
+            run_id : cluster run whose labels were written
+    """
+    cur.execute("DELETE FROM cluster_counts WHERE run_id = ?", (run_id,))
+    cur.execute(f"INSERT INTO cluster_counts {CLUSTER_COUNTS_QUERY.format(rows='run_id = ?')}", (run_id,))
+
+
+def rebuildaggregates(cur):
+    """
+        Recomputes every aggregate table from `incidents` and `incident_clusters`.
+        Args:
+            cur : database cursor
+    """
+    for table, (query, _) in AGGREGATE_QUERIES.items():
+        cur.execute(f"DELETE FROM {table}")
+        cur.execute(f"INSERT INTO {table} {query.format(rows='1')}")
+    cur.execute("DELETE FROM cluster_counts")
+    cur.execute(f"INSERT INTO cluster_counts {CLUSTER_COUNTS_QUERY.format(rows='1')}")
+
+
+def checkaggregates(db, repair=False):
+    """
+        Compares the aggregate tables with a fresh GROUP BY over the base tables.
+        Args:
+            db : path to the database.
+            repair : rebuild the aggregates when any of them differs
+        Returns:
+            A {table: number of groups whose count differs} dict
+    """
+    migratedb(db)
+    with sqlite3.connect(db) as con:
+        cur = con.cursor()
+        queries = {table: query for table, (query, _) in AGGREGATE_QUERIES.items()}
+        queries['cluster_counts'] = CLUSTER_COUNTS_QUERY
+        mismatches = {}
+        for table, query in queries.items():
+            # Groups whose count differs on either side; zero counts are the same as a missing row
+            stored = {row[:-1]: row[-1] for row in cur.execute(f"SELECT * FROM {table} WHERE total != 0")}
+            expected = {row[:-1]: row[-1] for row in cur.execute(query.format(rows='1'))}
+            mismatches[table] = sum(stored.get(key) != expected.get(key) for key in stored.keys() | expected.keys())
+        if repair and any(mismatches.values()):
+            rebuildaggregates(cur)
+            con.commit()
+    return mismatches
+
+
+def createdb(db_path='resources/normanpd.db', reset=True):
     """
         Creates a database in the resources directory
         Args:
+            db_path: path for the database.
+            reset: remove an existing database first; with False an existing database is migrated and kept.
         Returns:
             db_path: path for the databse.
     """
-    # Define the path and database name
-    # par_dir = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-    # db_directory = os.path.join(par_dir, 'resources')
-    # db_directory = 'resources'
-    # db_path = os.path.join(os.getcwd(),db_directory, 'normanpd.db')
-    # Remove the directory if it exists, and recreate it
-    db_path = 'resources/normanpd.db'
-    if os.path.exists(db_path):
-        os.remove(db_path) # Remove the existing directory and its contents
+    # Remove the existing database unless we are appending to it
+    if reset:
+        # Also drop the WAL sidecar files, or SQLite would replay them into the new file
+        for path in (db_path, db_path + '-wal', db_path + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+        # And the columnar snapshot of the old incidents (scripts/snapshot.py snapshot_dir)
+        shutil.rmtree(os.path.abspath(db_path) + '.snapshot', ignore_errors=True)
 
     # Create the directory
-    # os.makedirs(db_directory)
-    with sqlite3.connect(db_path) as con:
-        cur = con.cursor()
-        cur.execute("CREATE TABLE incidents ( \
-                        incident_time TEXT, \
-                        incident_number TEXT, \
-                        incident_location TEXT, \
-                        nature TEXT, \
-                        incident_ori TEXT \
-                    );")
-        # To verify if the table ahs been created
-        res = cur.execute("SELECT name FROM sqlite_master")
+    db_directory = os.path.dirname(db_path)
+    if db_directory:
+        os.makedirs(db_directory, exist_ok=True)
+    migratedb(db_path)
     return db_path
 
-def populatedb(db, incidents):
+
+def tablecolumns(cur, table):
+    """
+        Returns the column names of a table, or an empty list when it does not exist.
+    """
+    return [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]
+
+
+def parseincidenttime(incident_time):
     """
-        Insert all the records into db using multiple insert.
+        Parses a "date / time" value into a UTC epoch timestamp and the hour of the day.
         Args:
-            db : databse path
+            incident_time: e.g. "12/5/2024 / 0:14"; ISO timestamps are accepted as well
+        Returns:
+            (epoch, hour), or (None, None) when the value cannot be parsed
+    """
+    try:
+        parsed = datetime.strptime(incident_time, "%m/%d/%Y / %H:%M")
+    except (TypeError, ValueError):
+        try:
+            parsed = datetime.fromisoformat(incident_time)
+        except (TypeError, ValueError):
+            return None, None
+    return calendar.timegm(parsed.timetuple()), parsed.hour
+
+
+def lookupcodes(cur, table, names):
+    """
+        Returns a {name: id} mapping for a lookup table, adding the names that are missing.
+        Args:
+            cur : database cursor
+            table : "natures" or "locations"
+            names : values to encode
+    """
+    names = {name for name in names if name is not None}
+    cur.executemany(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", [(name,) for name in names])
+    return {name: code for code, name in cur.execute(f"SELECT id, name FROM {table}") if name in names}
+
+
+def incidentrecords(cur, incidents):
+    """
+        Adds the parsed time, hour of day and lookup codes to incident records.
+        Args:
+            cur : database cursor
             incidents : list of incident records form pdf file.
         Returns:
+            A list of tuples in `INCIDENT_COLUMNS` order followed by epoch, hour, nature_id and location_id
+    """
+    natures = lookupcodes(cur, 'natures', [row[3] for row in incidents])
+    locations = lookupcodes(cur, 'locations', [row[2] for row in incidents])
+    return [(*row, *parseincidenttime(row[0]), natures.get(row[3]), locations.get(row[2]))
+            for row in incidents]
+
+
+def movelabels(cur, table, key_column):
+    """
+        Moves the `cluster` column of an older incidents table into a new cluster run.
+        Args:
+            cur : database cursor
+            table : table holding the old `cluster` column
+            key_column : column of `table` matching incidents.id
+    """
+    n_clusters = cur.execute(f"SELECT COUNT(DISTINCT cluster) FROM {table}").fetchone()[0]
+    run_id = cur.execute("INSERT INTO cluster_runs (n_clusters, mode, created_at) VALUES (?, 'migrated', ?)",
+                         (n_clusters, datetime.now(timezone.utc).isoformat())).lastrowid
+    cur.execute(f"INSERT INTO incident_clusters (run_id, incident_number, cluster) \
+                  SELECT ?, i.incident_number, t.cluster FROM {table} t JOIN incidents i ON i.id = t.{key_column} \
+                  WHERE t.cluster IS NOT NULL AND i.incident_number IS NOT NULL", (run_id,))
+    countclusterrun(cur, run_id)
 
+
+def migratedb(db):
+    """
+        Brings a database up to the typed schema. Older all-TEXT incidents tables are rebuilt in place,
+        keeping their rowids, with the parsed timestamp, hour and lookup codes filled in.
+        Rows whose incident number was lost (the old clustering write-back replaced the table without it)
+        get a "legacy-<rowid>" placeholder so they stay unique and addressable. An old `cluster` column is
+        moved into a cluster run, and cluster runs from before the stored PCA coordinates or windows get empty ones.
+        The database is switched to WAL mode so readers never block on writers.
+        Args:
+            db : databse path
     """
-    if not incidents:
+    with sqlite3.connect(db) as con:
+        cur = con.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        columns = tablecolumns(cur, 'incidents')
+        legacy = bool(columns) and 'incident_epoch' not in columns
+        aggregated = bool(tablecolumns(cur, 'nature_counts'))
+        if legacy:
+            cur.execute("ALTER TABLE incidents RENAME TO incidents_legacy")
+        createschema(cur)
+        if 'pca_x' not in tablecolumns(cur, 'incident_clusters'):
+            cur.execute("ALTER TABLE incident_clusters ADD COLUMN pca_x REAL")
+            cur.execute("ALTER TABLE incident_clusters ADD COLUMN pca_y REAL")
+        if 'window_start' not in tablecolumns(cur, 'cluster_runs'):
+            cur.execute("ALTER TABLE cluster_runs ADD COLUMN window_start TEXT")
+            cur.execute("ALTER TABLE cluster_runs ADD COLUMN window_end TEXT")
+        if columns and not legacy and not aggregated:
+            # Typed tables from before the aggregates were added
+            rebuildaggregates(cur)
+        if not legacy:
+            # Typed tables that still carry labels in the incidents table
+            if 'cluster' in columns:
+                movelabels(cur, 'incidents', 'id')
+                cur.execute("ALTER TABLE incidents DROP COLUMN cluster")
+                con.commit()
+            return
+
+        select = ', '.join(column if column in columns else 'NULL' for column in INCIDENT_COLUMNS)
+        rows = cur.execute(f"SELECT rowid, {select} FROM incidents_legacy ORDER BY rowid").fetchall()
+        rowids = [row[0] for row in rows]
+        incidents = [[time, number if number is not None else f"legacy-{rowid}", location, nature, ori]
+                     for rowid, time, number, location, nature, ori in rows]
+        records = incidentrecords(cur, incidents)
+        cur.executemany("INSERT INTO incidents VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(rowid, *record) for rowid, record in zip(rowids, records)])
+        addincidentcounts(cur, 0)
+
+        # Keep cluster labels written by earlier clustering runs
+        if 'cluster' in columns:
+            movelabels(cur, 'incidents_legacy', 'rowid')
+        cur.execute("DROP TABLE incidents_legacy")
+        con.commit()
+
+
+POPULATE_CHUNK_SIZE = 5000
+
+
+@metrics.timed('load')
+def populatedb(db, incidents, chunk_size=POPULATE_CHUNK_SIZE):
+    """
+        Insert all the records into db using multiple insert, `chunk_size` records per executemany.
+        Only one chunk is held in memory, so `incidents` can be a generator such as `iterincidents`.
+        Args:
+            db : databse path
+            incidents : list or iterable of incident records form pdf file.
+            chunk_size : records passed to each executemany call
+        Returns:
+
+    """
+    incidents = iter(incidents)
+    chunk = list(itertools.islice(incidents, chunk_size))
+    if not chunk:
         return
     try:
         with sqlite3.connect(db) as con:
             cur = con.cursor()
-
-            res = cur.execute("SELECT name FROM sqlite_master")
-            table_name = res.fetchone()[0]
-
-            # Insert values into db
-            sql = f"INSERT INTO {table_name} VALUES(?, ?, ?, ?, ?)"
-            cur.executemany(sql, incidents)
+            while chunk:
+                insertincidents(cur, chunk)
+                chunk = list(itertools.islice(incidents, chunk_size))
             con.commit()
     except Exception as e:
         print(f"Error database not populated: {e}")
 
 
-def status(db):
+def insertincidents(cur, incidents):
     """
-        Extract and print individual natures from the database and with the total number of it's occurences on the terminal.
+        Insert incident records using the given cursor, inside the caller's transaction.
+        Records whose incident number is already stored are ignored; the inserted ones are added to the aggregates.
+        Args:
+            cur : database cursor
+            incidents : list of incident records form pdf file.
+        Returns:
+            The number of records inserted
+    """
+    # Insert values into db
+    sql = "INSERT OR IGNORE INTO incidents ( \
+               incident_time, incident_number, incident_location, nature, incident_ori, \
+               incident_epoch, incident_hour, nature_id, location_id \
+           ) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    after_id = cur.execute("SELECT COALESCE(MAX(id), 0) FROM incidents").fetchone()[0]
+    cur.executemany(sql, incidentrecords(cur, incidents))
+    inserted = cur.rowcount
+    addincidentcounts(cur, after_id)
+    metrics.count('load.rows', inserted)
+    return inserted
+
+
+def expandsources(sources):
+    """
+        Expand directories into the pdf files they contain, keeping URLs and file paths as they are.
+        Args:
+            sources : list of URLs, pdf file paths or directories
+        Returns:
+            A list of URLs and pdf file paths
+    """
+    expanded = []
+    for source in sources:
+        if os.path.isdir(source):
+            expanded.extend(sorted(os.path.join(source, name) for name in os.listdir(source)
+                                   if name.lower().endswith('.pdf')))
+        else:
+            expanded.append(source)
+    return expanded
+
+
+def readincidentsource(source):
+    """
+        Read the pdf contents of a URL or local file path.
+        Args:
+            source : URL or pdf file path
+        Returns:
+            data: pdf file contents
+    """
+    with metrics.timed('fetch'):
+        if '://' in source:
+            data = downloadincidents(source)
+        else:
+            with open(source, 'rb') as pdf_file:
+                data = pdf_file.read()
+    metrics.count('fetch.bytes', len(data))
+    return data
+
+
+def ingestbatch(db, sources, workers=4, cache=None):
+    """
+        Fetch and parse many incident pdfs concurrently and append them to the database in one transaction.
+        Files whose SHA-256 is already recorded in `ingested_files` (or repeated within the batch) are skipped.
+        Args:
+            db : databse path, created with createdb(reset=False)
+            sources : list of URLs, pdf file paths or directories
+            workers : number of download threads and parsing processes
+            cache : optional ParseCache; cached files are not parsed again
+        Returns:
+            results: list of (source, sha256, row count) tuples; row count is None for skipped files
+    """
+    sources = expandsources(sources)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        contents = list(executor.map(readincidentsource, sources))
+
+    with sqlite3.connect(db) as con:
+        known = {row[0] for row in con.execute("SELECT sha256 FROM ingested_files")}
+
+    digests = [hashlib.sha256(data).hexdigest() for data in contents]
+    row_counts = {}
+    pending = []
+    for source, digest, data in zip(sources, digests, contents):
+        if digest not in known:
+            known.add(digest)
+            pending.append((source, digest, data))
+
+    # Layout extraction is CPU-bound, so cache misses are parsed in separate processes
+    parsed = [cache.get(digest) if cache is not None else None for _, digest, _ in pending]
+    misses = [index for index, rows in enumerate(parsed) if rows is None]
+    if misses:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for index, rows in zip(misses, executor.map(extractincidents, [pending[index][2] for index in misses])):
+                parsed[index] = rows
+                if cache is not None:
+                    cache.put(pending[index][1], rows)
+
+    ingested_at = datetime.now(timezone.utc).isoformat()
+    with sqlite3.connect(db) as con:
+        cur = con.cursor()
+        for (source, digest, _), incidents in zip(pending, parsed):
+            insertincidents(cur, incidents)
+            cur.execute("INSERT INTO ingested_files VALUES(?, ?, ?, ?)",
+                        (digest, source, len(incidents), ingested_at))
+            row_counts[(source, digest)] = len(incidents)
+        con.commit()
+
+    return [(source, digest, row_counts.pop((source, digest), None))
+            for source, digest in zip(sources, digests)]
+
+
+def naturecounts(db):
+    """
+        Count the incidents of every nature.
         Args:
             db : path to the database.
+        Returns:
+            A list of (nature, count) tuples sorted by nature
     """
-    try:
-        with sqlite3.connect(db) as con:
-            cur = con.cursor()
-            res = cur.execute("SELECT name FROM sqlite_master")
-            table_name = res.fetchone()[0]
+    with sqlite3.connect(db) as con:
+        cur = con.cursor()
+
+        #fetch the precomputed counts; one row per nature however many incidents there are
+        sql = "SELECT n.name, c.total FROM nature_counts c JOIN natures n ON n.id = c.nature_id \
+               WHERE c.total > 0 ORDER BY n.name"
 
-            #fetch values from the table
-            sql = f"SELECT nature, count(*) FROM {table_name} GROUP BY nature"
+        # Execute the query
+        cur.execute(sql)
+        return cur.fetchall()
 
-            # Execute the query
-            cur.execute(sql)
 
-            # Fetch and print the results
-            results = cur.fetchall()
-            for nature, count in results:
-                print(f"{nature}|{count}")
+def daycounts(db):
+    """
+        Count the incidents of every day (UTC).
+        Args:
+            db : path to the database.
+        Returns:
+            A list of ("YYYY-MM-DD", count) tuples sorted by day
+    """
+    with sqlite3.connect(db) as con:
+        return con.execute("SELECT day, total FROM day_counts WHERE total > 0 ORDER BY day").fetchall()
+
+
+def status(db):
+    """
+        Extract and print individual natures from the database and with the total number of it's occurences on the terminal.
+        Args:
+            db : path to the database.
+    """
+    try:
+        # Fetch and print the results
+        results = naturecounts(db)
+        for nature, count in results:
+            print(f"{nature}|{count}")
     except Exception as e:
-        print(f"Error status not retrived: {e}")
\ No newline at end of file
+        print(f"Error status not retrived: {e}")
@@ -0,0 +1,168 @@
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from scripts.project0 import databaseid
+
+
+# Bump when a generate_* function draws differently, so old renders are not reused
+RENDER_VERSION = 4
+
+# Rendered plots are named <name>.<first 16 hex digits of the png sha256>.png
+HASHED_NAME = re.compile(r'^[\w-]+\.[0-9a-f]{16}\.png$')
+
+# Aggregate tables summed into the database fingerprint, with an expression weighting each group's count
+FINGERPRINT_COUNTS = {
+    'nature_counts': "nature_id",
+    'hour_location_counts': "(incident_hour + 1) * location_id",
+    'day_counts': "julianday(day)",
+}
+
+# Unreferenced pngs younger than this may belong to a render whose manifest is not written yet
+PRUNE_GRACE_S = 600
+
+
+def database_fingerprint(db_path):
+    """
+    Return a SHA-256 over the identity of the incidents table: its database id, highest rowid and aggregate counts.
+
+    Every value comes from the small aggregate tables, the rowid index or
+    `database_meta`, so a lookup costs the same however many incidents there
+    are. Appends raise the highest rowid, the aggregate triggers follow updates
+    and deletes, and a re-created database has another id.
+    """
+    digest = hashlib.sha256()
+    with sqlite3.connect(db_path) as conn:
+        digest.update(str(databaseid(conn.cursor())).encode())
+        digest.update(str(conn.execute("SELECT MAX(rowid) FROM incidents").fetchone()[0]).encode())
+        for table, key in FINGERPRINT_COUNTS.items():
+            checksum = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(total), 0), COALESCE(SUM(total * ({key})), 0) \
+                                      FROM {table}").fetchone()
+            digest.update(f"{table}:{checksum}".encode())
+    return digest.hexdigest()
+
+
+def save_figure(figure, name, media_root, media_url):
+    """
+    Save a matplotlib figure under a content-hashed file name in `media_root` and return its URL.
+
+    The png is written to a temporary file and renamed, so concurrent renders
+    never overwrite each other's output or expose a partial file.
+    """
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    png = buffer.getvalue()
+
+    filename = f"{name}.{hashlib.sha256(png).hexdigest()[:16]}.png"
+    path = os.path.join(media_root, filename)
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        part = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(part, 'wb') as png_file:
+            png_file.write(png)
+        os.replace(part, path)
+    return os.path.join(media_url, filename)
+
+
+class RenderCache:
+    """
+    Manifests of rendered visualizations, keyed by a fingerprint of the database and the plot parameters.
+
+    Each manifest maps plot names to the URLs of their content-hashed pngs, plus
+    the clustering run they were drawn from. Only the newest `max_entries`
+    manifests are kept, and hashed pngs no manifest refers to are removed.
+    """
+
+    def __init__(self, media_root, media_url, max_entries=20):
+        self.media_root = media_root
+        self.media_url = media_url
+        self.cache_dir = os.path.join(media_root, 'render_cache')
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(db_fingerprint, **params):
+        """
+        Return the cache key for the database fingerprint and plot parameters.
+        """
+        payload = json.dumps({'db': db_fingerprint, 'version': RENDER_VERSION, 'params': params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, key):
+        """
+        Return the manifest file for `key`.
+        """
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """
+        Return the cached manifest for `key`, or None on a miss or when one of its pngs is gone.
+        """
+        path = self.path(key)
+        try:
+            with open(path) as manifest_file:
+                manifest = json.load(manifest_file)
+            urls = manifest['visualizations'].values()
+            if not all(os.path.exists(os.path.join(self.media_root, os.path.basename(url))) for url in urls):
+                raise FileNotFoundError(path)
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return manifest
+
+    def put(self, key, visualizations, run_id=None):
+        """
+        Record the rendered visualizations for `key` and prune old manifests and pngs.
+        """
+        path = self.path(key)
+        part = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(part, 'w') as manifest_file:
+            json.dump({'visualizations': visualizations, 'run_id': run_id}, manifest_file)
+        os.replace(part, path)
+        self.prune()
+
+    def prune(self):
+        """
+        Keep the newest `max_entries` manifests and delete the hashed pngs that none of them use.
+        """
+        manifests = sorted(
+            (os.path.getmtime(os.path.join(self.cache_dir, name)), os.path.join(self.cache_dir, name))
+            for name in os.listdir(self.cache_dir) if name.endswith('.json')
+        )
+        for _, path in manifests[:-self.max_entries]:
+            os.remove(path)
+
+        in_use = set()
+        for _, path in manifests[-self.max_entries:]:
+            try:
+                with open(path) as manifest_file:
+                    urls = json.load(manifest_file)['visualizations'].values()
+            except (FileNotFoundError, ValueError, KeyError):
+                continue
+            in_use.update(os.path.basename(url) for url in urls)
+
+        cutoff = time.time() - PRUNE_GRACE_S
+        for name in os.listdir(self.media_root):
+            path = os.path.join(self.media_root, name)
+            if HASHED_NAME.match(name) and name not in in_use and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+    def stats(self):
+        """
+        Return the hit/miss counters and the number of manifests.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len([name for name in os.listdir(self.cache_dir) if name.endswith('.json')]),
+        }
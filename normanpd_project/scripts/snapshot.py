@@ -0,0 +1,338 @@
+import json
+import os
+import shutil
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+try:
+    from scripts import metrics
+    from scripts.project0 import databaseid
+except ImportError:  # imported from inside scripts/, as main.py does
+    import metrics
+    from project0 import databaseid
+
+
+# Text columns stored as int32 codes into an array of their distinct values, in order of first appearance
+CATEGORICAL_COLUMNS = ['incident_location', 'nature', 'incident_ori']
+
+# Integer columns stored as int64; NULL is stored as -1
+INTEGER_COLUMNS = ['incident_epoch', 'incident_hour']
+
+MANIFEST = 'manifest.json'
+
+SECONDS_PER_DAY = 86400
+
+
+def snapshot_dir(db_path):
+    """
+    Return the directory of the columnar snapshot that belongs to `db_path`.
+    """
+    return f"{os.path.abspath(db_path)}.snapshot"
+
+
+def read_manifest(directory):
+    """
+    Return the snapshot manifest in `directory`, or None when there is no snapshot.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+
+def column_file(directory, manifest, name):
+    """
+    Return the path of one column array of a snapshot generation.
+    """
+    return os.path.join(directory, f"{name}.{manifest['generation']}.npy")
+
+
+def load_array(directory, manifest, name):
+    """
+    Memory-map one column array read-only; nothing is read until it is used.
+    """
+    return np.load(column_file(directory, manifest, name), mmap_mode='r')
+
+
+def encode(values, categories):
+    """
+    Append the distinct non-null `values` missing from `categories` and return (categories, codes of `values`).
+
+    Categories are kept in order of first appearance, so a value keeps its code
+    when rows are appended, the same vocabulary `pd.factorize` gives the whole
+    column.
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    uniques = np.asarray(uniques, dtype=str)
+    lookup = pd.Index(categories, dtype=object).get_indexer(uniques)
+    unseen = lookup < 0
+    lookup[unseen] = len(categories) + np.arange(unseen.sum())
+    # factorize marks NULL as -1, which picks the -1 appended to the lookup
+    lookup = np.append(lookup, -1).astype(np.int32)
+    return np.concatenate([categories, uniques[unseen]]), lookup[codes]
+
+
+def update_snapshot(db_path):
+    """
+    Bring the columnar snapshot of the incidents table up to date and return its manifest.
+
+    The snapshot holds one `.npy` array per column: the rowids, the integer
+    columns and the categorical columns as int32 codes into an array of their
+    distinct values (-1 for NULL). Incidents are only ever appended, so when
+    the rows the snapshot already holds are unchanged only the rows with a
+    higher rowid are read and new values get the next codes. Otherwise the
+    snapshot is rebuilt from the whole table. A new generation of files is
+    written and published by renaming the manifest, so readers that have the
+    previous arrays mapped keep a consistent view.
+
+    Rows are also partitioned by incident day (days since the epoch):
+    `day_order` lists row positions sorted by day, and `partition_days`/
+    `partition_starts` give where each day's rows start in it, so a date range
+    is one contiguous slice (see `partition_rows`). `built` is the generation
+    of the last full rebuild; codes, and anything derived from them, stay valid
+    until it changes.
+    """
+    directory = snapshot_dir(db_path)
+    os.makedirs(directory, exist_ok=True)
+    previous = manifest = read_manifest(directory)
+
+    with sqlite3.connect(db_path) as conn:
+        database_id = databaseid(conn.cursor())
+        if manifest is not None:
+            kept = conn.execute("SELECT COUNT(*) FROM incidents WHERE rowid <= ?", (manifest['max_rowid'],)).fetchone()[0]
+            layout = manifest['columns'] == INTEGER_COLUMNS + CATEGORICAL_COLUMNS and 'built' in manifest
+            if kept != manifest['rows'] or not layout or manifest.get('database_id') != database_id:
+                manifest = None
+        present = {row[1] for row in conn.execute("PRAGMA table_info(incidents)")}
+        selected = ', '.join(name if name in present else f"NULL AS {name}"
+                             for name in INTEGER_COLUMNS + CATEGORICAL_COLUMNS)
+        new_rows = pd.read_sql_query(
+            f"SELECT rowid AS incident_rowid, {selected} FROM incidents WHERE rowid > ? ORDER BY rowid",
+            conn,
+            params=(manifest['max_rowid'] if manifest else 0,),
+        )
+    if manifest is not None and new_rows.empty:
+        return manifest
+
+    arrays = {'rowid': new_rows['incident_rowid'].to_numpy(dtype=np.int64)}
+    for name in INTEGER_COLUMNS:
+        arrays[name] = new_rows[name].fillna(-1).to_numpy(dtype=np.int64)
+    for name in CATEGORICAL_COLUMNS:
+        categories = np.array([], dtype=str)
+        if manifest is not None:
+            categories = np.asarray(load_array(directory, manifest, f"{name}.categories"))
+        arrays[f"{name}.categories"], arrays[name] = encode(new_rows[name], categories)
+    if manifest is not None:
+        # Codes of earlier rows are unchanged, so old and new arrays are simply joined
+        for name in ['rowid'] + INTEGER_COLUMNS + CATEGORICAL_COLUMNS:
+            arrays[name] = np.concatenate([load_array(directory, manifest, name), arrays[name]])
+
+    # Rows whose time could not be parsed (day -1) sort first and belong to no partition
+    epoch = arrays['incident_epoch']
+    day = np.where(epoch >= 0, epoch // SECONDS_PER_DAY, -1)
+    arrays['day_order'] = np.argsort(day, kind='stable')
+    days, starts = np.unique(day[arrays['day_order']], return_index=True)
+    arrays['partition_days'] = days[days >= 0]
+    arrays['partition_starts'] = np.append(starts[days >= 0], len(day))
+
+    generation = (previous['generation'] + 1) if previous else 1
+    manifest = {
+        'generation': generation,
+        'built': manifest['built'] if manifest is not None else generation,
+        'database_id': database_id,
+        'rows': len(arrays['rowid']),
+        'max_rowid': int(arrays['rowid'][-1]) if len(arrays['rowid']) else 0,
+        'columns': INTEGER_COLUMNS + CATEGORICAL_COLUMNS,
+    }
+    for name, array in arrays.items():
+        np.save(column_file(directory, manifest, name), array)
+    if manifest['built'] == generation:
+        # Partition counts are stored in code space, which a rebuild renumbers
+        shutil.rmtree(os.path.join(directory, 'partials'), ignore_errors=True)
+
+    temp_path = os.path.join(directory, f"{MANIFEST}.tmp")
+    with open(temp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(temp_path, os.path.join(directory, MANIFEST))
+
+    # Unlinked files stay readable for readers that still have them mapped
+    if previous is not None:
+        suffix = f".{previous['generation']}.npy"
+        for name in os.listdir(directory):
+            if name.endswith(suffix):
+                os.remove(os.path.join(directory, name))
+    metrics.gauge('snapshot.rows', manifest['rows'])
+    return manifest
+
+
+def current_manifest(db_path):
+    """
+    Return the manifest of the snapshot of `db_path`, or None when it is missing or stale.
+
+    The snapshot is current when it was written from this database (the id
+    `project0.databaseid` reads) and its row count and highest rowid match the
+    table's, which holds because incidents are only appended or rebuilt by an
+    ingest that writes a new snapshot.
+    """
+    manifest = read_manifest(snapshot_dir(db_path))
+    if manifest is None or manifest['columns'] != INTEGER_COLUMNS + CATEGORICAL_COLUMNS or 'built' not in manifest:
+        # Missing, or written with another layout; the next update rebuilds it
+        return None
+    with sqlite3.connect(db_path) as conn:
+        database_id = databaseid(conn.cursor())
+        rows, max_rowid = conn.execute("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM incidents").fetchone()
+    if (database_id, rows, max_rowid) != (manifest.get('database_id'), manifest['rows'], manifest['max_rowid']):
+        return None
+    return manifest
+
+
+def day_range(days, first_day, last_day):
+    """
+    Return the (start, stop) indexes into the sorted partition `days` covered by the inclusive day range.
+    """
+    first = 0 if first_day is None else int(np.searchsorted(days, first_day, side='left'))
+    last = len(days) if last_day is None else int(np.searchsorted(days, last_day, side='right'))
+    return first, last
+
+
+def partition_rows(directory, manifest, first_day, last_day):
+    """
+    Return the sorted row positions of the partitions from `first_day` to `last_day` (inclusive, None for open).
+    """
+    days = load_array(directory, manifest, 'partition_days')
+    starts = load_array(directory, manifest, 'partition_starts')
+    first, last = day_range(days, first_day, last_day)
+    if first >= last:
+        return np.array([], dtype=np.int64)
+    return np.sort(load_array(directory, manifest, 'day_order')[starts[first]:starts[last]])
+
+
+def partition_table(directory, manifest, first_day=None, last_day=None):
+    """
+    Return [(day, rows, highest rowid, row positions)] of the day partitions in the range.
+    """
+    days = load_array(directory, manifest, 'partition_days')
+    starts = load_array(directory, manifest, 'partition_starts')
+    order = load_array(directory, manifest, 'day_order')
+    rowid = load_array(directory, manifest, 'rowid')
+    first, last = day_range(days, first_day, last_day)
+    table = []
+    for i in range(first, last):
+        positions = order[starts[i]:starts[i + 1]]
+        table.append((int(days[i]), len(positions), int(rowid[positions].max()), positions))
+    return table
+
+
+def codes_key(manifest):
+    """
+    Return what identifies a snapshot's codes: the id of the database it was written from and its `built`.
+    """
+    return f"{manifest.get('database_id')}-{manifest['built']}"
+
+
+def partitions(db_path, first_day=None, last_day=None):
+    """
+    Return [(day, rows, highest rowid)] of the day partitions in the range and the snapshot's `codes_key`, or None when stale.
+
+    A partition's row count and highest rowid change whenever rows are added
+    to that day, so together with `codes_key` they identify its contents,
+    also across a re-created database.
+    """
+    manifest = current_manifest(db_path)
+    if manifest is None:
+        return None
+    table = partition_table(snapshot_dir(db_path), manifest, first_day, last_day)
+    return [(day, rows, max_rowid) for day, rows, max_rowid, _ in table], codes_key(manifest)
+
+
+def load_incidents(db_path, columns=None, days=None):
+    """
+    Return the snapshot as a DataFrame indexed by `incident_rowid`, or None when it is missing or stale.
+
+    Integer and code arrays are memory-mapped, so only the pages a caller
+    touches are read. Categorical columns come back as pandas Categoricals
+    built from the stored codes, and integer columns keep -1 for NULL. With
+    `days=(first_day, last_day)` (days since the epoch, inclusive, None for
+    open) only the rows of those day partitions are read.
+    """
+    manifest = current_manifest(db_path)
+    if manifest is None:
+        metrics.count('snapshot.misses')
+        return None
+
+    metrics.count('snapshot.hits')
+    directory = snapshot_dir(db_path)
+    rows = slice(None) if days is None else partition_rows(directory, manifest, *days)
+    data = {}
+    for name in columns or manifest['columns']:
+        if name in CATEGORICAL_COLUMNS:
+            categories = load_array(directory, manifest, f"{name}.categories")
+            codes = load_array(directory, manifest, name)[rows]
+            if days is not None:
+                # Keep only the values seen in the window; ascending codes keep their first-appearance order
+                used, codes = np.unique(codes, return_inverse=True)
+                codes = codes.astype(np.int32) - int(used[:1].tolist() == [-1])
+                categories = categories[used[used >= 0]]
+            data[name] = pd.Categorical.from_codes(codes, categories=pd.Index(categories, dtype=object),
+                                                   validate=False)
+        else:
+            data[name] = load_array(directory, manifest, name)[rows]
+    index = pd.Index(load_array(directory, manifest, 'rowid')[rows], name='incident_rowid')
+    return pd.DataFrame(data, index=index, copy=False)
+
+
+def partition_counts(db_path, first_day=None, last_day=None):
+    """
+    Return incident counts by hour and location over the day partitions in the range, or None when stale.
+
+    Each day's counts are computed once from its partition and cached under
+    `partials/` as (hour, location code, total) rows, keyed by the day, its row
+    count, its highest rowid and the snapshot's `codes_key`. A rolling window
+    therefore only reads the partitions of days it has not counted before, and
+    appending to one day only recounts that day. Returns a DataFrame with
+    `hour`, `incident_location` and `total` columns.
+    """
+    manifest = current_manifest(db_path)
+    if manifest is None:
+        return None
+    directory = snapshot_dir(db_path)
+    key = codes_key(manifest)
+    partials = os.path.join(directory, 'partials')
+    os.makedirs(partials, exist_ok=True)
+
+    blocks = []
+    for day, rows, max_rowid, positions in partition_table(directory, manifest, first_day, last_day):
+        path = os.path.join(partials, f"{day}.{key}.{rows}.{max_rowid}.npy")
+        try:
+            blocks.append(np.load(path))
+            metrics.count('snapshot.partition_hits')
+            continue
+        except (OSError, ValueError):
+            metrics.count('snapshot.partition_misses')
+
+        positions = np.sort(positions)
+        codes = pd.DataFrame({'hour': load_array(directory, manifest, 'incident_hour')[positions],
+                              'code': load_array(directory, manifest, 'incident_location')[positions]})
+        counts = codes[(codes['hour'] >= 0) & (codes['code'] >= 0)].value_counts().reset_index()
+        block = counts[['hour', 'code', 'count']].to_numpy(dtype=np.int64).reshape(-1, 3)
+
+        # Drop this day's counts from before it changed, then publish the new ones
+        for name in os.listdir(partials):
+            if name.startswith(f"{day}."):
+                os.remove(os.path.join(partials, name))
+        temp_path = f"{path}.tmp.npy"
+        np.save(temp_path, block)
+        os.replace(temp_path, path)
+        blocks.append(block)
+
+    block = np.concatenate(blocks) if blocks else np.zeros((0, 3), dtype=np.int64)
+    counts = pd.DataFrame(block, columns=['hour', 'code', 'total']).groupby(['hour', 'code'], as_index=False)['total'].sum()
+    categories = load_array(directory, manifest, 'incident_location.categories')
+    return pd.DataFrame({
+        'hour': counts['hour'].to_numpy(),
+        'incident_location': np.asarray(categories[counts['code'].to_numpy()], dtype=object),
+        'total': counts['total'].to_numpy(),
+    })
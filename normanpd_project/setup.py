@@ -5,7 +5,7 @@ setup(
 	version='1.0',
 	author='Arpita Patnaik',
 	author_email='arpitapatnaik@ufl.edu',
-	packages=find_packages(exclude=('tests', 'docs', 'resources')),
+	packages=find_packages(exclude=('tests', 'docs', 'resources', 'benchmarks')),
 	setup_requires=['pytest-runner'],
 	tests_require=['pytest']	
 )
\ No newline at end of file
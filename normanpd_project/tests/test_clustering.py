@@ -3,7 +3,10 @@ import os
 import sqlite3
 import pandas as pd
 import django
+from unittest.mock import patch
 from scripts.clustering import (
+    ClusteringPipeline,
+    add_clusters_incrementally,
     preprocess_features,
     add_clusters_to_database,
     generate_cluster_plot_with_pca,
@@ -48,7 +51,7 @@ def test_preprocess_features(temp_db_path):
 def test_add_clusters_to_database(temp_db_path):
     add_clusters_to_database(temp_db_path, n_clusters=2)
     with sqlite3.connect(temp_db_path) as conn:
-        clusters = pd.read_sql_query("SELECT DISTINCT cluster FROM incidents", conn)
+        clusters = pd.read_sql_query("SELECT DISTINCT cluster FROM incident_clusters", conn)
     assert clusters["cluster"].nunique() == 2
 
 
@@ -110,3 +113,272 @@ def test_generate_heatmap(temp_db_path, mock_django_settings):
     add_clusters_to_database(temp_db_path, n_clusters=2)
     plot_path = generate_heatmap(temp_db_path)
     assert os.path.exists(os.path.join(media_root, os.path.basename(plot_path)))
+
+
+def test_clustering_pipeline_runs_once(temp_db_path, mock_django_settings):
+    """
+    Test that a single fitted pipeline feeds the database write-back and every plot.
+    """
+    media_root = mock_django_settings
+    pipeline = ClusteringPipeline(temp_db_path, n_clusters=2).run()
+    assert pipeline.reduced_data.shape == (3, 2)
+    assert pipeline.cluster_sizes()["count"].sum() == 3
+
+    with patch("scripts.clustering.preprocess_features") as preprocess:
+        add_clusters_to_database(temp_db_path, n_clusters=2, pipeline=pipeline)
+        plot_paths = [
+            generate_cluster_plot_with_pca(temp_db_path, n_clusters=2, pipeline=pipeline),
+            generate_comparison_plot(temp_db_path, pipeline=pipeline),
+            generate_heatmap(temp_db_path, pipeline=pipeline),
+        ]
+    preprocess.assert_not_called()
+    for plot_path in plot_paths:
+        assert os.path.exists(os.path.join(media_root, os.path.basename(plot_path)))
+
+
+def test_sparse_preprocess_matches_dense(temp_db_path):
+    """
+    Test that the CSR path keeps the same columns and clusters as the dense path.
+    """
+    _, df_numeric, _ = preprocess_features(temp_db_path)
+    _, sparse_numeric, sparse_scaled = preprocess_features(temp_db_path, sparse=True)
+    assert sparse_numeric.format == "csr" and sparse_scaled.format == "csr"
+    assert sparse_numeric.shape == df_numeric.shape
+    assert (sparse_numeric.toarray() == df_numeric.to_numpy(dtype=float)).all()
+
+    dense = ClusteringPipeline(temp_db_path, n_clusters=2).run()
+    sparse = ClusteringPipeline(temp_db_path, n_clusters=2, sparse=True).run()
+    assert pd.crosstab(dense.df["cluster"], sparse.df["cluster"]).gt(0).sum().eq(1).all()
+
+
+def test_add_clusters_incrementally(temp_db_path, tmp_path):
+    """
+    Test that only newly inserted incidents are labelled on later runs.
+    """
+    from scripts import project0
+    labels_sql = "SELECT i.incident_number, c.cluster FROM incidents i \
+                  JOIN incident_clusters c ON c.incident_number = i.incident_number ORDER BY i.id"
+    model_path = str(tmp_path / "cluster_model.pkl")
+    assert add_clusters_incrementally(temp_db_path, n_clusters=2, model_path=model_path) == 3
+    with sqlite3.connect(temp_db_path) as conn:
+        before = conn.execute(labels_sql).fetchall()
+    project0.populatedb(temp_db_path, [
+        ["2024-12-09 09:00:00", "2024-00090001", "A", "Theft", "ORI1"],
+        ["2024-12-09 11:00:00", "2024-00090002", "C", "Fraud", "ORI3"],
+    ])
+
+    assert add_clusters_incrementally(temp_db_path, n_clusters=2, model_path=model_path) == 2
+    assert add_clusters_incrementally(temp_db_path, n_clusters=2, model_path=model_path) == 0
+    with sqlite3.connect(temp_db_path) as conn:
+        after = conn.execute(labels_sql).fetchall()
+        runs = conn.execute("SELECT COUNT(*) FROM cluster_runs").fetchone()[0]
+    assert after[:3] == before
+    assert len(after) == 5 and runs == 1
+    assert not any(project0.checkaggregates(temp_db_path).values())
+
+
+def test_generate_heatmap_uses_typed_schema(tmp_path, mock_django_settings):
+    """
+    Test the heatmap on a database created with the typed schema, which aggregates in SQL.
+    """
+    from scripts import project0
+    db_path = project0.createdb(str(tmp_path / "typed.db"))
+    project0.populatedb(db_path, [
+        ["12/5/2024 / 0:14", "2024-00087970", "1000 ALAMEDA ST", "Traffic Stop", "OK0140200"],
+        ["12/5/2024 / 0:25", "2024-00018488", "1310 ALAMEDA ST", "Sick Person", "14005"],
+        ["12/5/2024 / 13:25", "2024-00023878", "1000 ALAMEDA ST", "Sick Person", "EMSSTAT"],
+    ])
+    add_clusters_to_database(db_path, n_clusters=2)
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM incident_clusters").fetchone()[0] == 3
+        assert "incident_hour" in [row[1] for row in conn.execute("PRAGMA table_info(incidents)")]
+    plot_path = generate_heatmap(db_path)
+    assert os.path.exists(os.path.join(mock_django_settings, os.path.basename(plot_path)))
+
+
+def test_readers_keep_previous_run_until_commit(temp_db_path):
+    """
+    Test that a reader inside a transaction keeps seeing the previous run while a new one is written.
+    """
+    add_clusters_to_database(temp_db_path, n_clusters=2)
+    reader = sqlite3.connect(temp_db_path, isolation_level=None)
+    reader.execute("BEGIN")
+    first_run = reader.execute("SELECT MAX(run_id) FROM cluster_runs").fetchone()[0]
+
+    add_clusters_to_database(temp_db_path, n_clusters=3)
+    assert reader.execute("SELECT MAX(run_id) FROM cluster_runs").fetchone()[0] == first_run
+    reader.execute("COMMIT")
+    assert reader.execute("SELECT MAX(run_id) FROM cluster_runs").fetchone()[0] == first_run + 1
+
+    # The incidents table is never rewritten by clustering
+    columns = [row[1] for row in reader.execute("PRAGMA table_info(incidents)")]
+    assert "incident_number" in columns and "cluster" not in columns
+    assert reader.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    reader.close()
+
+
+def test_draw_cluster_scatter_modes():
+    """
+    Test that any number of clusters gets its own color and large inputs switch to hexbin.
+    """
+    import numpy as np
+    import matplotlib.pyplot as plt
+    from scripts.clustering import draw_cluster_scatter
+    rng = np.random.default_rng(0)
+    x, y = rng.normal(size=(2, 500))
+    labels = rng.integers(0, 12, 500)
+
+    fig, ax = plt.subplots()
+    assert draw_cluster_scatter(ax, x, y, labels, n_clusters=12) == "scatter"
+    assert sum(len(line.get_xdata()) for line in ax.lines) == 500
+    assert len({line.get_color() for line in ax.lines}) == 12
+    assert len(ax.get_legend().get_texts()) == 12
+    plt.close(fig)
+
+    fig, ax = plt.subplots()
+    assert draw_cluster_scatter(ax, x, y, labels, n_clusters=12, max_points=100) == "hexbin"
+    assert not ax.lines and len(ax.collections) == 1
+    plt.close(fig)
+
+
+def test_heatmap_counts_top_n_and_buckets(tmp_path):
+    """
+    Test that the heatmap keeps the busiest locations, sums the rest into Other and buckets by street or block.
+    """
+    from scripts import project0
+    from scripts.clustering import heatmap_counts
+    db_path = project0.createdb(str(tmp_path / "typed.db"))
+    project0.populatedb(db_path, [
+        ["12/5/2024 / 0:14", "2024-00000001", "1000 ALAMEDA ST", "Traffic Stop", "OK0140200"],
+        ["12/5/2024 / 0:25", "2024-00000002", "1000 ALAMEDA ST", "Sick Person", "14005"],
+        ["12/5/2024 / 1:25", "2024-00000003", "1310 ALAMEDA ST", "Sick Person", "EMSSTAT"],
+        ["12/5/2024 / 1:40", "2024-00000004", "1350 ALAMEDA ST", "Larceny", "OK0140200"],
+        ["12/5/2024 / 2:05", "2024-00000005", "200 W MAIN ST", "Alarm", "OK0140200"],
+    ])
+
+    counts = heatmap_counts(db_path, top_n=1)
+    assert counts.columns.tolist() == ["1000 ALAMEDA ST", "Other"]
+    assert counts.loc[0, "1000 ALAMEDA ST"] == 2 and counts.loc[1, "Other"] == 2
+    assert int(counts.to_numpy().sum()) == 5
+
+    assert heatmap_counts(db_path, top_n=None, bucket="street").sum().to_dict() == {"ALAMEDA ST": 4, "W MAIN ST": 1}
+    assert heatmap_counts(db_path, top_n=2, bucket="block").sum().to_dict() == {
+        "1000 BLOCK ALAMEDA ST": 2, "1300 BLOCK ALAMEDA ST": 2, "Other": 1}
+
+
+def test_approximate_pca_matches_exact(temp_db_path):
+    """
+    Test that the randomized and sampled projections find the exact components and report comparable variance.
+    """
+    import numpy as np
+    import scipy.sparse as sp
+    from sklearn.decomposition import PCA
+    from scripts.clustering import ApproximatePCA
+    matrix = sp.random(5000, 30, density=0.2, format="csr", random_state=0)
+    matrix = sp.csr_matrix(matrix.multiply(np.linspace(3, 0.1, 30)))
+
+    exact = PCA(n_components=2, random_state=42)
+    exact.fit(matrix)
+    for model in (ApproximatePCA(method="randomized", chunk_size=700),
+                  ApproximatePCA(method="sample", sample_size=2000, chunk_size=700)):
+        reduced = model.fit_transform(matrix)
+        assert reduced.shape == (5000, 2)
+        assert np.allclose(np.abs((model.components_ * exact.components_).sum(axis=1)), 1, atol=0.05)
+        assert np.allclose(model.explained_variance_ratio_, exact.explained_variance_ratio_, rtol=0.05)
+        assert np.allclose(model.transform(matrix[:10].toarray()), reduced[:10])
+        assert model.transform(matrix[:0]).shape == (0, 2)
+
+    pipeline = ClusteringPipeline(temp_db_path, n_clusters=2, projection="sample").run()
+    assert pipeline.reduced_data.shape == (3, 2)
+    with pytest.raises(ValueError):
+        ClusteringPipeline(temp_db_path, n_clusters=2, projection="svd").run()
+
+
+def test_load_features_codes_and_time_features(tmp_path):
+    """
+    Test that categorical codes keep their first-appearance vocabulary and times become cyclic features.
+    """
+    import numpy as np
+    from scripts import project0
+    from scripts.clustering import load_features, time_features
+    features = time_features([1733357640, 1733666400, None])
+    assert features["hour"].tolist() == [0, 14, -1]
+    assert features["weekday"].tolist() == [3, 6, -1]
+    assert features["minute_of_day"].tolist() == [14, 840, -1]
+    assert np.allclose(features["time_sin"] ** 2 + features["time_cos"] ** 2, [1, 1, 0])
+
+    db = project0.createdb(str(tmp_path / "normanpd.db"))
+    project0.populatedb(db, [
+        ["12/5/2024 / 0:14", "2024-00000001", "1 MAIN ST", "Traffic Stop", "OK0140200"],
+        ["12/5/2024 / 0:20", "2024-00000002", "2 ELM ST", "Alarm", "OK0140200"],
+    ])
+    before = load_features(db)
+    project0.populatedb(db, [["12/6/2024 / 9:30", "2024-00000003", "0 ASH ST", "Alarm", "14005"]])
+    after = load_features(db)
+    assert after["incident_location"].cat.categories.tolist() == ["1 MAIN ST", "2 ELM ST", "0 ASH ST"]
+    assert after["incident_location"].cat.codes.tolist()[:2] == before["incident_location"].cat.codes.tolist()
+    assert after["weekday"].tolist() == [3, 3, 4]
+    assert load_features(db, after_rowid=2).index.tolist() == [3]
+
+
+def test_windowed_clustering_uses_day_partitions(tmp_path):
+    """
+    Test that a window reads only its days, matches SQLite, and that rolling windows reuse cached day counts.
+    """
+    from datetime import date, timedelta
+    from benchmarks.synthetic import generate_rows
+    from scripts import metrics, project0, snapshot
+    from scripts.clustering import heatmap_counts, last_days, load_features
+    db = project0.createdb(str(tmp_path / "normanpd.db"))
+    project0.populatedb(db, generate_rows(3000))
+    window = last_days(db, 3)
+    with sqlite3.connect(db) as conn:
+        expected = conn.execute("SELECT COUNT(*) FROM incidents WHERE date(incident_epoch, 'unixepoch') BETWEEN ? AND ?",
+                                window).fetchone()[0]
+    sql_features = load_features(db, window=window)
+    sql_counts = heatmap_counts(db, top_n=None, window=window)
+
+    snapshot.update_snapshot(db)
+    features = load_features(db, window=window)
+    assert 0 < expected < 3000
+    assert features.index.tolist() == sql_features.index.tolist() and len(features) == expected
+    metrics.reset()
+    counts = heatmap_counts(db, top_n=None, window=window)
+    assert counts.sort_index(axis=1).equals(sql_counts.sort_index(axis=1)) and counts.to_numpy().sum() == expected
+    assert metrics.snapshot()["counters"]["snapshot.partition_misses"] == 3
+
+    # Sliding the window back a day only counts the day it did not cover before
+    metrics.reset()
+    earlier = tuple((date.fromisoformat(day) - timedelta(days=1)).isoformat() for day in window)
+    heatmap_counts(db, window=earlier)
+    counters = metrics.snapshot()["counters"]
+    assert counters["snapshot.partition_hits"] == 2 and counters["snapshot.partition_misses"] == 1
+
+    run_id = add_clusters_to_database(db, n_clusters=2, window=window)
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM incident_clusters WHERE run_id = ?", (run_id,)).fetchone()[0] == expected
+
+
+def test_comparison_plot_uses_the_run_of_its_window(tmp_path, mock_django_settings):
+    """
+    Test that a windowed comparison plot counts the run of that window, not the newest run of another window.
+    """
+    from benchmarks.synthetic import generate_rows
+    from scripts import project0
+    from scripts.clustering import last_days, window_cluster_run
+    db = project0.createdb(str(tmp_path / "normanpd.db"))
+    project0.populatedb(db, generate_rows(1000))
+    window, recent = last_days(db, 3), last_days(db, 1)
+    run_id = add_clusters_to_database(db, n_clusters=2, window=window)
+    newest = add_clusters_to_database(db, n_clusters=2, window=recent)
+    with sqlite3.connect(db) as conn:
+        assert window_cluster_run(conn, window) == run_id and window_cluster_run(conn, recent) == newest
+        assert window_cluster_run(conn) is None
+
+    with patch("scripts.clustering.plt.bar") as bar:
+        generate_comparison_plot(db, window=window)
+    with sqlite3.connect(db) as conn:
+        labelled = conn.execute("SELECT COUNT(*) FROM incident_clusters WHERE run_id = ?", (run_id,)).fetchone()[0]
+    assert sum(bar.call_args.args[1]) == labelled
+    with pytest.raises(ValueError):
+        generate_comparison_plot(db, window=("2000-01-01", "2000-01-07"))
@@ -0,0 +1,100 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from scripts import fetcher
+
+
+PDF_BODIES = {
+    "/2024-12-05_daily_incident_summary.pdf": b"%PDF-1.4 first day",
+    "/2024-12-06_daily_incident_summary.pdf": b"%PDF-1.4 second day",
+}
+
+
+class IncidentHandler(BaseHTTPRequestHandler):
+    """Serve the PDF bodies over keep-alive HTTP/1.1 with ETag support."""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        body = PDF_BODIES.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.server.downloads += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def incident_server():
+    """Run a local stand-in for the Norman PD server."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), IncidentHandler)
+    server.connections = 0
+    server.downloads = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_all_streams_and_skips_unchanged(incident_server, tmp_path):
+    """
+    Test that each URL lands in its own file, connections are reused and unchanged files are not downloaded again.
+    """
+    base = f"http://127.0.0.1:{incident_server.server_address[1]}"
+    urls = [base + path for path in PDF_BODIES]
+
+    results = fetcher.fetch_all(urls, str(tmp_path), concurrency=1)
+    assert [result["status"] for result in results] == ["downloaded", "downloaded"]
+    for result, body in zip(results, PDF_BODIES.values()):
+        with open(result["path"], "rb") as pdf_file:
+            assert pdf_file.read() == body
+    assert incident_server.connections == 1
+
+    results = fetcher.fetch_all(urls, str(tmp_path), concurrency=2)
+    assert [result["status"] for result in results] == ["not_modified", "not_modified"]
+    assert incident_server.downloads == 2
+
+
+def test_fetch_all_raises_on_missing_report(incident_server, tmp_path):
+    """
+    Test that an HTTP error status is surfaced instead of writing an empty file.
+    """
+    url = f"http://127.0.0.1:{incident_server.server_address[1]}/missing.pdf"
+    with pytest.raises(Exception, match="404"):
+        fetcher.fetch_all([url], str(tmp_path))
+    assert not list(tmp_path.glob("*.pdf"))
+
+
+def test_fetch_all_downloads_again_when_file_is_gone(incident_server, tmp_path):
+    """
+    Test that a deleted download is fetched again instead of being answered with 304.
+    """
+    url = f"http://127.0.0.1:{incident_server.server_address[1]}/2024-12-05_daily_incident_summary.pdf"
+    path = fetcher.fetch_all([url], str(tmp_path))[0]["path"]
+    tmp_path.joinpath(path).unlink()
+
+    result = fetcher.fetch_all([url], str(tmp_path))[0]
+    assert result["status"] == "downloaded" and incident_server.downloads == 2
+    with open(result["path"], "rb") as pdf_file:
+        assert pdf_file.read() == PDF_BODIES["/2024-12-05_daily_incident_summary.pdf"]
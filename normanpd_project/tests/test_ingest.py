@@ -0,0 +1,22 @@
+import os
+from scripts.ingest import ingest
+
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "scripts", "resources", "DailyIncidentSummary.pdf")
+
+
+def test_ingest_returns_structured_result(tmp_path):
+    """
+    Test that an in-process ingest reports row counts, nature counts and stage timings.
+    """
+    db_path = str(tmp_path / "normanpd.db")
+    result = ingest(SAMPLE_PDF, db_path=db_path)
+    assert result["rows"] == result["inserted"] == result["total_rows"] == 387
+    assert result["natures"]["Traffic Stop"] == 54
+    assert sum(result["natures"].values()) == 387
+    assert set(result["timings_ms"]) == {"fetch_ms", "extract_ms", "load_ms", "snapshot_ms", "status_ms"}
+
+    # Appending the same report again inserts nothing new
+    result = ingest(SAMPLE_PDF, db_path=db_path, reset=False)
+    assert result["inserted"] == 0 and result["total_rows"] == 387
@@ -0,0 +1,69 @@
+import time
+from scripts import jobs
+
+
+def record_job(payload):
+    """Job used by the worker test."""
+    return {"value": payload["value"] * 2}
+
+
+def test_run_worker_processes_queue(tmp_path):
+    """
+    Test that the worker pool runs every queued job and records its result.
+    """
+    jobs_db = str(tmp_path / "jobs.db")
+    job_ids = [jobs.enqueue(jobs_db, "tests.test_jobs.record_job", {"value": value}) for value in range(4)]
+
+    start = time.time()
+    assert jobs.run_worker(jobs_db, processes=2, poll_interval=0.05, max_jobs=4) == 4
+    assert time.time() - start < 60
+
+    for value, job_id in enumerate(job_ids):
+        job = jobs.get_job(jobs_db, job_id)
+        assert job["status"] == "done"
+        assert job["result"] == {"value": value * 2}
+    assert jobs.claim_job(jobs_db) is None
+
+
+def test_jobs_of_dead_workers_are_requeued(tmp_path):
+    """
+    Test that a running job without a recent heartbeat is claimed again, and failed after MAX_ATTEMPTS claims.
+    """
+    jobs_db = str(tmp_path / "jobs.db")
+    job_id = jobs.enqueue(jobs_db, "tests.test_jobs.record_job", {"value": 1})
+    assert jobs.claim_job(jobs_db) == job_id
+    # The worker died: the job keeps status 'running' and its heartbeat ages
+    assert jobs.claim_job(jobs_db) is None
+    assert jobs.claim_job(jobs_db, lease=-1) == job_id
+    assert jobs.get_job(jobs_db, job_id)["attempts"] == 2
+
+    assert jobs.claim_job(jobs_db, lease=-1) == job_id
+    assert jobs.claim_job(jobs_db, lease=-1) is None
+    job = jobs.get_job(jobs_db, job_id)
+    assert job["status"] == "failed" and "3 times" in job["error"]
+
+    retried = jobs.enqueue(jobs_db, "tests.test_jobs.record_job", {"value": 2})
+    assert jobs.claim_job(jobs_db) == retried
+    assert jobs.execute_job(jobs_db, retried) == "done" and jobs.claim_job(jobs_db, lease=-1) is None
+
+
+def crash_job(payload):
+    """Job that kills the worker process running it."""
+    import os
+    os._exit(1)
+
+
+def test_run_worker_survives_a_dying_worker(tmp_path):
+    """
+    Test that a job killing its worker process is retried and then failed, while the jobs sharing its pool still run.
+    """
+    jobs_db = str(tmp_path / "jobs.db")
+    crashed = jobs.enqueue(jobs_db, "tests.test_jobs.crash_job", {})
+    healthy = [jobs.enqueue(jobs_db, "tests.test_jobs.record_job", {"value": value}) for value in range(2)]
+
+    assert jobs.run_worker(jobs_db, processes=2, poll_interval=0.05, max_jobs=3) == 3
+    job = jobs.get_job(jobs_db, crashed)
+    assert job["status"] == "failed" and job["attempts"] == jobs.MAX_ATTEMPTS and "died" in job["error"]
+    for value, job_id in enumerate(healthy):
+        job = jobs.get_job(jobs_db, job_id)
+        assert job["status"] == "done" and job["result"] == {"value": value * 2}
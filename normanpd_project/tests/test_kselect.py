@@ -0,0 +1,68 @@
+import numpy as np
+import scipy.sparse as sp
+from scripts import project0
+from scripts.kselect import choose_k, elbow_k, select_k
+
+
+def blobs(n_clusters, per_cluster=60, seed=0):
+    """Return well separated 2D blobs."""
+    rng = np.random.default_rng(seed)
+    centers = np.array([[0, 0], [20, 0], [0, 20], [20, 20], [10, 40]])[:n_clusters]
+    return np.vstack([center + rng.normal(size=(per_cluster, 2)) for center in centers])
+
+
+def test_select_k_finds_blobs_and_stops_early():
+    """
+    Test that the silhouette picks the true k and the search stops once the score plateaus.
+    """
+    selection = select_k(blobs(3), k_min=2, k_max=10, processes=2, patience=2)
+    assert selection["k"] == 3 and selection["elbow_k"] == 3
+    assert selection["stopped_early"]
+    assert [score["k"] for score in selection["scores"]][:3] == [2, 3, 4]
+    assert len(selection["scores"]) < 9
+
+    # The shared matrix can also be sparse, as produced by preprocess_features(sparse=True)
+    assert select_k(sp.csr_matrix(blobs(4)), k_max=6, processes=1)["k"] == 4
+
+
+def test_elbow_k():
+    scores = [{"k": k, "inertia": inertia} for k, inertia in zip(range(2, 7), [100, 40, 12, 10, 9])]
+    assert elbow_k(scores) == 4
+
+
+def test_choose_k_is_cached_per_fingerprint(tmp_path):
+    """
+    Test that a second selection for the same fingerprint is read from the cache.
+    """
+    db_path = project0.createdb(str(tmp_path / "normanpd.db"))
+    project0.populatedb(db_path, [
+        [f"12/5/2024 / {hour}:00", f"2024-{hour:08d}", f"{hour % 3} MAIN ST", ["Alarm", "Larceny"][hour % 2], "14005"]
+        for hour in range(24)
+    ])
+    cache_dir = str(tmp_path / "kselect")
+    first = choose_k(db_path, "fingerprint", cache_dir=cache_dir, k_max=4, processes=1)
+    second = choose_k(db_path, "fingerprint", cache_dir=cache_dir, k_max=4, processes=1)
+    assert not first["cached"] and second["cached"]
+    assert second["scores"] == first["scores"] and 2 <= second["k"] <= 4
+    assert not choose_k(db_path, "changed", cache_dir=cache_dir, k_max=4, processes=1)["cached"]
+
+
+def test_choose_k_scores_the_pipeline_matrix(tmp_path):
+    """
+    Test that choose_k scores the matrix of the pipeline it is given, so the final fit preprocesses nothing again.
+    """
+    from unittest.mock import patch
+    from scripts import clustering
+    db_path = project0.createdb(str(tmp_path / "normanpd.db"))
+    project0.populatedb(db_path, [
+        [f"12/5/2024 / {hour}:00", f"2024-{hour:08d}", f"{hour % 3} MAIN ST", ["Alarm", "Larceny"][hour % 2], "14005"]
+        for hour in range(24)
+    ])
+    pipeline = clustering.ClusteringPipeline(db_path, n_clusters=None, sparse=True)
+    with patch("scripts.kselect.preprocess_features") as direct, \
+         patch("scripts.clustering.preprocess_features", wraps=clustering.preprocess_features) as shared:
+        pipeline.n_clusters = choose_k(db_path, "fingerprint", cache_dir=str(tmp_path / "kselect"), k_max=4,
+                                       processes=1, pipeline=pipeline)["k"]
+        pipeline.run()
+    direct.assert_not_called()
+    assert shared.call_count == 1 and len(pipeline.df["cluster"].unique()) == pipeline.n_clusters
@@ -0,0 +1,66 @@
+import os
+import pytest
+from scripts import project0
+from scripts.parsecache import ParseCache
+
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "scripts", "resources", "DailyIncidentSummary.pdf")
+
+
+def test_cached_extraction_skips_pypdf(tmp_path):
+    """
+    Test that re-extracting the same pdf bytes is served from the cache without pypdf.
+    """
+    with open(SAMPLE_PDF, "rb") as pdf_file:
+        incident_data = pdf_file.read()
+    cache = ParseCache(str(tmp_path / "cache"))
+
+    rows = project0.extractincidentscached(incident_data, cache)
+    assert cache.stats()["misses"] == 1
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(project0, "PdfReader", None)
+        assert project0.extractincidentscached(incident_data, cache) == rows
+    assert cache.stats()["hits"] == 1
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    """
+    Test that the oldest untouched entry is evicted once the size limit is exceeded.
+    """
+    cache = ParseCache(str(tmp_path / "cache"), max_bytes=10 ** 9)
+    rows = [["12/5/2024 / 0:14", "2024-00087970", "1000 ALAMEDA ST", "Traffic Stop", "OK0140200"]] * 50
+    for index, digest in enumerate(["a" * 64, "b" * 64, "c" * 64]):
+        cache.put(digest, rows)
+        os.utime(cache.path(digest), (index, index))
+    entry_size = os.path.getsize(cache.path("a" * 64))
+
+    assert cache.get("a" * 64) == rows
+    cache.max_bytes = 2 * entry_size
+    cache.evict()
+
+    assert cache.get("b" * 64) is None
+    assert cache.get("a" * 64) == rows and cache.get("c" * 64) == rows
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_is_versioned_and_safe_for_concurrent_writers(tmp_path):
+    """
+    Test that rows from another parser version are not served and that concurrent puts of one pdf all succeed.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from scripts import parsecache
+    cache = ParseCache(str(tmp_path / "cache"), max_bytes=0)
+    rows = [["12/5/2024 / 0:14", "2024-00087970", "1000 ALAMEDA ST", "Traffic Stop", "OK0140200"]] * 50
+    # Every put evicts the entry again, so the writers also race on removing it
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: cache.put("a" * 64, rows), range(64)))
+    assert not [name for name in os.listdir(cache.cache_dir) if name.endswith(".part")]
+
+    cache.max_bytes = 10 ** 9
+    cache.put("a" * 64, rows)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(parsecache, "PARSE_VERSION", parsecache.PARSE_VERSION + 1)
+        assert cache.get("a" * 64) is None
+    assert cache.get("a" * 64) == rows
@@ -0,0 +1,214 @@
+import os
+import pytest
+import sqlite3
+from unittest.mock import patch
+from scripts import project0
+
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "scripts", "resources", "DailyIncidentSummary.pdf")
+
+
+@pytest.fixture
+def incident_data():
+    """Read the sample daily incident summary."""
+    with open(SAMPLE_PDF, "rb") as pdf_file:
+        return pdf_file.read()
+
+
+def test_parse_merges_address_across_pages():
+    """
+    Test that an address continuation at the top of a page is merged into the last row of the previous page.
+    """
+    pages = [
+        ["12/5/2024 0:14              2024-00087970          1000 ALAMEDA ST                    Traffic Stop                OK0140200",
+         "12/5/2024 0:25              2024-00018488          E LINDSEY ST /                     Sick Person                 14005"],
+        ["                                                   CLASSEN BLVD",
+         "12/5/2024 0:26              2024-00018487          622 RANCHO DR                      Diabetic Problems           EMSSTAT"],
+    ]
+    rows = project0.parseincidentlines(pages)
+    assert rows == [
+        ["12/5/2024 / 0:14", "2024-00087970", "1000 ALAMEDA ST", "Traffic Stop", "OK0140200"],
+        ["12/5/2024 / 0:25", "2024-00018488", "E LINDSEY ST / CLASSEN BLVD", "Sick Person", "14005"],
+        ["12/5/2024 / 0:26", "2024-00018487", "622 RANCHO DR", "Diabetic Problems", "EMSSTAT"],
+    ]
+
+
+def test_parallel_extraction_matches_serial(incident_data):
+    """
+    Test that the process-pool extraction returns exactly the serial rows.
+    """
+    serial = project0.extractincidents(incident_data)
+    assert len(serial) == 387
+    assert project0.extractincidents(incident_data, workers=3) == serial
+
+
+def test_ingestbatch_skips_known_files(tmp_path, incident_data):
+    """
+    Test that a batch appends every new pdf once and skips content it has already ingested.
+    """
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    (pdf_dir / "2024-12-05.pdf").write_bytes(incident_data)
+    (pdf_dir / "copy.pdf").write_bytes(incident_data)
+    db = project0.createdb(str(tmp_path / "normanpd.db"), reset=False)
+
+    results = project0.ingestbatch(db, [str(pdf_dir)], workers=2)
+    assert [row_count for _, _, row_count in results] == [387, None]
+    assert project0.ingestbatch(db, [SAMPLE_PDF], workers=2)[0][2] is None
+
+    with sqlite3.connect(db) as con:
+        assert con.execute("SELECT COUNT(*) FROM incidents").fetchone()[0] == 387
+        assert con.execute("SELECT COUNT(*) FROM ingested_files").fetchone()[0] == 1
+
+
+def test_migratedb_upgrades_legacy_table(tmp_path, capsys):
+    """
+    Test that an all-TEXT table without incident numbers is rebuilt into the typed, indexed schema.
+    """
+    db = str(tmp_path / "legacy.db")
+    with sqlite3.connect(db) as con:
+        con.execute("CREATE TABLE incidents (incident_time TEXT, incident_location TEXT, nature TEXT, incident_ori TEXT, cluster INTEGER)")
+        con.executemany("INSERT INTO incidents VALUES (?, ?, ?, ?, ?)", [
+            ("12/5/2024 / 0:14", "1000 ALAMEDA ST", "Traffic Stop", "OK0140200", 2),
+            ("12/5/2024 / 23:45", "3700 12TH AVE SE", "Contact a Subject", "OK0140200", 0),
+            ("12/5/2024 / 23:50", "1000 ALAMEDA ST", "Traffic Stop", "14005", 1),
+        ])
+
+    project0.createdb(db, reset=False)
+    project0.populatedb(db, [["12/6/2024 / 1:02", "2024-00088230", "622 RANCHO DR", "Traffic Stop", "EMSSTAT"]])
+    project0.populatedb(db, [["12/6/2024 / 1:02", "2024-00088230", "622 RANCHO DR", "Traffic Stop", "EMSSTAT"]])
+
+    with sqlite3.connect(db) as con:
+        rows = con.execute("SELECT i.id, i.incident_number, i.incident_epoch, i.incident_hour, c.cluster FROM incidents i \
+                            LEFT JOIN incident_clusters c ON c.incident_number = i.incident_number ORDER BY i.id").fetchall()
+        plan = con.execute("EXPLAIN QUERY PLAN SELECT nature_id, count(*) FROM incidents GROUP BY nature_id").fetchall()
+        natures = con.execute("SELECT COUNT(*) FROM natures").fetchone()[0]
+    assert rows == [
+        (1, "legacy-1", 1733357640, 0, 2),
+        (2, "legacy-2", 1733442300, 23, 0),
+        (3, "legacy-3", 1733442600, 23, 1),
+        (4, "2024-00088230", 1733446920, 1, None),
+    ]
+    assert natures == 2
+    assert "COVERING INDEX" in plan[0][3]
+
+    project0.status(db)
+    assert capsys.readouterr().out.splitlines() == ["Contact a Subject|1", "Traffic Stop|3"]
+
+
+def test_parseincidenttime():
+    """
+    Test parsing of the summary "date / time" format into epoch seconds and hour of day.
+    """
+    assert project0.parseincidenttime("12/5/2024 / 0:14") == (1733357640, 0)
+    assert project0.parseincidenttime("2024-12-08 14:00:00") == (1733666400, 14)
+    assert project0.parseincidenttime("not a time") == (None, None)
+
+
+def test_iterincidents_streams_into_populatedb(tmp_path, incident_data):
+    """
+    Test that the row generator matches the list API and that populatedb consumes it in chunks.
+    """
+    rows = project0.iterincidents(SAMPLE_PDF)
+    assert next(rows) == project0.extractincidents(incident_data)[0]
+    assert list(project0.iterincidents(incident_data)) == project0.extractincidents(incident_data)
+
+    db = project0.createdb(str(tmp_path / "normanpd.db"))
+    with patch.object(project0, "insertincidents", wraps=project0.insertincidents) as insert:
+        project0.populatedb(db, project0.iterincidents(SAMPLE_PDF), chunk_size=100)
+    assert [len(call.args[1]) for call in insert.call_args_list] == [100, 100, 100, 87]
+    with sqlite3.connect(db) as con:
+        assert con.execute("SELECT COUNT(*) FROM incidents").fetchone()[0] == 387
+
+
+def test_synthetic_pdf_round_trips():
+    """
+    Test that the benchmark suite's generated summary pdfs extract back to the rows they were built from.
+    """
+    from benchmarks.synthetic import build_summary_pdf, generate_rows
+    rows = generate_rows(200)
+    assert project0.extractincidents(build_summary_pdf(rows, lines_per_page=40)) == rows
+
+
+def test_aggregates_follow_writes_and_repair(tmp_path, incident_data):
+    """
+    Test that the aggregate tables match a full GROUP BY after inserts, updates and deletes, and that drift is repaired.
+    """
+    db = project0.createdb(str(tmp_path / "normanpd.db"))
+    incidents = project0.extractincidents(incident_data)
+    project0.populatedb(db, incidents[:200])
+    project0.populatedb(db, incidents)
+    with sqlite3.connect(db) as con:
+        assert project0.naturecounts(db) == con.execute(
+            "SELECT nature, COUNT(*) FROM incidents GROUP BY nature ORDER BY nature").fetchall()
+        assert project0.daycounts(db) == [("2024-12-05", 387)]
+        con.execute("UPDATE incidents SET incident_hour = 23 WHERE id % 5 = 0")
+        con.execute("DELETE FROM incidents WHERE id % 7 = 0")
+    assert not any(project0.checkaggregates(db).values())
+
+    with sqlite3.connect(db) as con:
+        con.execute("UPDATE nature_counts SET total = total + 1 WHERE nature_id = 1")
+        con.execute("DELETE FROM day_counts")
+    assert project0.checkaggregates(db, repair=True) == {
+        "nature_counts": 1, "hour_location_counts": 0, "day_counts": 1, "cluster_counts": 0}
+    assert not any(project0.checkaggregates(db).values())
+
+
+def regex_rows(pages):
+    """The regex-only parser the column slicer must agree with."""
+    rows = []
+    for row_contents in pages:
+        for line in row_contents:
+            row_check = project0.INCIDENT_REGEX.match(line)
+            if row_check:
+                extracted_data = [i.strip() for i in row_check.groups()]
+                extracted_data[:2] = [" / ".join(extracted_data[:2])]
+                rows.append(extracted_data)
+            elif rows:
+                rows[-1][2] = rows[-1][2] + " " + line.lstrip()
+    return rows
+
+
+def layout_line(date_time, number, location, nature, ori, starts=(28, 51, 108, 166)):
+    """Lay out a record line with its fields padded to the given column starts."""
+    fields = [date_time, number, location, nature]
+    bounds = (0,) + starts
+    return "".join(field.ljust(stop - start) for field, start, stop in zip(fields, bounds, bounds[1:])) + ori
+
+
+# Lines that stress the column slicer; each page is parsed on its own columns
+LINE_CORPUS = [
+    [
+        layout_line("12/5/2024 0:14", "2024-00087970", "1000 ALAMEDA ST", "Traffic Stop", "OK0140200"),
+        layout_line("12/15/2024 10:14", "2024-00087971", "E LINDSEY ST /", "Sick Person", "14005"),
+        "                                                   CLASSEN BLVD",
+        layout_line("12/5/2024 0:26", "2024-00087972", "622  RANCHO DR", "Diabetic Problems", "EMSSTAT"),
+        layout_line("12/5/2024 0:27", "2024-00087973", "1 MAIN ST", "Alarm", "OK0140200") + "  ",
+        layout_line("12/5/2024 0:28", "2024-00087974", "2 MAIN ST", "Harassment / Threats Report Harassment", "14005"),
+        layout_line("12/5/2024 0:29", "2024-00087975", "3 MAIN ST", "Fraud", "ok01"),
+        layout_line("12/5/2024 0:30", "2024-00087976", "35.2219,-97.4426", "Welfare Check", "OK0140200"),
+        "",
+        layout_line("12/5/2024 0:31", "2024-0008797", "4 MAIN ST", "Larceny", "EMSSTAT"),
+    ],
+    [
+        "                                                   BLVD",
+        layout_line("12/5/2024 0:32", "2024-00087977", "5 MAIN ST", "Noise Complaint", "14005", starts=(29, 52, 110, 170)),
+        layout_line("12/5/2024 0:33", "2024-00087978", "6 MAIN ST", "Assault", "OK0140200", starts=(28, 51, 108, 166)),
+    ],
+]
+
+
+def test_column_parser_matches_regex_corpus(incident_data):
+    """
+    Test that slicing at column positions gives exactly the regex rows, on the corpus and every sample page.
+    """
+    assert list(project0.iterincidentrows(LINE_CORPUS)) == regex_rows(LINE_CORPUS)
+
+    reader = project0.PdfReader(SAMPLE_PDF)
+    pages = [project0.extractpagelines(page, index, len(reader.pages)) for index, page in enumerate(reader.pages)]
+    with patch.object(project0, "matchincidentline", wraps=project0.matchincidentline) as match:
+        rows = list(project0.iterincidentrows(pages))
+    assert rows == regex_rows(pages)
+    # The regex only runs on the first record of every page
+    assert match.call_count == len(pages)
@@ -0,0 +1,117 @@
+import os
+import pytest
+from unittest.mock import patch
+from django.urls import reverse
+from scripts import project0
+from scripts.rendercache import HASHED_NAME, RenderCache, database_fingerprint
+from webapp import tasks
+
+
+ROWS = [
+    ["12/5/2024 / 0:14", "2024-00087970", "1000 ALAMEDA ST", "Traffic Stop", "OK0140200"],
+    ["12/5/2024 / 0:25", "2024-00018488", "1310 ALAMEDA ST", "Sick Person", "14005"],
+    ["12/5/2024 / 13:25", "2024-00023878", "1000 ALAMEDA ST", "Sick Person", "EMSSTAT"],
+    ["12/5/2024 / 15:02", "2024-00023879", "900 MAIN ST", "Larceny", "OK0140200"],
+]
+
+
+@pytest.fixture
+def typed_db(tmp_path):
+    db_path = project0.createdb(str(tmp_path / "normanpd.db"))
+    project0.populatedb(db_path, ROWS[:3])
+    return db_path
+
+
+@pytest.fixture
+def media_root(tmp_path, settings):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    settings.MEDIA_URL = "/media/"
+    return settings.MEDIA_ROOT
+
+
+def test_cluster_job_reuses_renders_until_data_changes(typed_db, media_root):
+    """
+    Test that an unchanged database is served from the render cache and new rows trigger a re-render.
+    """
+    first = tasks.cluster_job({"db_path": typed_db, "n_clusters": 2})
+    assert not first["cached"]
+    for url in first["visualizations"].values():
+        assert HASHED_NAME.match(os.path.basename(url))
+        assert os.path.exists(os.path.join(media_root, os.path.basename(url)))
+
+    with patch("webapp.tasks.ClusteringPipeline") as pipeline:
+        second = tasks.cluster_job({"db_path": typed_db, "n_clusters": 2})
+    pipeline.assert_not_called()
+    assert second["cached"] and second["visualizations"] == first["visualizations"]
+
+    fingerprint = database_fingerprint(typed_db)
+    project0.populatedb(typed_db, ROWS[3:])
+    assert database_fingerprint(typed_db) != fingerprint
+    third = tasks.cluster_job({"db_path": typed_db, "n_clusters": 2})
+    assert not third["cached"]
+    assert third["visualizations"]["Comparison_Plot"] != first["visualizations"]["Comparison_Plot"]
+
+
+def test_database_fingerprint_follows_updates_and_resets(typed_db):
+    """
+    Test that the fingerprint changes on an update, a delete and a re-created database with the same rows.
+    """
+    import sqlite3
+    fingerprints = [database_fingerprint(typed_db)]
+    with sqlite3.connect(typed_db) as con:
+        con.execute("UPDATE incidents SET incident_hour = 7 WHERE id = 1")
+    fingerprints.append(database_fingerprint(typed_db))
+    with sqlite3.connect(typed_db) as con:
+        con.execute("DELETE FROM incidents WHERE id = 2")
+    fingerprints.append(database_fingerprint(typed_db))
+    project0.createdb(typed_db)
+    project0.populatedb(typed_db, ROWS[:3])
+    fingerprints.append(database_fingerprint(typed_db))
+    assert len(set(fingerprints)) == 4
+
+
+def test_render_cache_misses_when_png_is_gone(tmp_path):
+    """
+    Test that a manifest whose png was deleted is treated as a miss.
+    """
+    cache = RenderCache(str(tmp_path), "/media/")
+    png = tmp_path / "heatmap.0123456789abcdef.png"
+    png.write_bytes(b"png")
+    key = RenderCache.key("fingerprint", n_clusters=3)
+    cache.put(key, {"Heatmap": "/media/heatmap.0123456789abcdef.png"}, run_id=1)
+
+    assert cache.get(key)["run_id"] == 1
+    assert cache.get(RenderCache.key("fingerprint", n_clusters=4)) is None
+    png.unlink()
+    assert cache.get(key) is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "entries": 1}
+
+
+def test_hashed_media_is_cached_long(rf, media_root):
+    """
+    Test that content-hashed plots get long-lived cache headers and other media does not.
+    """
+    from webapp.views import media_file
+    os.makedirs(media_root)
+    for name in ["heatmap.0123456789abcdef.png", "heatmap.png"]:
+        with open(os.path.join(media_root, name), "wb") as png_file:
+            png_file.write(b"png")
+
+    response = media_file(rf.get("/media/heatmap.0123456789abcdef.png"), "heatmap.0123456789abcdef.png")
+    assert response.status_code == 200
+    assert response["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert media_file(rf.get("/media/heatmap.png"), "heatmap.png")["Cache-Control"] == "no-cache"
+
+
+def test_media_is_only_routed_in_debug():
+    """
+    Test that Django serves MEDIA_ROOT only when DEBUG is on.
+    """
+    import importlib
+    from django.test import override_settings
+    from webapp import urls
+    for debug in (False, True):
+        with override_settings(DEBUG=debug):
+            names = [pattern.name for pattern in importlib.reload(urls).urlpatterns]
+        assert ("media_file" in names) == debug
+    importlib.reload(urls)
@@ -0,0 +1,105 @@
+import os
+import shutil
+import sqlite3
+import pandas as pd
+from scripts import project0, snapshot
+from scripts.clustering import preprocess_features
+
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "scripts", "resources", "DailyIncidentSummary.pdf")
+
+
+def sql_features(db_path, sparse):
+    """Run preprocess_features with the snapshot hidden, so it reads SQLite."""
+    directory = snapshot.snapshot_dir(db_path)
+    os.rename(directory, directory + ".hidden")
+    try:
+        return preprocess_features(db_path, sparse=sparse)
+    finally:
+        os.rename(directory + ".hidden", directory)
+
+
+def test_snapshot_matches_sql_and_follows_appends(tmp_path):
+    """
+    Test that features loaded from the snapshot equal the SQL path, after a build, an append and a rebuild.
+    """
+    db = project0.createdb(str(tmp_path / "normanpd.db"))
+    incidents = project0.extractincidents(open(SAMPLE_PDF, "rb").read())
+    project0.populatedb(db, incidents[:250])
+    assert snapshot.load_incidents(db) is None
+    assert snapshot.update_snapshot(db)["rows"] == 250
+
+    df = snapshot.load_incidents(db)
+    assert isinstance(df["nature"].dtype, pd.CategoricalDtype)
+    with sqlite3.connect(db) as con:
+        assert df["nature"].astype(str).tolist() == [row[0] for row in con.execute("SELECT nature FROM incidents ORDER BY id")]
+        assert df["incident_hour"].tolist() == [row[0] for row in con.execute("SELECT incident_hour FROM incidents ORDER BY id")]
+
+    # New rows bring new categories, so the stored codes are remapped
+    project0.populatedb(db, incidents)
+    assert snapshot.load_incidents(db) is None
+    manifest = snapshot.update_snapshot(db)
+    assert manifest["rows"] == 387 and manifest["generation"] == 2
+    for sparse in (False, True):
+        _, numeric, _ = preprocess_features(db, sparse=sparse)
+        _, expected, _ = sql_features(db, sparse)
+        if sparse:
+            assert (numeric != expected).nnz == 0
+        else:
+            assert list(numeric.columns) == list(expected.columns)
+            assert (numeric.to_numpy() == expected.to_numpy()).all()
+
+    # Deleting rows the snapshot holds forces a rebuild
+    with sqlite3.connect(db) as con:
+        con.execute("DELETE FROM incidents WHERE id % 3 = 0")
+    assert snapshot.update_snapshot(db)["rows"] == 258
+    assert preprocess_features(db, sparse=True)[0].index.tolist() == sql_features(db, True)[0].index.tolist()
+    files = os.listdir(snapshot.snapshot_dir(db))
+    assert "manifest.json" in files and all(name.endswith(".3.npy") for name in files if name != "manifest.json")
+
+
+def test_snapshot_is_not_reused_after_reset(tmp_path):
+    """
+    Test that re-creating the database drops its snapshot, and that a snapshot of another database is never loaded.
+    """
+    db = project0.createdb(str(tmp_path / "normanpd.db"))
+    incidents = project0.extractincidents(open(SAMPLE_PDF, "rb").read())
+    project0.populatedb(db, incidents[:200])
+    snapshot.update_snapshot(db)
+    old_snapshot = str(tmp_path / "old.snapshot")
+    shutil.copytree(snapshot.snapshot_dir(db), old_snapshot)
+
+    # The new report has more rows, so row count and highest rowid alone would match after the next check
+    project0.createdb(db)
+    assert not os.path.exists(snapshot.snapshot_dir(db))
+    project0.populatedb(db, incidents[187:])
+    shutil.copytree(old_snapshot, snapshot.snapshot_dir(db))
+    with sqlite3.connect(db) as con:
+        assert con.execute("SELECT COUNT(*), MAX(rowid) FROM incidents").fetchone() == (200, 200)
+        expected = [row[0] for row in con.execute("SELECT nature FROM incidents ORDER BY id")]
+    assert snapshot.load_incidents(db) is None
+
+    assert snapshot.update_snapshot(db)["generation"] == 2
+    assert snapshot.load_incidents(db)["nature"].astype(str).tolist() == expected
+
+
+def test_partition_keys_name_the_database(tmp_path):
+    """
+    Test that identical incidents in a re-created database get other partition keys and recounted day partials.
+    """
+    from scripts import metrics
+    db = project0.createdb(str(tmp_path / "normanpd.db"))
+    incidents = project0.extractincidents(open(SAMPLE_PDF, "rb").read())
+    project0.populatedb(db, incidents)
+    snapshot.update_snapshot(db)
+    listed, key = snapshot.partitions(db)
+    snapshot.partition_counts(db)
+
+    project0.createdb(db)
+    project0.populatedb(db, incidents)
+    snapshot.update_snapshot(db)
+    metrics.reset()
+    assert snapshot.partitions(db)[0] == listed and snapshot.partitions(db)[1] != key
+    snapshot.partition_counts(db)
+    assert "snapshot.partition_hits" not in metrics.snapshot()["counters"]
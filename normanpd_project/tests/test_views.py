@@ -1,8 +1,10 @@
+import os
 import pytest
 from django.urls import reverse
 import sqlite3
 import pandas as pd
-from unittest.mock import patch, Mock
+from unittest.mock import patch
+from scripts import jobs
 
 
 @pytest.fixture
@@ -28,24 +30,141 @@ def setup_media_root(tmp_path):
     return media_root
 
 
-def test_upload_files(client):
+@pytest.fixture(autouse=True)
+def jobs_db(tmp_path, settings):
+    """Point the job queue at a temporary database."""
+    settings.JOBS_DB = str(tmp_path / "jobs.db")
+    return settings.JOBS_DB
+
+
+def test_upload_files(client, jobs_db):
     """Test file upload with a valid URL."""
-    with patch("subprocess.run", return_value=Mock(returncode=0)):
-        response = client.post(reverse("upload_files"), data={"url": "https://example.com/incident.pdf"})
+    response = client.post(reverse("upload_files"), data={"url": "https://example.com/incident.pdf"})
     assert response.status_code == 200
     assert "successfully uploaded" in response.content.decode().lower()
 
+    with patch("webapp.tasks.ingest", return_value={"rows": 1, "natures": {"Traffic Stop": 1}}) as ingest:
+        assert jobs.run_pending(jobs_db) == [response.context["job_id"]]
+    assert ingest.call_args.args[0] == "https://example.com/incident.pdf"
+    job = jobs.get_job(jobs_db, response.context["job_id"])
+    assert job["status"] == "done" and job["result"]["rows"] == 1
+
 
-def test_process_files(client, temp_db_path, setup_media_root):
+def test_process_files(client, temp_db_path, setup_media_root, jobs_db, settings):
     """Test that clustering and visualizations are generated."""
-    with patch("scripts.clustering.add_clusters_to_database"), \
-         patch("scripts.clustering.generate_cluster_plot_with_pca", return_value="pca_cluster_plot.png"), \
-         patch("scripts.clustering.generate_comparison_plot", return_value="comparison_plot.png"), \
-         patch("scripts.clustering.generate_heatmap", return_value="heatmap.png"):
-        response = client.get(reverse("process_files"))
+    settings.MEDIA_ROOT = str(setup_media_root)
+    response = client.get(reverse("process_files"))
+    assert response.status_code == 200
+    job_id = response.context["job_id"]
+    assert client.get(reverse("job_status", args=[job_id])).json()["status"] == "queued"
+
+    with patch("webapp.tasks.default_db_path", return_value=str(temp_db_path)), \
+         patch("webapp.tasks.choose_k", return_value={"k": 3, "elbow_k": 3, "stopped_early": True, "scores": [
+             {"k": 2, "inertia": 9.0, "silhouette": 0.41}, {"k": 3, "inertia": 4.0, "silhouette": 0.57}]}), \
+         patch("webapp.tasks.ClusteringPipeline"), \
+         patch("webapp.tasks.add_clusters_to_database", return_value=1), \
+         patch("webapp.tasks.generate_cluster_plot_with_pca", return_value="pca_cluster_plot.png"), \
+         patch("webapp.tasks.generate_comparison_plot", return_value="comparison_plot.png"), \
+         patch("webapp.tasks.generate_heatmap", return_value="heatmap.png"):
+        jobs.run_pending(jobs_db)
 
+    response = client.get(reverse("job_result", args=[job_id]))
     assert response.status_code == 200
     content = response.content.decode().lower()
     assert "pca_cluster_plot.png" in content
     assert "comparison_plot.png" in content
     assert "heatmap.png" in content
+    assert "chose k = 3" in content and "0.570" in content
+
+
+def test_job_metrics(client, jobs_db):
+    """Test the queue depth and latency metrics endpoint."""
+    jobs.enqueue(jobs_db, "webapp.tasks.ingest_job", {"url": "https://example.com/incident.pdf"})
+    jobs.enqueue(jobs_db, "webapp.tasks.no_such_job", {})
+    metrics = client.get(reverse("job_metrics")).json()
+    assert metrics["queue_depth"] == 2
+
+    with patch("webapp.tasks.ingest", return_value={"rows": 0}):
+        jobs.run_pending(jobs_db)
+    metrics = client.get(reverse("job_metrics")).json()
+    assert metrics["queue_depth"] == 0
+    assert metrics["done"] == 1 and metrics["failed"] == 1
+    assert metrics["run_s"]["mean"] is not None
+
+
+def test_pipeline_metrics_and_profiles(client, jobs_db, tmp_path, settings):
+    """Test that job stage metrics reach /metrics/ and that ?profile= writes request and job reports."""
+    settings.PROFILE_REQUESTS = True
+    response = client.get(reverse("job_metrics") + "?profile=tracemalloc")
+    assert (tmp_path / "profiles" / response["X-Profile"]).exists()
+
+    sample = str(settings.BASE_DIR / "scripts" / "resources" / "DailyIncidentSummary.pdf")
+    jobs.enqueue(jobs_db, "webapp.tasks.ingest_job", {"url": sample, "profile": "cprofile"})
+    with patch("webapp.tasks.default_db_path", return_value=str(tmp_path / "normanpd.db")):
+        job_id, = jobs.run_pending(jobs_db)
+    assert (tmp_path / "profiles" / f"job-{job_id}.prof").exists()
+
+    ingest = client.get(reverse("pipeline_metrics")).json()["jobs"]["webapp.tasks.ingest_job"]
+    assert ingest["jobs"] == 1
+    assert ingest["counters"]["parse.rows"] == ingest["counters"]["load.rows"] == 387
+    assert ingest["counters"]["fetch.bytes"] == os.path.getsize(sample)
+    assert {"fetch", "extract", "extract.layout", "job"} <= set(ingest["timings"])
+    for window in ("abc", "0", "-5"):
+        assert client.get(reverse("pipeline_metrics") + f"?window={window}").status_code == 404
+
+
+def test_client_render_and_data_api(client, jobs_db, tmp_path, settings):
+    """Test that ?render=client skips the pngs and the data API serves gzip, ETag-cached columnar payloads."""
+    import gzip
+    import json
+    from scripts import project0
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    db_path = project0.createdb(str(tmp_path / "normanpd.db"))
+    sample = str(settings.BASE_DIR / "scripts" / "resources" / "DailyIncidentSummary.pdf")
+    project0.populatedb(db_path, project0.iterincidents(sample))
+
+    job_id = client.get(reverse("process_files") + "?k=3&render=client").context["job_id"]
+    with patch("webapp.tasks.default_db_path", return_value=db_path), \
+         patch("webapp.tasks.generate_heatmap") as generate_heatmap:
+        jobs.run_pending(jobs_db)
+        result = jobs.get_job(jobs_db, job_id)["result"]
+        assert result["visualizations"] == {} and result["run_id"] == 1
+        generate_heatmap.assert_not_called()
+        assert "api/clusters/points/" in client.get(reverse("job_result", args=[job_id])).content.decode()
+
+        response = client.get(reverse("api_cluster_points") + "?max_points=50", HTTP_ACCEPT_ENCODING="gzip")
+        assert response["Content-Encoding"] == "gzip"
+        points = json.loads(gzip.decompress(response.content))
+        assert points["total"] == 387 and len(points["x"]) == len(points["cluster"]) == 50
+        assert len(points["centroids"]["x"]) == 3
+
+        sizes = client.get(reverse("api_cluster_sizes")).json()
+        assert sizes["cluster"] == [0, 1, 2] and sum(sizes["count"]) == 387
+
+        heatmap = client.get(reverse("api_heatmap") + "?top_n=5")
+        data = heatmap.json()
+        assert len(data["counts"]) == len(data["hours"]) * len(data["locations"]) and sum(data["counts"]) == 387
+        assert client.get(reverse("api_heatmap") + "?top_n=5", HTTP_IF_NONE_MATCH=heatmap["ETag"]).status_code == 304
+        assert client.get(reverse("api_heatmap") + "?top_n=6", HTTP_IF_NONE_MATCH=heatmap["ETag"]).status_code == 200
+
+        etag = response["ETag"]
+        project0.populatedb(db_path, [["12/6/2024 / 1:02", "2024-00088230", "622 RANCHO DR", "Traffic Stop", "EMSSTAT"]])
+        assert client.get(reverse("api_heatmap") + "?top_n=5", HTTP_IF_NONE_MATCH=heatmap["ETag"]).status_code == 200
+        assert client.get(reverse("api_cluster_points") + "?max_points=50",
+                          HTTP_IF_NONE_MATCH=etag).status_code == 304
+        assert client.get(reverse("api_cluster_sizes") + "?run=9").status_code == 404
+
+
+def test_payload_etags_change_with_a_recreated_database(tmp_path):
+    """Test that a re-created database with the same run id and counts gets new cluster and heatmap ETags."""
+    from scripts import payloads, project0
+    from scripts.clustering import save_cluster_labels
+    rows = [["12/5/2024 / 0:14", "2024-00087970", "1000 ALAMEDA ST", "Traffic Stop", "OK0140200"],
+            ["12/5/2024 / 13:25", "2024-00023878", "900 MAIN ST", "Sick Person", "EMSSTAT"]]
+    versions = []
+    for _ in range(2):
+        db_path = project0.createdb(str(tmp_path / "normanpd.db"))
+        project0.populatedb(db_path, rows)
+        assert save_cluster_labels(db_path, [1, 2], [0, 1], n_clusters=2) == 1
+        versions.append((payloads.cluster_version(db_path), payloads.heatmap_version(db_path)))
+    assert versions[0][0] != versions[1][0] and versions[0][1] != versions[1][1]
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from scripts.project0 import checkaggregates
+from webapp.tasks import default_db_path
+
+
+class Command(BaseCommand):
+    help = "Check the precomputed count tables against the incidents and optionally rebuild them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--db", default=None, help="Incidents database (default: the one /process/ uses).")
+        parser.add_argument("--repair", action="store_true", help="Rebuild the aggregates if any count differs.")
+
+    def handle(self, *args, **options):
+        db_path = options["db"] or default_db_path()
+        mismatches = checkaggregates(db_path, repair=options["repair"])
+        for table, mismatched in mismatches.items():
+            self.stdout.write(f"{table}|{mismatched} mismatched groups")
+        if any(mismatches.values()):
+            self.stdout.write("Rebuilt the aggregates." if options["repair"] else "Run with --repair to rebuild them.")
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from scripts import jobs
+from webapp.tasks import init_worker
+
+
+class Command(BaseCommand):
+    help = "Run the ingest and clustering job workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=settings.JOB_WORKERS,
+                            help="Number of worker processes.")
+        parser.add_argument("--poll-interval", type=float, default=0.5,
+                            help="Seconds between queue polls when idle.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Running jobs from {settings.JOBS_DB} on {options['processes']} processes")
+        jobs.run_worker(
+            settings.JOBS_DB,
+            processes=options["processes"],
+            poll_interval=options["poll_interval"],
+            initializer=init_worker,
+        )
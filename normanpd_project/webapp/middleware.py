@@ -0,0 +1,45 @@
+import contextlib
+import os
+import time
+from django.conf import settings
+from scripts import jobs, metrics
+
+
+def requested_profile(request):
+    """
+    Return the profile mode asked for with `?profile=cprofile|tracemalloc`, or None when profiling is off.
+    """
+    mode = request.GET.get('profile')
+    if settings.PROFILE_REQUESTS and mode in metrics.PROFILE_MODES:
+        return mode
+    return None
+
+
+class RequestMetricsMiddleware:
+    """
+    Time every request as the `request.<url name>` stage and profile it when asked.
+
+    With settings.PROFILE_REQUESTS on, `?profile=cprofile` or
+    `?profile=tracemalloc` writes a report of the request to the profiles
+    directory next to JOBS_DB and names it in the `X-Profile` header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = requested_profile(request)
+        if mode:
+            capture = metrics.profiled(mode, jobs.profile_dir(settings.JOBS_DB), f"request-{time.time_ns()}")
+        else:
+            capture = contextlib.nullcontext()
+
+        start = time.perf_counter()
+        with capture as report:
+            response = self.get_response(request)
+        match = request.resolver_match
+        metrics.record(f"request.{match.url_name if match else 'unresolved'}", (time.perf_counter() - start) * 1000)
+
+        if report is not None:
+            response['X-Profile'] = os.path.basename(report['path'])
+        return response
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import sqlite3
+import django
+from django.conf import settings
+from scripts import snapshot
+from scripts.ingest import ingest
+from scripts.parsecache import ParseCache
+from scripts.rendercache import RenderCache, database_fingerprint
+from scripts.kselect import choose_k
+from scripts.project0 import migratedb
+from scripts.clustering import (
+    ClusteringPipeline,
+    add_clusters_to_database,
+    last_days,
+    latest_cluster_run,
+    window_days,
+    generate_cluster_plot_with_pca,
+    generate_comparison_plot,
+    generate_heatmap,
+)
+
+
+def default_db_path():
+    """
+    Path of the incidents database written by `scripts/main.py`.
+    """
+    return os.path.join(settings.BASE_DIR, 'scripts', 'resources', 'normanpd.db')
+
+
+def window_fingerprint(db_path, window):
+    """
+    Fingerprint of the incidents a clustering job reads: its window's day partitions, or the whole table.
+
+    A window's partitions only change when incidents of those days are added,
+    so the cached renders of a fixed window survive ingests of other days. The
+    snapshot's `codes_key` names the database, so a re-created database with
+    the same day sizes gets another fingerprint.
+    """
+    listed = snapshot.partitions(db_path, *window_days(window)) if window else None
+    if listed is None:
+        return database_fingerprint(db_path)
+    return hashlib.sha256(json.dumps(listed).encode()).hexdigest()
+
+
+def init_worker():
+    """
+    Set up Django once per worker process. pypdf, pandas and scikit-learn are
+    already loaded by this module's imports, so every job runs warm.
+    """
+    django.setup()
+
+
+def ingest_job(payload):
+    """
+    Job: download and load the submitted URL in-process and return the structured ingest result.
+    """
+    resources = os.path.dirname(default_db_path())
+    cache = ParseCache(os.path.join(resources, 'parse_cache'))
+    return ingest(payload["url"], db_path=default_db_path(), cache=cache)
+
+
+def cluster_job(payload):
+    """
+    Job: cluster the incidents and render the three visualizations.
+
+    With `n_clusters` set to "auto" the number of clusters is chosen by
+    `choose_k` first. Renders are cached by a fingerprint of the incidents and
+    the clustering parameters, so when neither changed since the last run (and
+    its labels are still the newest run) the stored pngs are returned without
+    refitting. With `render` set to "client" no pngs are drawn: the labels and
+    PCA coordinates are stored and the page draws them from the data API.
+    `projection` (default settings.PCA_PROJECTION) picks the PCA solver.
+    `window` ([start, end] ISO dates) or `days` (the most recent N days of
+    incidents) limits clustering and every plot to that range; each window is
+    cached under its own key.
+    """
+    db_path = payload.get("db_path") or default_db_path()
+    n_clusters = payload.get("n_clusters", 3)
+    render_mode = payload.get("render", "png")
+    projection = payload.get("projection", settings.PCA_PROJECTION)
+    max_points = settings.SCATTER_MAX_POINTS
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+    # Upgrade databases created before the typed schema
+    migratedb(db_path)
+    window = tuple(payload["window"]) if payload.get("window") else None
+    if payload.get("days"):
+        window = last_days(db_path, payload["days"])
+    fingerprint = window_fingerprint(db_path, window)
+
+    k_selection = pipeline = None
+    if n_clusters == "auto":
+        # The k search and the final fit share one preprocessed matrix
+        pipeline = ClusteringPipeline(db_path, n_clusters=None, sparse=True, projection=projection, window=window)
+        k_min, k_max = settings.CLUSTER_K_RANGE
+        k_selection = choose_k(db_path, fingerprint, k_min=k_min, k_max=k_max, processes=settings.JOB_WORKERS,
+                               window=window, pipeline=pipeline)
+        n_clusters = pipeline.n_clusters = k_selection['k']
+
+    cache = RenderCache(settings.MEDIA_ROOT, settings.MEDIA_URL)
+    key = cache.key(fingerprint, n_clusters=n_clusters, sparse=True, max_points=max_points, render=render_mode,
+                    projection=projection, window=list(window) if window else None)
+    cached = cache.get(key)
+    if cached is not None:
+        with sqlite3.connect(db_path) as conn:
+            if cached['run_id'] == latest_cluster_run(conn):
+                return {"visualizations": cached['visualizations'], "n_clusters": n_clusters,
+                        "k_selection": k_selection, "run_id": cached['run_id'], "window": window, "cached": True}
+
+    # Fit the clustering pipeline once and share it across all outputs
+    if pipeline is None:
+        pipeline = ClusteringPipeline(db_path, n_clusters=n_clusters, sparse=True, projection=projection, window=window)
+    pipeline.run()
+
+    # Process database and generate visualizations
+    run_id = add_clusters_to_database(db_path, n_clusters=n_clusters, pipeline=pipeline)
+    visualizations = {}
+    if render_mode == "png":
+        visualizations = {
+            'Cluster_Plot_with_PCA': generate_cluster_plot_with_pca(db_path, n_clusters=n_clusters, pipeline=pipeline,
+                                                                    max_points=max_points),
+            'Comparison_Plot': generate_comparison_plot(db_path, pipeline=pipeline),
+            'Heatmap': generate_heatmap(db_path, pipeline=pipeline, window=window),
+        }
+    cache.put(key, visualizations, run_id=run_id)
+    return {"visualizations": visualizations, "n_clusters": n_clusters, "k_selection": k_selection,
+            "run_id": run_id, "window": window, "cached": False}
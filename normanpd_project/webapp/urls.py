@@ -1,12 +1,19 @@
 from django.urls import path
 from webapp import views
 from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('', views.upload_files, name='upload_files'),
     path('process/', views.process_files, name='process_files'),
+    path('metrics/', views.pipeline_metrics, name='pipeline_metrics'),
+    path('api/clusters/points/', views.api_cluster_points, name='api_cluster_points'),
+    path('api/clusters/sizes/', views.api_cluster_sizes, name='api_cluster_sizes'),
+    path('api/heatmap/', views.api_heatmap, name='api_heatmap'),
+    path('jobs/metrics/', views.job_metrics, name='job_metrics'),
+    path('jobs/<int:job_id>/', views.job_result, name='job_result'),
+    path('jobs/<int:job_id>/status/', views.job_status, name='job_status'),
 ]
 
+# Django only serves media while developing; in production the web server serves MEDIA_ROOT
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    urlpatterns.append(path(settings.MEDIA_URL.strip('/') + '/<path:path>', views.media_file, name='media_file'))
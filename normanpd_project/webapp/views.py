@@ -1,61 +1,42 @@
 import os
-import sys
-import subprocess
-from django.shortcuts import render, redirect
+from datetime import date
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
 from django.conf import settings
-from scripts.project0 import createdb
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+from django.views.static import serve
+from scripts import jobs, metrics, payloads
+from scripts.clustering import HEATMAP_TOP_N
+from scripts.rendercache import HASHED_NAME
+from webapp import tasks
 from .forms import UploadFileForm
-from .models import UploadedFile
-from scripts.clustering import (
-    add_clusters_to_database,
-    generate_cluster_plot_with_pca,
-    generate_comparison_plot,
-    generate_heatmap,
-)
+from .middleware import requested_profile
+
+
+def job_payload(request, payload):
+    """
+    Add the profile mode requested with `?profile=` to a job payload, so the job is profiled too.
+    """
+    mode = requested_profile(request)
+    if mode:
+        payload['profile'] = mode
+    return payload
+
 
 def upload_files(request):
     """
-    View to process the input URL, pass it to `main.py`, and generate a CSV output.
+    View to queue the input URL for ingestion by `main.py`.
     """
-    # Output CSV file path
-    output_file = os.path.join(settings.MEDIA_ROOT, "incident_output.csv")
-    
     if request.method == "POST":
         form = UploadFileForm(request.POST)
         if form.is_valid():
             url = form.cleaned_data["url"]
 
             try:
-                # Full path to the Python executable
-                python_executable = sys.executable
-
-                # Run the `main.py` script with the provided URL
-                cwd = os.path.join(settings.BASE_DIR, "scripts")
-                print(f"Resolved CWD: {cwd}")
-                print(f"Path Exists: {os.path.exists(cwd)}")
-                print(f"Directory Contents: {os.listdir(cwd) if os.path.exists(cwd) else 'Not Found'}")
-
-
-                result = subprocess.run(
-                    [python_executable, "main.py", "--incidents", url],
-                    capture_output=True,
-                    text=True,
-                    cwd=os.path.join(settings.BASE_DIR, "scripts"),  # Ensure `main.py` is in the `scripts` folder
-                )
-
-                # Check if the script ran successfully
-                if result.returncode != 0:
-                    raise Exception(result.stderr)
-
-                # Export data from the SQLite database to a CSV file
-                db_path = os.path.abspath(os.path.join(os.getcwd(), "media/normanpd.db"))
-
-                # Render the success page with a link to the output CSV
-                return render(
-                    request,
-                    "webapp/success.html",
-                    {"url": url, "output_file": os.path.join(settings.MEDIA_URL, "incident_output.csv")},
-                )
+                # Hand the download and parsing to the job workers and answer right away
+                job_id = jobs.enqueue(settings.JOBS_DB, "webapp.tasks.ingest_job", job_payload(request, {"url": url}))
+                return render(request, "webapp/success.html", {"url": url, "job_id": job_id})
             except Exception as e:
                 # Render the error page with the exception message
                 return render(request, "webapp/error.html", {"error": str(e)})
@@ -68,23 +49,221 @@ def upload_files(request):
 
 
 def process_files(request):
-    try:
-        db_path = os.path.join(settings.BASE_DIR, 'scripts', 'resources', 'normanpd.db')
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-
-        # Process database and generate visualizations
-        add_clusters_to_database(db_path, n_clusters=3)
-        visualizations = {
-            'Cluster_Plot_with_PCA': generate_cluster_plot_with_pca(db_path, n_clusters=3),
-            'Comparison_Plot': generate_comparison_plot(db_path),
-            'Heatmap': generate_heatmap(db_path),
-        }
-
-        # Debug print for paths
-        print("Visualizations:", visualizations)
+    """
+    View to queue clustering and visualization, returning a page that polls for the result.
 
-        return render(request, 'webapp/visualizations.html', {'visualizations': visualizations})
+    `?k=<number>` fixes the number of clusters; otherwise settings.N_CLUSTERS is used.
+    `?render=client` (or settings.RENDER_MODE) skips the server-side pngs and
+    lets the result page draw the data API payloads in the browser.
+    `?days=<n>` limits clustering and the plots to the most recent n days of
+    incidents, and `?start=`/`?end=` (ISO dates, either may be left out) to a
+    fixed range.
+    """
+    try:
+        n_clusters = request.GET.get("k") or settings.N_CLUSTERS
+        if n_clusters != "auto":
+            n_clusters = int(n_clusters)
+        render_mode = request.GET.get("render") or settings.RENDER_MODE
+        if render_mode not in ("png", "client"):
+            raise ValueError(f"Unknown render mode {render_mode!r}")
+        payload = {"n_clusters": n_clusters, "render": render_mode}
+        if request.GET.get("days"):
+            payload["days"] = int(request.GET["days"])
+            if payload["days"] < 1:
+                raise ValueError("days must be at least 1")
+        elif request.GET.get("start") or request.GET.get("end"):
+            # Validate the dates here so a bad range fails before a job is queued
+            payload["window"] = [date.fromisoformat(request.GET[name]).isoformat() if request.GET.get(name) else None
+                                 for name in ("start", "end")]
+        job_id = jobs.enqueue(settings.JOBS_DB, "webapp.tasks.cluster_job", job_payload(request, payload))
+        return render(request, 'webapp/job.html', {'job_id': job_id, 'status': 'queued'})
 
     except Exception as e:
         print(f"Error processing files: {e}")
         return render(request, 'webapp/home.html', {"error": f"Error: {e}"})
+
+
+def job_status(request, job_id):
+    """
+    JSON status of a job for the polling templates.
+    """
+    job = jobs.get_job(settings.JOBS_DB, job_id)
+    if job is None:
+        raise Http404("Unknown job")
+    return JsonResponse({
+        'id': job['id'],
+        'status': job['status'],
+        'result': job['result'],
+        'error': job['error'].splitlines()[0] if job['error'] else None,
+    })
+
+
+def job_result(request, job_id):
+    """
+    Show the visualizations of a finished clustering job, or the polling page while it runs.
+    """
+    job = jobs.get_job(settings.JOBS_DB, job_id)
+    if job is None:
+        raise Http404("Unknown job")
+    if job['status'] == 'failed':
+        return render(request, 'webapp/error.html', {'error': job['error'].splitlines()[0]})
+    if job['status'] != 'done':
+        return render(request, 'webapp/job.html', {'job_id': job_id, 'status': job['status']})
+    return render(request, 'webapp/visualizations.html', {
+        'visualizations': job['result']['visualizations'],
+        'n_clusters': job['result'].get('n_clusters'),
+        'k_selection': job['result'].get('k_selection'),
+        'run_id': job['result'].get('run_id'),
+        'window': job['result'].get('window'),
+        'max_points': payloads.API_MAX_POINTS,
+    })
+
+
+def job_metrics(request):
+    """
+    Queue depth and job latency metrics.
+    """
+    return JsonResponse(jobs.queue_metrics(settings.JOBS_DB))
+
+
+# Most recent jobs /metrics/ summarizes in one request
+METRICS_MAX_WINDOW = 10000
+
+
+def pipeline_metrics(request):
+    """
+    Per-stage timings, counters and gauges of recent jobs (by task) and of this web process's requests.
+
+    `?window=<n>` sets how many recent jobs are summarized (default 100, at most `METRICS_MAX_WINDOW`).
+    """
+    window = int_param(request, "window", 100, minimum=1, maximum=METRICS_MAX_WINDOW)
+    return JsonResponse({
+        'jobs': jobs.stage_metrics(settings.JOBS_DB, window=window),
+        'web': metrics.summarize([metrics.snapshot()]),
+        'queue': jobs.queue_metrics(settings.JOBS_DB, window=window),
+    })
+
+
+def api_db_path():
+    """
+    Incidents database served by the data API; 404 until something has been ingested.
+    """
+    db_path = tasks.default_db_path()
+    if not os.path.exists(db_path):
+        raise Http404("No incidents have been loaded")
+    return db_path
+
+
+def int_param(request, name, default=None, minimum=None, maximum=None):
+    """
+    Read an optional integer query parameter, answering 404 for values that are not integers or out of bounds.
+    """
+    value = request.GET.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise Http404(f"{name} must be an integer")
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise Http404(f"{name} must be between {minimum} and {maximum}")
+    return value
+
+
+def heatmap_params(request):
+    """
+    Read the `top_n`, `bucket` and `start`/`end` window parameters of the heatmap endpoint.
+    """
+    bucket = request.GET.get("bucket") or None
+    if bucket not in (None, "street", "block"):
+        raise Http404("bucket must be street or block")
+    window = None
+    if request.GET.get("start") or request.GET.get("end"):
+        try:
+            window = tuple(date.fromisoformat(request.GET[name]).isoformat() if request.GET.get(name) else None
+                           for name in ("start", "end"))
+        except ValueError:
+            raise Http404("start and end must be ISO dates")
+    return int_param(request, "top_n", HEATMAP_TOP_N), bucket, window
+
+
+def points_etag(request):
+    """
+    ETag of the PCA points endpoint: the run's contents and the sample size.
+    """
+    version = payloads.cluster_version(api_db_path(), int_param(request, "run"))
+    return version and payloads.etag(version, int_param(request, "max_points", payloads.API_MAX_POINTS))
+
+
+def sizes_etag(request):
+    """
+    ETag of the cluster sizes endpoint.
+    """
+    return payloads.cluster_version(api_db_path(), int_param(request, "run"))
+
+
+def heatmap_etag(request):
+    """
+    ETag of the heatmap endpoint.
+    """
+    return payloads.heatmap_version(api_db_path(), *heatmap_params(request))
+
+
+def json_payload(payload, what):
+    """
+    Answer with a payload, or 404 when the run it was asked for does not exist.
+    """
+    if payload is None:
+        raise Http404(f"No {what}")
+    response = JsonResponse(payload)
+    # Revalidate every time; an unchanged payload costs one ETag query and a 304
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@gzip_page
+@condition(etag_func=points_etag)
+def api_cluster_points(request):
+    """
+    PCA coordinates and labels of a clustering run (`?run=`, default newest) as columns.
+
+    `?max_points=` sets the sample size (default API_MAX_POINTS).
+    """
+    return json_payload(payloads.cluster_points(
+        api_db_path(), int_param(request, "run"), max_points=int_param(request, "max_points", payloads.API_MAX_POINTS),
+    ), "clustering run")
+
+
+@gzip_page
+@condition(etag_func=sizes_etag)
+def api_cluster_sizes(request):
+    """
+    Number of incidents per cluster of a run (`?run=`, default newest) as columns.
+    """
+    return json_payload(payloads.cluster_sizes(api_db_path(), int_param(request, "run")), "clustering run")
+
+
+@gzip_page
+@condition(etag_func=heatmap_etag)
+def api_heatmap(request):
+    """
+    Hour x location incident counts; `?top_n=`, `?bucket=street|block` and `?start=`/`?end=` as in `heatmap_counts`.
+    """
+    top_n, bucket, window = heatmap_params(request)
+    return json_payload(payloads.heatmap_payload(api_db_path(), top_n=top_n, bucket=bucket, window=window),
+                        "incidents")
+
+
+def media_file(request, path):
+    """
+    Serve a file from MEDIA_ROOT. Content-hashed plots never change, so browsers may cache them for a year.
+
+    Only routed when DEBUG is on; in production the web server serving
+    MEDIA_ROOT should send the same Cache-Control headers.
+    """
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if HASHED_NAME.match(os.path.basename(path)):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'no-cache'
+    return response